@@ -0,0 +1,157 @@
+# This module keeps a local SQLite copy of the cloud properties_data table, so
+# scripts that only read (nb05.py, the scoring service) do not transfer the
+# table from Supabase on every run. Freshness is checked with one small probe
+# (row count, max id and max updated_at); when the cloud has moved on, only
+# rows stamped since the cached watermark are fetched, and deletions are
+# reconciled from the id column alone. Reads then run against the local copy.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+from typing import Dict, Optional
+
+# Database Connection
+from sqlalchemy import inspect, text
+from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+
+# File and System Operations
+import time
+
+# Tracking
+import logging
+
+
+# SQL
+
+## The cloud table's state when the cache was last refreshed
+CREATE_CACHE_STATE_SQL_QUERY = """
+CREATE TABLE IF NOT EXISTS cache_state (
+    source TEXT PRIMARY KEY,
+    row_count INTEGER,
+    max_id INTEGER,
+    max_updated_at TEXT,
+    refreshed_at REAL
+);
+"""
+
+## The freshness probe: one row, answered from the primary key and the updated_at index
+PROBE_SQL_QUERY = """
+SELECT COUNT(*) AS row_count, MAX(id) AS max_id, {watermark} AS max_updated_at
+FROM properties_data
+"""
+
+
+class CloudCache:
+    """
+    A local materialised replica of a remote properties_data table.
+
+    Args:
+        remote_engine (sqlalchemy.engine.Engine): The cloud database (kept up to date by replication.replicate).
+        cache_path (str): The SQLite file holding the replica.
+        source (str): A name for the remote, so one file can cache several.
+        max_age (float): Seconds a probe stays valid; reads within it skip the probe.
+        chunksize (int): Rows fetched per chunk when refreshing.
+    """
+
+    def __init__(self, remote_engine, cache_path: str, source: str = "supabase",
+                 max_age: float = 0.0, chunksize: int = 50_000):
+        self.remote_engine = remote_engine
+        self.engine = sqlq.get_sql_engine(cache_path)
+        self.source = source
+        self.max_age = max_age
+        self.chunksize = chunksize
+        self._checked_at = None
+        self._has_watermark = False
+        with self.engine.begin() as connection:
+            connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+            connection.execute(text(CREATE_CACHE_STATE_SQL_QUERY))
+        sqlq.ensure_column(self.engine, "properties_data", "updated_at", "TEXT")
+        sqlq.ensure_indexes(self.engine)
+
+    ## Ask the remote for its current state
+    def probe(self) -> Dict[str, object]:
+        with self.remote_engine.connect() as connection:
+            # a table not yet replicated with updated_at stamps can only be compared by count and max id,
+            # and then every change means a full fetch
+            columns = {col["name"] for col in inspect(connection).get_columns("properties_data")}
+            self._has_watermark = "updated_at" in columns
+            watermark = "MAX(updated_at)" if self._has_watermark else "NULL"
+            return dict(connection.execute(text(PROBE_SQL_QUERY.format(watermark=watermark))).mappings().one())
+
+    ## The remote state recorded at the last refresh (None before the first one)
+    def state(self) -> Optional[Dict[str, object]]:
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                text("SELECT row_count, max_id, max_updated_at FROM cache_state WHERE source = :source"),
+                {"source": self.source},
+            ).mappings().first()
+        return dict(row) if row else None
+
+    ## Bring the replica up to date if the remote has changed
+    def refresh(self, force: bool = False) -> Dict[str, int]:
+        """
+        Probes the remote and, if its count, max id or max updated_at differ
+        from the last refresh, fetches the rows stamped after the cached
+        watermark (all rows on the first refresh) and deletes any ids the
+        remote no longer has.
+
+        Returns:
+            dict: Rows fetched and deleted (both 0 when the cache was fresh).
+        """
+        remote = self.probe()
+        cached = self.state()
+        self._checked_at = time.monotonic()
+        if cached == remote and not force:
+            logging.info(f'Local cache of {self.source} is fresh ({remote["row_count"]} rows)')
+            return {"fetched": 0, "deleted": 0}
+
+        # each replicated batch is stamped and committed at once, so nothing can later appear
+        # at or before a watermark that has been seen
+        since = cached["max_updated_at"] if cached and self._has_watermark and not force else None
+        query = pq.PropertyQuery(updated_after=since)
+        fetched = 0
+        for chunk in query.iter_chunks(self.remote_engine, chunksize=self.chunksize):
+            fetched += sqlq.bulk_load("properties_data", chunk, "id", self.engine, upsert=True)
+
+        deleted = 0
+        with self.engine.connect() as connection:
+            local_count = connection.execute(text("SELECT COUNT(*) FROM properties_data")).scalar()
+        if local_count != remote["row_count"]:
+            # something was deleted remotely: compare ids, which is one column rather than the table
+            remote_ids = pq.PropertyQuery(columns=["id"]).read(self.remote_engine)["id"]
+            local_ids = pq.PropertyQuery(columns=["id"]).read(self.engine)["id"]
+            gone = sorted(set(local_ids) - set(remote_ids))
+            for start in range(0, len(gone), 900):
+                batch = gone[start:start + 900]
+                params = {f"id_{i}": int(d) for i, d in enumerate(batch)}
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        text(f"DELETE FROM properties_data WHERE id IN ({', '.join(':' + p for p in params)})"),
+                        params,
+                    )
+            deleted = len(gone)
+
+        with self.engine.begin() as connection:
+            connection.execute(text("""
+                INSERT INTO cache_state (source, row_count, max_id, max_updated_at, refreshed_at)
+                VALUES (:source, :row_count, :max_id, :max_updated_at, :refreshed_at)
+                ON CONFLICT (source) DO UPDATE SET
+                    row_count = excluded.row_count,
+                    max_id = excluded.max_id,
+                    max_updated_at = excluded.max_updated_at,
+                    refreshed_at = excluded.refreshed_at
+            """), {"source": self.source, **remote, "refreshed_at": time.time()})
+        logging.info(f'Refreshed local cache of {self.source}: {fetched} rows fetched, {deleted} deleted')
+        return {"fetched": fetched, "deleted": deleted}
+
+    ## The cache engine, refreshed first unless the last probe is recent enough
+    def fresh_engine(self):
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.max_age:
+            self.refresh()
+        return self.engine
+
+    ## Run a query against the (refreshed) replica
+    def read(self, query: pq.PropertyQuery) -> pd.DataFrame:
+        return query.read(self.fresh_engine())
@@ -0,0 +1,298 @@
+# This module refreshes many towns in one go. Each town is resolved with
+# functions.find_locations and crawled with functions.scrape_search, several
+# at once on one event loop, into its own partition
+# (<data_dir>/cities/<slug>/rightmove_properties.json), so one town's scrape
+# never overwrites another's. The partitions are then cleaned (and, given
+# TravelTime credentials, sent for travel times) in a pool of worker
+# processes, one town per task, and merged into properties_data by the
+# parent, the database's only writer, with a city column holding the slug
+# of the town each listing was found under (so "St Albans" and "st albans"
+# are one town). Every crawl is also kept in the scrape archive
+# (<data_dir>/archive, see scrape_archive), and a past crawl can be re-parsed
+# into the database straight from there.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Database Connection
+from sqlalchemy import text
+from rental_utils import functions as rent
+from rental_utils import sql_queries as sqlq
+from rental_utils import instrumentation as instr
+from rental_utils import scrape_archive
+
+# Parallel Processing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# File and System Operations
+import asyncio
+import json
+import os
+import re
+import time
+
+# Tracking
+import logging
+
+
+# SETTINGS
+
+## Towns crawled at once (each already sends its result pages concurrently)
+CRAWL_CONCURRENCY = 4
+
+## The index kept on the city column (created with the column, see ensure_city_column)
+CITY_INDEX = {"idx_properties_city": "city"}
+
+
+# PARTITIONS
+
+## A file-system friendly name for a town ("St Albans" -> "st-albans")
+def city_slug(city: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", city.strip().lower()).strip("-")
+    if not slug:
+        raise ValueError(f"Not a town name: {city!r}")
+    return slug
+
+
+## Where a town's latest scrape is kept
+def partition_path(data_dir: str, city: str) -> str:
+    return os.path.join(data_dir, "cities", city_slug(city), "rightmove_properties.json")
+
+
+## Where every crawl is archived
+def archive_path(data_dir: str) -> str:
+    return os.path.join(data_dir, "archive")
+
+
+## Drop repeated towns (by slug), keeping the first spelling given
+def unique_cities(cities: Iterable[str]) -> List[str]:
+    seen = {}
+    for city in cities:
+        seen.setdefault(city_slug(city), city.strip())
+    return list(seen.values())
+
+
+# CRAWLING
+
+## Resolve one town and scrape its listings into its partition
+async def crawl_city(city: str, data_dir: str, total_results: int = 250) -> Dict[str, object]:
+    """
+    Finds the town's most likely location id, scrapes up to `total_results`
+    listings for it and writes them to `partition_path(data_dir, city)`.
+
+    Returns:
+        dict: The location id used, the number of listings and the partition path.
+    """
+    locations = await rent.find_locations(city)
+    if not locations:
+        raise ValueError(f"Rightmove knows no location called {city!r}")
+    results = await rent.scrape_search(locations[0], total_results)
+    path = partition_path(data_dir, city)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written to a temporary file first, so a failed scrape never leaves half a file behind
+    partial = path + ".partial"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+    os.replace(partial, path)
+    archived = scrape_archive.ScrapeArchive(archive_path(data_dir)).add(results, source=city_slug(city))
+    logging.info(f'{city}: {len(results)} listings from {locations[0]} saved to {path}')
+    return {"location": locations[0], "listings": len(results), "path": path, "archived": archived}
+
+
+## Crawl every town, a few at a time
+async def crawl_cities(cities: Iterable[str], data_dir: str, total_results: int = 250,
+                       concurrency: int = CRAWL_CONCURRENCY) -> Dict[str, dict]:
+    """
+    Runs `crawl_city` for each town, at most `concurrency` at once. A town that
+    fails (unknown name, a blocked or malformed response) is reported and does
+    not stop the others.
+
+    Returns:
+        dict: Per town, its crawl summary, or {"error": ...} if it failed.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def crawl(city: str) -> Tuple[str, dict]:
+        async with semaphore:
+            try:
+                return city, await crawl_city(city, data_dir, total_results)
+            except Exception as error:
+                logging.exception(f'{city}: crawl failed')
+                return city, {"error": repr(error)}
+
+    return dict(await asyncio.gather(*(crawl(city) for city in unique_cities(cities))))
+
+
+# CLEANING AND ENRICHMENT (in worker processes)
+
+## Ids that already have a travel time, set once per worker by the pool's initializer
+_KNOWN_TRAVEL_TIMES = frozenset()
+
+
+def _init_worker(known_travel_times: frozenset):
+    global _KNOWN_TRAVEL_TIMES
+    _KNOWN_TRAVEL_TIMES = known_travel_times
+
+
+## Clean one town's partition, and fetch travel times for its new listings
+def prepare_city(city: str, path: str, credentials: Optional[dict] = None,
+                 transportation_type: str = "public_transport") -> Tuple[pd.DataFrame, Dict[str, object]]:
+    """
+    Runs the nb02 cleaning on a town's partition and tags every row with the
+    town's slug. With TravelTime credentials, listings that have coordinates but no
+    known travel time are sent to the API (as nb03 does); if that request
+    fails the rows are kept without travel times, for the pipeline's
+    travel_time stage to retry.
+
+    Returns:
+        tuple: The cleaned rows, and a summary of what was done.
+    """
+    start = time.perf_counter()
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    summary: Dict[str, object] = {"listings": len(data)}
+    if not data:
+        return pd.DataFrame(columns=["id", "city"]), {**summary, "seconds": time.perf_counter() - start}
+    clean_df = rent.clean_column_names(rent.filter_df(pd.json_normalize(data, max_level=1)))
+    clean_df["city"] = city_slug(city)
+
+    if credentials is not None:
+        located = clean_df["latitude"].notna() & clean_df["longitude"].notna()
+        missing = clean_df.loc[located & ~clean_df["id"].isin(_KNOWN_TRAVEL_TIMES), ["id", "latitude", "longitude"]]
+        summary["travel_times_requested"] = len(missing)
+        if not missing.empty:
+            try:
+                results = rent.fetch_travel_times(missing, credentials, transportation_type)
+                # the API returns ids as strings, so cast back to match the scraped ids
+                results = results.astype({"id": clean_df["id"].dtype})
+                clean_df = clean_df.merge(results, on="id", how="left")
+                summary["travel_times_found"] = len(results)
+            except Exception as error:
+                logging.warning(f'{city}: travel times not fetched ({error!r})')
+                summary["travel_time_error"] = repr(error)
+    summary["seconds"] = time.perf_counter() - start
+    return clean_df, summary
+
+
+# MERGING (in the parent process)
+
+## Add the city column (and its index) to a database created before it existed
+def ensure_city_column(engine):
+    sqlq.ensure_column(engine, "properties_data", "city", "TEXT")
+    sqlq.ensure_indexes(engine, indexes=CITY_INDEX)
+
+
+## Write one town's cleaned rows into properties_data
+def merge_city(clean_df: pd.DataFrame, engine) -> Dict[str, int]:
+    """
+    Inserts the listings that are new, tags listings already in the table that
+    have no city yet, and fills in travel times that are still missing. A
+    listing that turns up under two towns keeps the first one it was stored with.
+
+    Returns:
+        dict: Rows inserted, tagged and given travel times.
+    """
+    if clean_df.empty:
+        return {"new": 0, "tagged": 0, "travel_times": 0}
+    new = sqlq.bulk_load("properties_data", clean_df, "id", engine)
+    tagged = sqlq.bulk_update("properties_data", clean_df[["id", "city"]], "id", ["city"], engine, only_null=True)
+    travel_times = 0
+    if "travel_time" in clean_df.columns:
+        timed = clean_df.loc[clean_df["travel_time"].notna(), ["id", "travel_time", "distance"]]
+        if not timed.empty:
+            travel_times = sqlq.bulk_update("properties_data", timed, "id", ["travel_time", "distance"], engine,
+                                            only_null=True)
+    return {"new": new, "tagged": tagged, "travel_times": travel_times}
+
+
+## Clean every town's partition in a process pool, merging each as it finishes
+def load_cities(cities: Iterable[str], data_dir: str, engine, workers: Optional[int] = None,
+                credentials: Optional[dict] = None,
+                transportation_type: str = "public_transport") -> Dict[str, dict]:
+    """
+    Runs `prepare_city` for every town with a partition on disk, in up to
+    `workers` processes (default: one per core), and merges each town into
+    properties_data as soon as its worker returns. Towns without a partition,
+    or whose worker fails, are reported and skipped.
+
+    Args:
+        cities (iterable): The towns to load.
+        data_dir (str): The folder holding the partitions (see partition_path).
+        engine (sqlalchemy.engine.Engine): The database to merge into.
+        workers (int): Worker processes (default os.cpu_count()).
+        credentials (dict): TravelTime credentials, to fetch travel times in the workers.
+        transportation_type (str): The TravelTime transport mode.
+
+    Returns:
+        dict: Per town, the worker's summary and the merge counts, or {"error": ...}.
+    """
+    ensure_city_column(engine)
+    results: Dict[str, dict] = {}
+    paths = {}
+    for city in unique_cities(cities):
+        path = partition_path(data_dir, city)
+        if os.path.exists(path):
+            paths[city] = path
+        else:
+            results[city] = {"error": f"no partition at {path}"}
+    if not paths:
+        return results
+
+    known = frozenset()
+    if credentials is not None:
+        with engine.connect() as connection:
+            known = frozenset(connection.execute(text(
+                "SELECT id FROM properties_data WHERE travel_time IS NOT NULL"
+            )).scalars())
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    logging.info(f'Cleaning {len(paths)} towns in {workers} worker processes')
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(known,)) as pool:
+        futures = {pool.submit(prepare_city, city, path, credentials, transportation_type): city
+                   for city, path in paths.items()}
+        for future in as_completed(futures):
+            city = futures[future]
+            try:
+                clean_df, summary = future.result()
+            except Exception as error:
+                logging.exception(f'{city}: cleaning failed')
+                results[city] = {"error": repr(error)}
+                continue
+            with instr.span("merge_city", rows=len(clean_df), city=city):
+                merged = merge_city(clean_df, engine)
+            results[city] = {**summary, **merged}
+            logging.info(f'{city}: {results[city]}')
+    return results
+
+
+## Re-parse an archived search crawl into properties_data, streaming it a chunk at a time
+def load_archived(archive: scrape_archive.ScrapeArchive, crawl_name: str, engine,
+                  chunk_size: int = 10_000) -> Dict[str, int]:
+    """
+    Cleans the listings of a past crawl as nb02 does, tagged with the town the
+    crawl was made for, and merges them into properties_data (see merge_city).
+    Only `chunk_size` listings are held in memory at once.
+
+    Returns:
+        dict: Listings read, and rows inserted, tagged and given travel times.
+    """
+    crawls = archive.crawls().set_index("crawl")
+    if crawl_name not in crawls.index:
+        raise KeyError(f"No finished crawl called {crawl_name!r} in {archive.root}")
+    if crawls.at[crawl_name, "kind"] != "search":
+        raise ValueError(f"{crawl_name} holds {crawls.at[crawl_name, 'kind']} pages, not search results")
+    city = city_slug(crawls.at[crawl_name, "source"])
+    ensure_city_column(engine)
+    totals = {"listings": 0, "new": 0, "tagged": 0, "travel_times": 0}
+    for chunk in archive.iter_crawl(crawl_name, chunk_size=chunk_size):
+        clean_df = rent.clean_column_names(rent.filter_df(pd.json_normalize(chunk, max_level=1)))
+        clean_df["city"] = city
+        merged = merge_city(clean_df, engine)
+        totals["listings"] += len(chunk)
+        for key, value in merged.items():
+            totals[key] += value
+    logging.info(f'Reloaded {crawl_name}: {totals}')
+    return totals
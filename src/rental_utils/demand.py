@@ -0,0 +1,350 @@
+# This module estimates a differentiated-products demand model for rentals in
+# the spirit of BLP (and Calder-Wang & Kim): a random-coefficients logit whose
+# mean utilities are recovered from market shares with the share-inversion
+# contraction mapping. The contraction is vectorised across all the products
+# and simulated consumers of a block of markets at once, accelerated with
+# SQUAREM, run over blocks of markets in parallel, and warm-started from the
+# previous solution for each market as the outer GMM search moves.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+# Optimisation
+from scipy.optimize import minimize
+
+# Parallel Processing
+from concurrent.futures import ProcessPoolExecutor
+from rental_utils import model_search
+from rental_utils.online_regression import make_segments
+
+# File and System Operations
+import time
+
+# Tracking
+import logging
+
+
+# MARKETS
+
+@dataclass
+class MarketBlock:
+    """
+    A block of markets padded to a common number of products, so the
+    contraction runs on dense (markets x products x consumers) arrays.
+    Padding slots have mask False and never enter shares or norms.
+    """
+    market_ids: np.ndarray
+    x: np.ndarray          # markets x products x K characteristics with random coefficients
+    log_shares: np.ndarray  # markets x products observed log shares
+    mask: np.ndarray        # markets x products, True for real products
+    rows: np.ndarray        # markets x products position of each product in the long data (-1 for padding)
+
+
+@dataclass
+class Markets:
+    """
+    Products in long format: one row per product, with its market, observed
+    share and the characteristics that get random coefficients.
+    """
+    market: np.ndarray
+    shares: np.ndarray
+    x: np.ndarray
+    blocks: List[MarketBlock] = field(default_factory=list)
+
+    ## Split the markets into padded blocks of at most `block_size` markets
+    def build_blocks(self, block_size: int = 64) -> "Markets":
+        codes, ids = pd.factorize(self.market, sort=True)
+        # grouping markets of similar size into a block wastes the least padding
+        sizes = np.bincount(codes)
+        order = np.argsort(sizes, kind="stable")
+        self.blocks = []
+        for start in range(0, len(order), block_size):
+            chosen = order[start:start + block_size]
+            width = sizes[chosen].max()
+            rows = np.full((len(chosen), width), -1)
+            for i, market in enumerate(chosen):
+                members = np.flatnonzero(codes == market)
+                rows[i, :len(members)] = members
+            mask = rows >= 0
+            safe = np.where(mask, rows, 0)
+            self.blocks.append(MarketBlock(
+                market_ids=np.asarray(ids)[chosen],
+                x=np.where(mask[:, :, None], self.x[safe], 0.0),
+                log_shares=np.where(mask, np.log(self.shares[safe]), 0.0),
+                mask=mask,
+                rows=rows,
+            ))
+        return self
+
+
+## Build markets from properties_data rows
+def markets_from_properties(df: pd.DataFrame, nonlinear: Sequence[str] = ("price_per_bed", "travel_time"),
+                            market_by: Sequence[str] = ("month",), share_col: Optional[str] = None,
+                            outside_share: float = 0.5) -> Markets:
+    """
+    Defines markets (by default one per month of firstVisibleDate) and shares.
+
+    Listings do not come with quantities, so unless `share_col` gives a share
+    (e.g. derived from how quickly listings were let) the inside share
+    1 - `outside_share` is split evenly over the listings of each market.
+    Characteristics in `nonlinear` are standardised before use.
+    """
+    market = make_segments(df, market_by).to_numpy()
+    if share_col is not None:
+        shares = df[share_col].to_numpy(dtype=float)
+    else:
+        counts = pd.Series(market).map(pd.Series(market).value_counts()).to_numpy(dtype=float)
+        shares = (1 - outside_share) / counts
+    x = df[list(nonlinear)].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    x = (x - np.nanmean(x, axis=0)) / np.nanstd(x, axis=0)
+    return Markets(market=market, shares=shares, x=np.nan_to_num(x))
+
+
+# THE CONTRACTION
+
+## Simulated market shares for every market of a block at once
+def block_shares(delta: np.ndarray, exp_mu: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Returns markets x products shares of the random-coefficients logit, given
+    mean utilities `delta` (markets x products) and exp(mu), the exponentiated
+    consumer-specific utilities (markets x products x consumers).
+    """
+    numerator = np.exp(delta)[:, :, None] * exp_mu * mask[:, :, None]
+    return (numerator / (1.0 + numerator.sum(axis=1, keepdims=True))).mean(axis=2)
+
+
+## Solve for the mean utilities of one block
+def solve_block(block: MarketBlock, sigma: np.ndarray, draws: np.ndarray, delta0: Optional[np.ndarray] = None,
+                tol: float = 1e-12, max_iter: int = 5000, accelerate: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Runs the BLP contraction delta <- delta + log(s) - log(s(delta)) to `tol`
+    (sup norm) in every market of the block.
+
+    With `accelerate`, each step is a SQUAREM step (Varadhan & Roland's S3):
+    two contraction evaluations r = F(d) - d and v = F(F(d)) - 2F(d) + d
+    give a step length alpha = -|r|/|v| per market, the extrapolation
+    d - 2 alpha r + alpha^2 v, and one more contraction to stabilise it.
+
+    Returns:
+        dict: delta (markets x products), iterations (contraction evaluations
+        per market) and converged (bool per market).
+    """
+    mask = block.mask
+    exp_mu = np.exp(block.x @ (sigma[:, None] * draws.T))
+    delta = (block.log_shares - np.log1p(-np.exp(block.log_shares).sum(axis=1, keepdims=True))
+             if delta0 is None else delta0.copy())
+    delta = np.where(mask, delta, 0.0)
+
+    active = np.arange(len(mask))
+    evaluations = np.zeros(len(mask), dtype=int)
+    m, log_shares, mu = mask, block.log_shares, exp_mu
+
+    def contract(values):
+        shares = block_shares(values, mu, m)
+        return np.where(m, values + log_shares - np.log(np.where(m, shares, 1.0)), 0.0)
+
+    for _ in range(max_iter):
+        d = delta[active]
+        if accelerate:
+            f1 = contract(d)
+            f2 = contract(f1)
+            r = f1 - d
+            v = f2 - 2 * f1 + d
+            r_norm = np.sqrt((r ** 2).sum(axis=1))
+            v_norm = np.sqrt((v ** 2).sum(axis=1))
+            alpha = -r_norm / np.where(v_norm > 0, v_norm, np.inf)
+            # alpha = -1 is the plain two-step contraction; never step less than that
+            alpha = np.minimum(alpha, -1.0)[:, None]
+            with np.errstate(over="ignore", invalid="ignore"):
+                new = contract(d - 2 * alpha * r + alpha ** 2 * v)
+            # fall back to the plain steps where the extrapolation overshot into overflow
+            bad = ~np.isfinite(new).all(axis=1)
+            new[bad] = f2[bad]
+            evaluations[active] += 3
+        else:
+            new = contract(d)
+            evaluations[active] += 1
+        change = np.abs(new - d).max(axis=1)
+        delta[active] = new
+        still = change >= tol
+        if not still.any():
+            active = active[:0]
+            break
+        if not still.all():
+            # converged markets drop out, so later steps only touch the ones still moving
+            active = active[still]
+            m, log_shares, mu = mask[active], block.log_shares[active], exp_mu[active]
+    converged = np.ones(len(mask), dtype=bool)
+    converged[active] = False
+    return {"delta": delta, "iterations": evaluations, "converged": converged}
+
+
+## Worker state: the blocks and draws are sent once, when the pool starts
+_worker_blocks = None
+_worker_draws = None
+
+def _init_worker(blocks, draws):
+    global _worker_blocks, _worker_draws
+    model_search._limit_threads()
+    _worker_blocks, _worker_draws = blocks, draws
+
+
+def _solve_blocks(indices, sigma, deltas, tol, max_iter, accelerate):
+    # one worker's share of the blocks
+    return [solve_block(_worker_blocks[i], sigma, _worker_draws, delta0, tol, max_iter, accelerate)
+            for i, delta0 in zip(indices, deltas)]
+
+
+# THE PROBLEM
+
+@dataclass
+class DemandProblem:
+    """
+    A random-coefficients logit demand problem, estimated by GMM.
+
+    Args:
+        markets (Markets): Products, their markets, shares and random-coefficient characteristics.
+        x_linear (np.ndarray): N x K1 characteristics entering mean utility (include a constant).
+        instruments (np.ndarray): N x L instruments (L >= K1 + number of sigmas).
+        n_draws (int): Simulated consumers per market.
+        block_size (int): Markets per vectorised block.
+        n_jobs (int): Worker processes for the blocks (1 runs in this process; call
+            `close`, or use the problem as a context manager, to stop them).
+    """
+    markets: Markets
+    x_linear: np.ndarray
+    instruments: np.ndarray
+    n_draws: int = 200
+    block_size: int = 64
+    n_jobs: int = 1
+    tol: float = 1e-12
+    max_iter: int = 5000
+    seed: int = 0
+    warm_start: Dict[object, np.ndarray] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.markets.build_blocks(self.block_size)
+        self.draws = np.random.default_rng(self.seed).standard_normal((self.n_draws, self.markets.x.shape[1]))
+        self.weighting = np.linalg.pinv(self.instruments.T @ self.instruments)
+        self.stats = {"solves": 0, "evaluations": 0, "seconds": 0.0}
+        self._pool = None
+
+    ## Stop the worker processes (if any were started)
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self) -> "DemandProblem":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ## Mean utilities of every product at sigma
+    def solve_delta(self, sigma, accelerate: bool = True, warm: bool = True) -> np.ndarray:
+        """
+        Inverts the shares of every market at `sigma`, starting each block from
+        its last solution when `warm` is set. Returns delta in the long order.
+        """
+        sigma = np.asarray(sigma, dtype=float)
+        blocks = self.markets.blocks
+        starts = [self.warm_start.get(i) if warm else None for i in range(len(blocks))]
+        start = time.perf_counter()
+        if self.n_jobs == 1:
+            results = [solve_block(block, sigma, self.draws, delta0, self.tol, self.max_iter, accelerate)
+                       for block, delta0 in zip(blocks, starts)]
+        else:
+            # the pool lives as long as the problem, so each solve only ships sigma and the warm starts
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.n_jobs, initializer=_init_worker,
+                                                 initargs=(blocks, self.draws))
+            chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(blocks)), min(self.n_jobs, len(blocks)))]
+            futures = [self._pool.submit(_solve_blocks, chunk, sigma, [starts[i] for i in chunk],
+                                         self.tol, self.max_iter, accelerate) for chunk in chunks]
+            results = [result for future in futures for result in future.result()]
+
+        delta = np.empty(len(self.markets.shares))
+        for i, (block, result) in enumerate(zip(blocks, results)):
+            if not result["converged"].all():
+                logging.warning(f'{(~result["converged"]).sum()} markets did not converge in block {i}')
+            self.warm_start[i] = result["delta"]
+            delta[block.rows[block.mask]] = result["delta"][block.mask]
+            self.stats["evaluations"] += int(result["iterations"].sum())
+        self.stats["solves"] += 1
+        self.stats["seconds"] += time.perf_counter() - start
+        return delta
+
+    ## Linear parameters and unobserved quality given delta (IV regression)
+    def linear_parameters(self, delta: np.ndarray):
+        xz = self.x_linear.T @ self.instruments
+        beta = np.linalg.solve(xz @ self.weighting @ xz.T, xz @ self.weighting @ (self.instruments.T @ delta))
+        return beta, delta - self.x_linear @ beta
+
+    ## The GMM objective at sigma
+    def objective(self, sigma) -> float:
+        if np.any(np.asarray(sigma) < 0):
+            # sigma and -sigma are the same model; keep the search on one side
+            return 1e10
+        _, xi = self.linear_parameters(self.solve_delta(sigma))
+        moments = self.instruments.T @ xi
+        return float(moments @ self.weighting @ moments)
+
+    ## Estimate sigma (and beta) by minimising the GMM objective
+    def estimate(self, sigma0) -> Dict[str, object]:
+        """
+        Minimises the GMM objective over sigma with Nelder-Mead; each objective
+        evaluation solves every market, warm-started from the previous sigma.
+        """
+        result = minimize(self.objective, np.asarray(sigma0, dtype=float), method="Nelder-Mead",
+                          options={"xatol": 1e-6, "fatol": 1e-10, "maxiter": 2000})
+        beta, xi = self.linear_parameters(self.solve_delta(result.x))
+        logging.info(f'Estimated sigma {result.x} after {self.stats["solves"]} share inversions '
+                     f'({self.stats["seconds"]:.1f}s in the contraction)')
+        return {"sigma": result.x, "beta": beta, "xi": xi, "objective": float(result.fun),
+                "converged": bool(result.success), **self.stats}
+
+
+## BLP instruments: each product's characteristics summed over its rivals in the market
+def rival_sums(market: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Returns N x K sums of `x` over the other products of each product's market."""
+    totals = pd.DataFrame(x).groupby(np.asarray(market)).transform("sum").to_numpy()
+    return totals - x
+
+
+# SYNTHETIC MARKETS
+
+## Simulate markets from a known model (for benchmarks and checks)
+def simulate_markets(n_markets: int, products: int, sigma=(1.0, 0.5), beta=(1.0, -1.0),
+                     n_draws: int = 200, seed: int = 0) -> Dict[str, object]:
+    """
+    Draws `n_markets` markets of `products` products each and computes their
+    exact shares under `sigma`, with mean utility x @ beta plus unobserved
+    quality. Returns the Markets, the true delta, the linear characteristics
+    [1, x], BLP instruments [1, x, x^2, rival sums of x], and the draws used.
+    """
+    rng = np.random.default_rng(seed)
+    sigma = np.asarray(sigma, dtype=float)
+    market = np.repeat(np.arange(n_markets), products)
+    x = rng.standard_normal((len(market), len(sigma)))
+    # the constant keeps the outside good's share realistic as markets grow
+    delta = -np.log(products) + x @ np.asarray(beta, dtype=float) + rng.normal(0, 0.5, len(market))
+    draws = rng.standard_normal((n_draws, len(sigma)))
+    markets = Markets(market=market, shares=np.ones(len(market)), x=x).build_blocks(block_size=n_markets)
+    block = markets.blocks[0]
+    exp_mu = np.exp(block.x @ (sigma[:, None] * draws.T))
+    shares = block_shares(np.where(block.mask, delta[np.maximum(block.rows, 0)], 0.0), exp_mu, block.mask)
+    markets.shares = np.empty(len(market))
+    markets.shares[block.rows[block.mask]] = shares[block.mask]
+    markets.blocks = []
+    ones = np.ones((len(market), 1))
+    return {
+        "markets": markets, "delta": delta, "draws": draws, "sigma": sigma,
+        "x_linear": np.hstack([ones, x]),
+        "instruments": np.hstack([ones, x, x ** 2, rival_sums(market, x)]),
+    }
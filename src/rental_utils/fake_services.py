@@ -0,0 +1,333 @@
+# This module is a local stand-in for the Rightmove and TravelTime endpoints
+# the scrapers call (typeAhead, api/_search, property pages and
+# time-filter/fast), serving synthetic listings from rental_utils.synthetic.
+# Latency, server errors, 429 throttling and the search pagination cap can be
+# set, so crawler throughput and failure handling can be measured offline.
+# Point the scrapers at it with use_fake_services (or the RIGHTMOVE_BASE_URL
+# and TRAVELTIME_BASE_URL environment variables).
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import numpy as np
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+from collections import Counter
+
+# Server
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from contextlib import contextmanager
+import threading
+
+# Synthetic data
+from rental_utils import synthetic
+from rental_utils import functions as rent
+
+# File and System Operations
+import json
+import math
+import time
+import zlib
+
+# Tracking
+import logging
+
+
+# CONFIGURATION
+
+@dataclass
+class FakeServiceConfig:
+    """
+    How the fake services behave.
+
+    Args:
+        listings_per_location (int): Listings each location's search holds.
+        seed (int): Seed for the synthetic listings.
+        latency_ms (float): Mean delay added to every response.
+        latency_jitter_ms (float): Standard deviation of that delay.
+        error_rate (float): Share of requests answered with a 503.
+        rate_limit (float): Requests per second allowed before 429s (None for no limit).
+        burst (int): Requests allowed at once before the rate limit applies.
+        retry_after (float): Seconds sent in the Retry-After header of a 429.
+        max_results (int): Highest search index served (Rightmove stops at 1000); beyond it, 400.
+        max_per_page (int): Most listings a search page returns.
+        max_locations (int): Most locations one time-filter request may send; beyond it, 422.
+        unreachable_rate (float): Share of locations TravelTime cannot reach.
+        speed_kmh (float): Average commuting speed behind the synthetic travel times.
+        seed_faults (int): Seed for the latency and fault draws.
+    """
+    listings_per_location: int = 5_000
+    seed: int = 0
+    latency_ms: float = 0.0
+    latency_jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit: Optional[float] = None
+    burst: int = 20
+    retry_after: float = 1.0
+    max_results: int = 1_000
+    max_per_page: int = 24
+    max_locations: int = 100_000
+    unreachable_rate: float = 0.02
+    speed_kmh: float = 18.0
+    seed_faults: int = 0
+
+
+## Location slots: each location's listings are a separate range of synthetic listing numbers
+LOCATION_SLOTS = 1_000
+
+
+def location_identifier(name: str) -> str:
+    return f"REGION^{zlib.crc32(name.upper().encode('utf-8')) % 100_000}"
+
+
+def location_slot(identifier: str) -> int:
+    return zlib.crc32(identifier.encode("utf-8")) % LOCATION_SLOTS
+
+
+## Great-circle distance in metres
+def haversine_m(lat1, lng1, lat2, lng2) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6_371_000 * math.asin(math.sqrt(a))
+
+
+# FAULTS
+
+class _Faults:
+    """Draws latency and errors, and runs the token bucket behind the 429s."""
+
+    def __init__(self, config: FakeServiceConfig):
+        self.config = config
+        self.rng = np.random.default_rng(config.seed_faults)
+        self.lock = threading.Lock()
+        self.tokens = float(config.burst)
+        self.refilled = time.monotonic()
+
+    ## Returns (delay in seconds, status to fail with or None)
+    def draw(self) -> Tuple[float, Optional[int]]:
+        config = self.config
+        with self.lock:
+            delay = max(0.0, self.rng.normal(config.latency_ms, config.latency_jitter_ms)) / 1000 \
+                if config.latency_ms or config.latency_jitter_ms else 0.0
+            if config.rate_limit is not None:
+                now = time.monotonic()
+                self.tokens = min(config.burst, self.tokens + (now - self.refilled) * config.rate_limit)
+                self.refilled = now
+                if self.tokens < 1:
+                    return delay, 429
+                self.tokens -= 1
+            if config.error_rate and self.rng.random() < config.error_rate:
+                return delay, 503
+        return delay, None
+
+
+# THE SERVER
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET  /typeAhead/uknostreet/<LO/ND/ON>/   location identifiers for a place name
+    GET  /api/_search?locationIdentifier=...&index=...&numberOfPropertiesPerPage=...
+    GET  /properties/<id>                     a listing page with a PAGE_MODEL script
+    POST /v4/time-filter/fast                 travel times (needs X-Application-Id and X-Api-Key)
+    GET  /__stats                             requests served, by endpoint and status
+    """
+    server_state: "FakeServer" = None
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/__stats":
+            self._respond(200, self.server_state.stats(), endpoint=None)
+        elif url.path.startswith("/typeAhead/uknostreet/"):
+            self._serve("typeAhead", lambda: self._type_ahead(url.path))
+        elif url.path == "/api/_search":
+            self._serve("_search", lambda: self._search(parse_qs(url.query)))
+        elif url.path.startswith("/properties/"):
+            self._serve("property", lambda: self._property(url.path))
+        else:
+            self._respond(404, {"error": f"Unknown path {url.path}"}, endpoint="unknown")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if url.path == "/v4/time-filter/fast":
+            self._serve("time-filter", lambda: self._time_filter(body))
+        else:
+            self._respond(404, {"error": f"Unknown path {url.path}"}, endpoint="unknown")
+
+    ## Apply latency and faults, then answer with the endpoint's (status, payload)
+    def _serve(self, endpoint: str, answer):
+        delay, fault = self.server_state.faults.draw()
+        if delay:
+            time.sleep(delay)
+        if fault == 429:
+            self._respond(429, {"error": "Too many requests"}, endpoint,
+                          headers={"Retry-After": f"{self.server_state.config.retry_after:g}"})
+            return
+        if fault is not None:
+            self._respond(fault, {"error": "Service unavailable"}, endpoint)
+            return
+        try:
+            status, payload = answer()
+        except (KeyError, ValueError, TypeError, IndexError) as error:
+            status, payload = 400, {"error": f"Bad request: {error}"}
+        self._respond(status, payload, endpoint)
+
+    def _type_ahead(self, path: str):
+        # the scraper splits the name into two-letter tokens: /typeAhead/uknostreet/LO/ND/ON/
+        name = path[len("/typeAhead/uknostreet/"):].replace("/", "").upper()
+        if not name:
+            return 400, {"error": "No query"}
+        display = name.title()
+        return 200, {"typeAheadLocations": [
+            {"displayName": display, "locationIdentifier": location_identifier(name), "normalisedSearchTerm": name},
+            {"displayName": f"{display} Station", "locationIdentifier": f"STATION^{zlib.crc32(name.encode()) % 10_000}",
+             "normalisedSearchTerm": f"{name} STATION"},
+        ]}
+
+    def _search(self, query: Dict[str, list]):
+        config = self.server_state.config
+        identifier = query["locationIdentifier"][0]
+        index = int(query.get("index", ["0"])[0])
+        per_page = min(int(query.get("numberOfPropertiesPerPage", [str(synthetic.RESULTS_PER_PAGE)])[0]),
+                       config.max_per_page)
+        if index < 0 or index >= config.max_results:
+            # Rightmove answers pages beyond its cap with a 400
+            return 400, {"error": f"index {index} is beyond the {config.max_results} results served"}
+        page = synthetic.search_page(config.listings_per_location, index, config.seed, per_page,
+                                     first=location_slot(identifier) * config.listings_per_location)
+        return 200, page
+
+    def _property(self, path: str):
+        config = self.server_state.config
+        listing = path[len("/properties/"):].strip("/")
+        i = int(listing) - synthetic.FIRST_ID if listing.isdigit() else -1
+        if not 0 <= i < LOCATION_SLOTS * config.listings_per_location:
+            return 404, "<html><body>This property has been removed by the agent.</body></html>"
+        return 200, synthetic.page_model_html(i, config.seed)
+
+    def _time_filter(self, body: bytes):
+        config = self.server_state.config
+        if not self.headers.get("X-Application-Id") or not self.headers.get("X-Api-Key"):
+            return 401, {"http_status": 401, "error_code": 2, "description": "Missing authentication headers"}
+        payload = json.loads(body or b"{}")
+        locations = {loc["id"]: loc["coords"] for loc in payload["locations"]}
+        if len(locations) > config.max_locations:
+            return 422, {"http_status": 422, "error_code": 15,
+                         "description": f"At most {config.max_locations} locations per request"}
+        results = []
+        for search in payload["arrival_searches"]["one_to_many"]:
+            origin = locations[search["departure_location_id"]]
+            reached, unreachable = [], []
+            for location_id in search["arrival_location_ids"]:
+                coords = locations[location_id]
+                # travel times depend only on the location, so repeated requests agree
+                crow = haversine_m(origin["lat"], origin["lng"], coords["lat"], coords["lng"])
+                distance = int(crow * 1.3)
+                travel_time = int(300 + distance / (config.speed_kmh / 3.6))
+                blocked = zlib.crc32(str(location_id).encode("utf-8")) % 10_000 < config.unreachable_rate * 10_000
+                if blocked or travel_time > search["travel_time"]:
+                    unreachable.append(location_id)
+                else:
+                    reached.append({"id": location_id,
+                                    "properties": {"travel_time": travel_time, "distance": distance}})
+            results.append({"search_id": search["id"], "locations": reached, "unreachable": unreachable})
+        return 200, {"results": results}
+
+    def _respond(self, status: int, payload, endpoint: Optional[str], headers: Optional[Dict[str, str]] = None):
+        is_html = isinstance(payload, str)
+        body = (payload if is_html else json.dumps(payload)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8" if is_html else "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if endpoint is not None:
+            self.server_state.record(endpoint, status)
+
+    def log_message(self, format, *args):
+        logging.debug(f'{self.address_string()} {format % args}')
+
+
+class FakeServer:
+    """
+    The fake services on a local port, served from a background thread.
+
+    Use it as a context manager, or call start() and stop():
+
+        with FakeServer(FakeServiceConfig(error_rate=0.05)) as server, use_fake_services(server):
+            ids = await rent.find_locations("london")
+    """
+
+    def __init__(self, config: Optional[FakeServiceConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeServiceConfig()
+        self.faults = _Faults(self.config)
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        handler = type("FakeServiceHandler", (_Handler,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        logging.info(f'Fake Rightmove and TravelTime services listening on {self.url}')
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "FakeServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def record(self, endpoint: str, status: int):
+        with self._lock:
+            self._counts[(endpoint, status)] += 1
+
+    ## Requests served so far, by endpoint and status
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        by_endpoint: Dict[str, Dict[str, int]] = {}
+        for (endpoint, status), count in sorted(counts.items()):
+            by_endpoint.setdefault(endpoint, {})[str(status)] = count
+        return {
+            "requests": sum(counts.values()),
+            "throttled": sum(c for (_, status), c in counts.items() if status == 429),
+            "errors": sum(c for (_, status), c in counts.items() if status >= 500),
+            "by_endpoint": by_endpoint,
+            "uptime_seconds": time.monotonic() - self._started,
+            "config": asdict(self.config),
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+
+## Point the scrapers in functions.py at a fake server for the duration of a block
+@contextmanager
+def use_fake_services(server: FakeServer):
+    previous = rent.RIGHTMOVE_BASE_URL, rent.TRAVELTIME_BASE_URL
+    rent.RIGHTMOVE_BASE_URL = rent.TRAVELTIME_BASE_URL = server.url
+    try:
+        yield server
+    finally:
+        rent.RIGHTMOVE_BASE_URL, rent.TRAVELTIME_BASE_URL = previous
@@ -16,6 +16,7 @@ from urllib.parse import urlencode
 
 # Data Manipulation and Analysis
 import pandas as pd
+from rental_utils import uncertainty
 from pprint import pprint 
 import json
 from typing import List
@@ -30,6 +31,10 @@ from IPython.display import display, Markdown
 # File and System Operations
 import os
 import sys
+import time
+
+# Tracking
+from rental_utils import instrumentation as instr
 
 # DIRECTORY SETUP
 
@@ -46,12 +51,26 @@ credentials_file_path = os.path.join(current_dir, '..', '..', "credentials.json"
 data_folder_path = os.path.join(current_dir, '..', '..', "data")
 
 # REQUESTS SETUP
+## Where requests are sent; set RIGHTMOVE_BASE_URL / TRAVELTIME_BASE_URL (or these attributes)
+## to point the scrapers at a stand-in such as fake_services.FakeServer
+RIGHTMOVE_BASE_URL = os.environ.get("RIGHTMOVE_BASE_URL", "https://www.rightmove.co.uk")
+TRAVELTIME_BASE_URL = os.environ.get("TRAVELTIME_BASE_URL", "https://api.traveltimeapp.com")
+
 # 1. establish HTTP client with browser-like headers to avoid being blocked
 client = AsyncClient(headers={
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)", # mimic browser use (baseline)
     "Accept": "application/json",  # Accept json apis
     "Referer": "https://www.rightmove.co.uk/",  # Helps mimic browser use
-})
+}, event_hooks=instr.httpx_event_hooks("rightmove", lambda path: rightmove_endpoint(path)))
+
+
+## Name a Rightmove request by its endpoint (rather than its full path) for the latency metrics
+def rightmove_endpoint(path: str) -> str:
+    if path.startswith("/typeAhead/"):
+        return "typeAhead"
+    if path.startswith("/properties/"):
+        return "property"
+    return path
 
 
 
@@ -60,12 +79,13 @@ client = AsyncClient(headers={
 ## EXTRACTION
 
 ### Function to find locations
+@instr.timed("find_locations", rows="result")
 async def find_locations(query: str) -> List[str]:
     """use rightmove's typeahead api to find location IDs. Returns list of location IDs in most likely order"""
     # Tokenize the query string into two-character segments separated by slashes, as required by the API
     tokenize_query = "".join(c + ("/" if i % 2 == 0 else "") for i, c in enumerate(query.upper(), start=1))
     # Construct the URL for the typeahead API using the tokenized query
-    url = f"https://www.rightmove.co.uk/typeAhead/uknostreet/{tokenize_query.strip('/')}/"
+    url = f"{RIGHTMOVE_BASE_URL}/typeAhead/uknostreet/{tokenize_query.strip('/')}/"
     # Make an asynchronous GET request to the API
     response = await client.get(url)
     # Parse the JSON response from the API
@@ -75,6 +95,7 @@ async def find_locations(query: str) -> List[str]:
 
 
 ### Function to scrape results for a given location for multiple pages
+@instr.timed("scrape_search", rows="result")
 async def scrape_search(location_id: str, total_results = 250) -> str:
     """
     Scrapes rental property listings from Rightmove for a given location identifier, handling pagination and returning all results.
@@ -82,7 +103,7 @@ async def scrape_search(location_id: str, total_results = 250) -> str:
     RESULTS_PER_PAGE = 24
 
     def make_url(offset: int) -> str:
-        url = "https://www.rightmove.co.uk/api/_search?"
+        url = f"{RIGHTMOVE_BASE_URL}/api/_search?"
         params = {
             "areaSizeUnit": "sqm", # the units for the size of each property
             "channel": "RENT",  # BUY or RENT - for my puyrposes, rent is the most relevant
@@ -133,11 +154,148 @@ async def scrape_search(location_id: str, total_results = 250) -> str:
     return results
 
 
+### The fields kept from a property page
+class PropertyResult(TypedDict):
+    """this is what our result dataset will look like"""
+    id: str
+    available: bool
+    archived: bool
+    phone: str
+    bedrooms: int
+    bathrooms: int
+    type: str
+    property_type: str
+    tags: list
+    description: str
+    title: str
+    subtitle: str
+    price: str
+    price_sqft: str
+    address: dict
+    latitude: float
+    longitude: float
+    features: list
+    history: dict
+    photos: list
+    floorplans: list
+    agency: dict
+    industryAffiliations: list
+    nearest_airports: list
+    nearest_stations: list
+    sizings: list
+    brochures: list
+
+### Define a function that parses rightmove property data to only get the relevant fields
+@instr.timed("parse_property")
+def parse_property(data) -> PropertyResult:
+    """parse rightmove cache data for proprety information"""
+    # here we define field name to JMESPath mapping
+    parse_map = {
+        "id": "id",
+        "available": "status.published",
+        "archived": "status.archived",
+        "phone": "contactInfo.telephoneNumbers.localNumber",
+        "bedrooms": "bedrooms",
+        "bathrooms": "bathrooms",
+        "type": "transactionType",
+        "property_type": "propertySubType",
+        "tags": "tags",
+        "description": "text.description",
+        "title": "text.pageTitle",
+        "subtitle": "text.propertyPhrase",
+        "price": "prices.primaryPrice",
+        "price_sqft": "prices.pricePerSqFt",
+        "address": "address",
+        "latitude": "location.latitude",
+        "longitude": "location.longitude",
+        "features": "keyFeatures",
+        "history": "listingHistory",
+        "photos": "images[*].{url: url, caption: caption}",
+        "floorplans": "floorplans[*].{url: url, caption: caption}",
+        "agency": """customer.{
+            id: branchId, 
+            branch: branchName, 
+            company: companyName, 
+            address: displayAddress, 
+            commercial: commercial, 
+            buildToRent: buildToRent,
+            isNew: isNewHomeDeveloper
+        }""",
+        "industryAffiliations": "industryAffiliations[*].name",
+        "nearest_airports": "nearestAirports[*].{name: name, distance: distance}",
+        "nearest_stations": "nearestStations[*].{name: name, distance: distance}",
+        "sizings": "sizings[*].{unit: unit, min: minimumSize, max: maximumSize}",
+        "brochures": "brochures",
+    }
+    results = {}
+    for key, path in parse_map.items():
+        value = jmespath.search(path, data)
+        results[key] = value
+    return results
+
+
+    
+def find_json_objects(text: str, decoder=json.JSONDecoder()):
+    """Find JSON objects in text, and generate decoded JSON data"""
+    pos = 0
+    while True:
+        match = text.find("{", pos)
+        if match == -1:
+            break
+        try:
+            result, index = decoder.raw_decode(text[match:])
+            yield result
+            pos = match + index
+        except ValueError:
+            pos = match + 1
+
+
+### Find the PAGE_MODEL javascript variable in a property page and return its property data
+def extract_page_model(html: str) -> dict:
+    """extract property data from the rightmove PAGE_MODEL javascript variable (None if the page has none)"""
+    selector = Selector(html)
+    data = selector.xpath("//script[contains(.,'PAGE_MODEL = ')]/text()").get()
+    if not data:
+        return None
+    json_data = list(find_json_objects(data))[0]
+    return json_data["propertyData"]
+
+
+
+### Scrape and parse a list of property pages
+@instr.timed("scrape_properties", rows="result")
+async def scrape_properties(urls: List[str], page_client: AsyncClient = None) -> List[dict]:
+    """
+    Scrape Rightmove property listings from a list of URLs (concurrently),
+    and return the parsed fields of each one (see parse_property).
+    Pages that are not listings are reported and parsed as empty.
+    """
+    page_client = page_client or client
+    # Prepare asynchronous GET requests for all URLs using the shared client
+    to_scrape = [page_client.get(url) for url in urls]
+
+    # List to store parsed property data
+    properties = []
+
+    # Asynchronously process each response as it completes
+    for response in asyncio.as_completed(to_scrape):
+        # Await the HTTP response for the property page
+        response = await response
+
+        # Extract and parse the property data from the response
+        data = extract_page_model(response.text)
+        if data is None:
+            print(f"page {response.url} is not a property listing page")
+        properties.append(parse_property(data))
+
+    return properties
+
 
 
 ## CLEANING
 
 ### A function that filters out only the desired columns
+@instr.timed("filter_df", rows=0)
 def filter_df(df: pd.DataFrame) -> pd.DataFrame:
     """
     Filters the input DataFrame to retain only the columns relevant for property analysis.
@@ -174,6 +332,9 @@ def filter_df(df: pd.DataFrame) -> pd.DataFrame:
     ]
     # Assign the columns of interest (can be extended or modified if needed)
     columns_of_interest = base_cols
+    # Keep the listing summary for the text features when the search results carry it
+    if 'summary' in df.columns:
+        columns_of_interest = base_cols + ['summary']
     # Filter the DataFrame to include only the columns of interest
     filtered_df = df[columns_of_interest]
     # Create a price per bedroom column
@@ -205,6 +366,7 @@ def clean_column_names(df: pd.DataFrame) -> pd.DataFrame:
 
 
 # Define a function that cleans a dataframe for regression analysis
+@instr.timed("clean_for_reg", rows=0)
 def clean_for_reg(df: pd.DataFrame) -> pd.DataFrame:
     """
     Cleans the input DataFrame for regression analysis.
@@ -242,6 +404,7 @@ def clean_for_reg(df: pd.DataFrame) -> pd.DataFrame:
 
 ## Define a function that generates a payload to pass into the API
 
+@instr.timed("create_payload", rows=0)
 def create_payload(df: pd.DataFrame, search_id: str="1", transportation_type: str = "public_transport") -> dict:
     """
     Creates a payload dictionary for the TravelTime API using property locations from a DataFrame.
@@ -291,29 +454,79 @@ def create_payload(df: pd.DataFrame, search_id: str="1", transportation_type: st
     return payload
 
 
+## Request travel times for properties from the TravelTime API
+
+def fetch_travel_times(df: pd.DataFrame, credentials: dict, transportation_type: str = "public_transport") -> pd.DataFrame:
+    """
+    Sends the properties in df (id, latitude, longitude) to the TravelTime API
+    and returns a DataFrame of id, distance and travel_time for the ones it could reach.
+    The credentials dict needs the 'app_id' and 'api_key' of a TravelTime account.
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "X-Application-Id": credentials["app_id"],
+        "X-Api-Key": credentials["api_key"]
+    }
+    payload = create_payload(df.copy(), transportation_type=transportation_type)
+    with instr.span("fetch_travel_times", rows=len(df)):
+        start = time.perf_counter()
+        response = requests.post(
+            f"{TRAVELTIME_BASE_URL}/v4/time-filter/fast",
+            headers=headers,
+            data=json.dumps(payload)
+        )
+        instr.record_request("traveltime", "time-filter/fast", response.status_code, time.perf_counter() - start)
+    response.raise_for_status()
+
+    # Get the nested part of the json response that is relevant
+    results = response.json()["results"][0]["locations"]
+    return pd.DataFrame([
+        {
+            "id": loc["id"],
+            "distance": loc["properties"]["distance"],
+            "travel_time": loc["properties"]["travel_time"]
+        }
+        for loc in results
+    ], columns=["id", "distance", "travel_time"])
+
+
 # Find underpriced flats relative to others with the same travel time
-def find_underpriced(df, user_budget=1200):
+@instr.timed("find_underpriced", rows=0)
+def find_underpriced(df, user_budget=1200, reference_col='predicted_price_per_bed', rank_by='savings'):
     """Finds underpriced flats relative to others with the same travel time.
     Takes as input a dataframe with the information, and the user's budget, and outputs a sorted 
     dataframe with the most underpriced rental properties at the top, and
     a recommendation with a link to the most ideal such property.
+    The reference price defaults to the regression prediction; pass
+    reference_col='comparable_price_per_bed' (see comparables.add_comparables)
+    to compare against similar nearby properties instead.
+    With the reference's spread (prediction_sd, or comparable_mad for the comparable
+    price), savings are also given as z-scores (savings_z), and rank_by='savings_z'
+    ranks by them so noisy references do not come first.
     """
+    if rank_by == 'savings_z' and not uncertainty.has_spread(df, reference_col):
+        spread_col = uncertainty.SPREAD_COLUMNS.get(reference_col, 'spread')
+        raise ValueError(f"rank_by='savings_z' needs a {spread_col} column for {reference_col}; "
+                         "use rank_by='savings' without one")
+
     # Make a copy and calculate savings
     df = df.copy()
-    df['savings'] = df['predicted_price_per_bed'] - df['price_per_bed']
+    df['savings'] = df[reference_col] - df['price_per_bed']
+    if uncertainty.has_spread(df, reference_col):
+        df['savings_z'] = uncertainty.savings_z(df, reference_col)
 
     # Filter by budget
     budget_data = df[df['price_per_bed'] <= user_budget]
 
     # Sort descending by savings
-    sorted_data = budget_data.sort_values(by='savings', ascending=False)
+    sorted_data = budget_data.sort_values(by=rank_by, ascending=False)
 
     # Print the top property
     if not sorted_data.empty:
         top_flat = sorted_data.iloc[0]
         address = top_flat['displayAddress']
         price = top_flat['price_per_bed']
-        pred_price = top_flat['predicted_price_per_bed']
+        pred_price = top_flat[reference_col]
         url = top_flat['propertyUrl']
         full_url = f"https://www.rightmove.co.uk{url}" if url.startswith('/') else url
 
@@ -325,3 +538,40 @@ def find_underpriced(df, user_budget=1200):
 
     return sorted_data
 
+
+
+
+# STREAMING
+# These consume the chunk iterators from sql_queries.iter_query / property_queries.iter_properties,
+# so memory stays bounded by the chunk size rather than the table size
+
+## Clean a stream of chunks for regression
+def stream_clean_for_reg(chunks):
+    """Applies `clean_for_reg` to each chunk of a stream, yielding the cleaned chunks."""
+    for chunk in chunks:
+        yield clean_for_reg(chunk)
+
+
+## Find underpriced flats while only ever holding the best k of them
+def find_underpriced_stream(chunks, user_budget=1200, k=10):
+    """Like `find_underpriced`, but reads a stream of chunks and keeps only a running top `k`."""
+    top = None
+    for chunk in chunks:
+        chunk = chunk[chunk['price_per_bed'] <= user_budget]
+        chunk = chunk.assign(savings=chunk['predicted_price_per_bed'] - chunk['price_per_bed'])
+        candidates = chunk if top is None else pd.concat([top, chunk])
+        top = candidates.sort_values(by='savings', ascending=False).head(k)
+    if top is None:
+        top = pd.DataFrame(columns=['price_per_bed', 'predicted_price_per_bed'])
+    # the final ranking and recommendation are the same as for a whole table
+    return find_underpriced(top, user_budget)
+
+
+## Write a stream of chunks to one CSV file
+def export_chunks(chunks, path):
+    """Writes each chunk of a stream to the CSV file at `path`, returning the number of rows written."""
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=(i == 0), index=False)
+        rows += len(chunk)
+    return rows
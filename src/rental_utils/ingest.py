@@ -0,0 +1,366 @@
+# This module loads external data files (e.g. the supply-side shifters in the
+# README) into the database a bounded chunk at a time. The schema is inferred
+# from a first streamed pass over the whole file, widening a column's kind
+# whenever a later chunk doesn't fit it, so nothing is written until every
+# value is known to fit. The chunks are then written through the batched
+# insert path in sql_queries (COPY on Postgres, executemany elsewhere) into a
+# staging table, which is moved into place in one transaction at the end: a
+# failed load never leaves half a table behind.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from typing import Dict, Iterator, List, Optional
+
+# Database Connection
+from sqlalchemy import MetaData, Table, Column, inspect, text
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, Float, Integer, Numeric, Text
+from rental_utils import sql_queries as sqlq
+
+# File and System Operations
+import os
+import time
+
+# Tracking
+import logging
+
+
+# READERS
+# Each reader yields DataFrames of at most `chunksize` rows
+
+def _read_csv(path: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def _read_ndjson(path: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    with pd.read_json(path, lines=True, chunksize=chunksize) as reader:
+        yield from reader
+
+
+def _read_parquet(path: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    import pyarrow.parquet as parquet
+    for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunksize):
+        yield batch.to_pandas()
+
+
+def _read_xlsx(path: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+    # read-only mode streams rows from the sheet instead of building the whole workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [name if name is not None else f"column_{i}" for i, name in enumerate(header)]
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) == chunksize:
+                yield pd.DataFrame(buffer, columns=header).infer_objects()
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header).infer_objects()
+    finally:
+        workbook.close()
+
+
+## The readers for each supported file extension
+READERS = {
+    ".csv": _read_csv,
+    ".ndjson": _read_ndjson,
+    ".jsonl": _read_ndjson,
+    ".parquet": _read_parquet,
+    ".xlsx": _read_xlsx,
+}
+
+
+## Stream any supported file as chunks
+def iter_file_chunks(path: str, chunksize: int = 50_000) -> Iterator[pd.DataFrame]:
+    """
+    Yields the contents of a CSV, NDJSON, Parquet or XLSX file as DataFrames of at
+    most `chunksize` rows, picking the reader from the file extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in READERS:
+        raise ValueError(f"Unsupported file type '{extension}', expected one of {sorted(READERS)}")
+    return READERS[extension](path, chunksize)
+
+
+# SCHEMA
+
+## The SQL and pandas types for each inferred kind of column
+SQL_TYPES = {"integer": Integer, "bigint": BigInteger, "float": Float,
+             "boolean": Boolean, "datetime": DateTime, "text": Text}
+PANDAS_TYPES = {"integer": "Int32", "bigint": "Int64", "float": "float64",
+                "boolean": "boolean", "datetime": "datetime64[ns]", "text": "object"}
+
+## The range each whole-number kind can hold
+INTEGER_RANGES = {"integer": (-2**31, 2**31 - 1), "bigint": (-2**63, 2**63 - 1)}
+
+## Numeric kinds from narrowest to widest; any other mix of kinds widens to "text"
+NUMERIC_KINDS = ["integer", "bigint", "float"]
+
+
+## Work out the narrowest kind for each column of a chunk (None for columns with no values)
+def _chunk_kinds(chunk: pd.DataFrame) -> Dict[str, Optional[str]]:
+    kinds = {}
+    for col in chunk.columns:
+        values = chunk[col].dropna()
+        if values.empty:
+            kind = None
+        elif pd.api.types.is_bool_dtype(values):
+            kind = "boolean"
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            kind = "datetime"
+        elif pd.api.types.is_numeric_dtype(values):
+            as_float = values.astype(float)
+            if np.isfinite(as_float).all() and (as_float == np.round(as_float)).all():
+                kind = next((k for k, (low, high) in INTEGER_RANGES.items()
+                             if as_float.min() >= low and as_float.max() <= high), "float")
+            else:
+                kind = "float"
+        elif pd.to_datetime(values.astype(str), errors="coerce", format="ISO8601").notna().all():
+            # text columns holding ISO dates (CSV and NDJSON carry no date type)
+            kind = "datetime"
+        else:
+            kind = "text"
+        kinds[str(col)] = kind
+    return kinds
+
+
+## The narrowest kind that holds the values of both kinds
+def widen(kind: Optional[str], other: Optional[str]) -> Optional[str]:
+    """
+    Returns the kind a column needs to hold values of `kind` and of `other`:
+    integer -> bigint -> float among numbers, and "text" for any other mix.
+    None (no values seen yet) fits anything.
+    """
+    if kind is None or kind == other:
+        return other
+    if other is None:
+        return kind
+    if kind in NUMERIC_KINDS and other in NUMERIC_KINDS:
+        return max(kind, other, key=NUMERIC_KINDS.index)
+    return "text"
+
+
+## Work out the narrowest kind for each column of a sample
+def infer_schema(sample: pd.DataFrame) -> Dict[str, str]:
+    """
+    Returns column name -> kind ("integer", "bigint", "float", "boolean",
+    "datetime" or "text") for a sample chunk. Whole-number columns become
+    "integer" when they fit in 32 bits, else "bigint". Columns with no values are "text".
+    """
+    return {col: kind or "text" for col, kind in _chunk_kinds(sample).items()}
+
+
+## Infer the schema of a whole file, a chunk at a time
+def scan_schema(path: str, chunksize: int = 50_000) -> Dict[str, str]:
+    """
+    Streams the file once and returns the narrowest kind for each column that
+    fits every chunk, widening a column (see `widen`) whenever a later chunk
+    doesn't fit what the earlier ones suggested.
+    """
+    kinds: Dict[str, Optional[str]] = {}
+    for chunk in iter_file_chunks(path, chunksize):
+        for col, kind in _chunk_kinds(chunk).items():
+            widened = widen(kinds.get(col), kind)
+            if col in kinds and kinds[col] is not None and widened != kinds[col]:
+                logging.info(f'Column {col} widened from {kinds[col]} to {widened}')
+            kinds[col] = widened
+    return {col: kind or "text" for col, kind in kinds.items()}
+
+
+## Cast a chunk to the inferred schema
+def conform(chunk: pd.DataFrame, schema: Dict[str, str],
+            coerced: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+    """
+    Returns the chunk with exactly the schema's columns, cast to their kinds.
+    Columns the schema doesn't know are dropped; missing ones are filled with nulls.
+
+    Values that can't be read as their column's kind (e.g. "unknown" in a float
+    column) are stored as nulls, logged and counted into `coerced` (column -> count).
+    Whole-number columns are never rounded: a fraction or a value out of the
+    column's range raises ValueError.
+    """
+    chunk = chunk.rename(columns=str)
+    out = pd.DataFrame(index=chunk.index)
+    for col, kind in schema.items():
+        values = chunk[col] if col in chunk.columns else pd.Series(pd.NA, index=chunk.index)
+        present = values.notna()
+        if kind in ("integer", "bigint", "float"):
+            values = pd.to_numeric(values, errors="coerce")
+        elif kind == "datetime":
+            values = pd.to_datetime(values, errors="coerce", format="ISO8601")
+        elif kind == "boolean":
+            values = values.astype("boolean")
+        else:
+            values = values.astype(object).where(values.notna(), None)
+
+        lost = int((present & values.isna()).sum())
+        if lost:
+            logging.warning(f'{lost} values in column {col} could not be read as {kind} and were stored as null')
+            if coerced is not None:
+                coerced[col] = coerced.get(col, 0) + lost
+
+        if kind in INTEGER_RANGES:
+            as_float = values.astype("float64")
+            low, high = INTEGER_RANGES[kind]
+            fractions = as_float[as_float != np.round(as_float)].dropna()
+            if not fractions.empty:
+                raise ValueError(f"Column {col} is {kind} but holds fractions (e.g. {fractions.iloc[0]})")
+            if ((as_float < low) | (as_float > high)).any():
+                raise ValueError(f"Column {col} holds values outside the {kind} range {low}..{high}")
+            values = values.astype(PANDAS_TYPES[kind])
+        out[col] = values
+    return out
+
+
+## The kind of an existing table column, from its reflected SQL type
+def _column_kind(sql_type) -> str:
+    if isinstance(sql_type, BigInteger):
+        return "bigint"
+    if isinstance(sql_type, Integer):
+        return "integer"
+    if isinstance(sql_type, (Float, Numeric)):
+        return "float"
+    if isinstance(sql_type, Boolean):
+        return "boolean"
+    if isinstance(sql_type, (DateTime, Date)):
+        return "datetime"
+    return "text"
+
+
+## Create the destination table for a schema
+def create_table(engine, table: str, schema: Dict[str, str], if_exists: str = "append"):
+    """
+    Creates `table` with columns typed from `schema`. With if_exists="replace" an
+    existing table is dropped first, with "fail" an existing table raises, and with
+    "append" an existing table is kept as it is.
+    """
+    exists = inspect(engine).has_table(table)
+    if exists and if_exists == "fail":
+        raise ValueError(f"Table {table} already exists")
+    if exists and if_exists == "replace":
+        with engine.begin() as connection:
+            quote = connection.dialect.identifier_preparer.quote
+            connection.execute(text(f"DROP TABLE {quote(table)}"))
+    metadata = MetaData()
+    Table(table, metadata, *[Column(name, SQL_TYPES[kind]()) for name, kind in schema.items()])
+    metadata.create_all(engine, checkfirst=True)
+
+
+# INGEST
+
+## Name of the table a load is staged in before it is moved into place
+def staging_table(table: str) -> str:
+    return f"{table}__loading"
+
+
+## Decide which columns to load, and as which kinds, checking they fit an existing table
+def _plan_load(engine, table: str, schema: Dict[str, str], if_exists: str) -> Dict[str, str]:
+    if if_exists not in ("append", "replace", "fail"):
+        raise ValueError(f"if_exists must be 'append', 'replace' or 'fail', not {if_exists!r}")
+    if not inspect(engine).has_table(table) or if_exists == "replace":
+        return dict(schema)
+    if if_exists == "fail":
+        raise ValueError(f"Table {table} already exists")
+
+    # appending: only load the columns the table has, as the kinds it declares
+    existing = {col["name"]: _column_kind(col["type"]) for col in inspect(engine).get_columns(table)}
+    skipped = [c for c in schema if c not in existing]
+    if skipped:
+        logging.warning(f'Columns not in {table} will be skipped: {skipped}')
+    too_narrow = {c: f"{existing[c]} < {kind}" for c, kind in schema.items()
+                  if c in existing and widen(existing[c], kind) != existing[c]}
+    if too_narrow:
+        raise ValueError(f"The file does not fit the columns of {table}: {too_narrow}")
+    return {c: existing[c] for c in schema if c in existing}
+
+
+## Move a finished staging table into place, in one transaction
+def _publish(engine, staging: str, table: str, columns: List[str], replace: bool):
+    with engine.begin() as connection:
+        quote = connection.dialect.identifier_preparer.quote
+        if replace:
+            connection.execute(text(f"DROP TABLE IF EXISTS {quote(table)}"))
+        if inspect(connection).has_table(table):
+            # appending (_plan_load has already checked the columns fit)
+            col_list = ", ".join(quote(c) for c in columns)
+            connection.execute(text(
+                f"INSERT INTO {quote(table)} ({col_list}) SELECT {col_list} FROM {quote(staging)}"
+            ))
+            connection.execute(text(f"DROP TABLE {quote(staging)}"))
+        else:
+            connection.execute(text(f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}"))
+
+
+def _drop_table(engine, table: str):
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {connection.dialect.identifier_preparer.quote(table)}"))
+
+
+## Load a whole file into a table, one chunk at a time
+def ingest_file(path: str, table: str, engine, chunksize: int = 50_000,
+                if_exists: str = "append", schema: Optional[Dict[str, str]] = None) -> Dict[str, float]:
+    """
+    Streams a data file into a database table.
+
+    Unless a schema is given, the file is read twice: once to infer each
+    column's kind from every chunk (see `scan_schema`), then to load it. Each
+    chunk is conformed to the schema and written with `sql_queries.bulk_insert`
+    into a staging table, which replaces (or is appended to) `table` in one
+    transaction once every chunk has loaded. If any chunk fails, the staging
+    table is dropped and `table` is left as it was. Progress and throughput
+    are logged per chunk.
+
+    Args:
+        path (str): A .csv, .ndjson/.jsonl, .parquet or .xlsx file.
+        table (str): The destination table.
+        engine (sqlalchemy.engine.Engine): The database to write to.
+        chunksize (int): Rows read and written at a time.
+        if_exists (str): "append", "replace" or "fail", as in pandas' to_sql.
+        schema (dict): Column name -> kind, to skip inference.
+
+    Returns:
+        dict: Rows written, chunks, seconds taken, rows per second, and the
+        number of values stored as null because they did not fit their column.
+    """
+    start = time.perf_counter()
+    if schema is None:
+        schema = scan_schema(path, chunksize)
+        logging.info(f'Inferred schema for {table}: {schema}')
+    if not schema:
+        logging.warning(f'{path} holds no columns, so nothing was loaded into {table}')
+        return {"rows": 0, "chunks": 0, "seconds": round(time.perf_counter() - start, 3),
+                "rows_per_second": 0.0, "coerced": 0}
+    load_schema = _plan_load(engine, table, schema, if_exists)
+    columns = list(load_schema)
+
+    staging = staging_table(table)
+    create_table(engine, staging, load_schema, if_exists="replace")
+    rows = chunks = 0
+    coerced: Dict[str, int] = {}
+    try:
+        for chunk in iter_file_chunks(path, chunksize):
+            rows += sqlq.bulk_insert(staging, conform(chunk, load_schema, coerced)[columns], engine)
+            chunks += 1
+            elapsed = time.perf_counter() - start
+            logging.info(f'{rows:,} rows staged for {table} ({rows / elapsed:,.0f} rows/s)')
+        _publish(engine, staging, table, columns, replace=if_exists == "replace")
+    except BaseException:
+        logging.error(f'Loading {path} failed, so {table} was left as it was')
+        _drop_table(engine, staging)
+        raise
+
+    if coerced:
+        logging.warning(f'Values stored as null because they did not fit their column: {coerced}')
+    elapsed = time.perf_counter() - start
+    stats = {"rows": rows, "chunks": chunks, "seconds": round(elapsed, 3),
+             "rows_per_second": round(rows / elapsed, 1) if elapsed else 0.0,
+             "coerced": sum(coerced.values())}
+    logging.info(f'Finished loading {path} into {table}: {stats}')
+    return stats
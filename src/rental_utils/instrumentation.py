@@ -0,0 +1,438 @@
+# This module times the pipeline's stages and hot functions. Spans (named,
+# labelled timings with a row count) and request latencies feed histograms
+# and counters, every finished span is appended to a JSON lines run log, and
+# the totals (with peak RSS) can be written as a Prometheus text file.
+# Nothing is recorded until `enable` is called (or RENTAL_METRICS_DIR is set):
+# until then a span is a shared no-op object and a timed function costs one
+# extra call and a check of a global.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+from typing import Dict, Optional, Tuple, Union
+from collections import defaultdict
+from bisect import bisect_left
+
+# Parallel Processing
+import threading
+
+# File and System Operations
+import atexit
+import functools
+import inspect
+import json
+import os
+import sys
+import time
+import uuid
+
+# Peak memory (not available on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Tracking
+import logging
+
+
+# SETTINGS
+
+## Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+## Prefix of every exported metric name
+PREFIX = "rental"
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """The process's peak resident set size so far (None where it cannot be read)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+# THE RECORDER
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.n += 1
+
+
+class Recorder:
+    """
+    Collects spans, histograms and counters for one run.
+
+    Args:
+        jsonl_path (str): Run log; one JSON object per finished span (None to keep nothing on disk).
+        prometheus_path (str): Where `export` writes the Prometheus text file.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._log = None
+        if jsonl_path:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+            self._log = open(jsonl_path, "a", encoding="utf-8")
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = _Histogram()
+            histogram.observe(value)
+
+    def count(self, name: str, value: float = 1, labels: Labels = ()):
+        with self.lock:
+            self.counters[(name, labels)] += value
+
+    def log(self, event: dict):
+        if self._log is None:
+            return
+        line = json.dumps({"run_id": self.run_id, **event}, default=str)
+        with self.lock:
+            self._log.write(line + "\n")
+
+    def finish_span(self, span: "Span", seconds: float):
+        labels = (("span", span.name),) + span.labels
+        self.observe("span_seconds", seconds, labels)
+        if span.rows is not None:
+            self.count("rows_total", span.rows, labels)
+        self.log({
+            "type": "span",
+            "name": span.name,
+            "labels": dict(span.labels),
+            "started_at": span.started_at,
+            "seconds": seconds,
+            "rows": span.rows,
+            "rows_per_second": span.rows / seconds if span.rows is not None and seconds > 0 else None,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "thread": threading.current_thread().name,
+            "error": span.error,
+        })
+
+    ## Everything recorded so far, as plain data
+    def snapshot(self) -> dict:
+        with self.lock:
+            histograms = {
+                f"{name}{_format_labels(labels)}": {"count": h.n, "sum": h.total,
+                                                   "buckets": dict(zip([*map(str, h.buckets), "+Inf"], h.counts))}
+                for (name, labels), h in self.histograms.items()
+            }
+            counters = {f"{name}{_format_labels(labels)}": value for (name, labels), value in self.counters.items()}
+        return {"run_id": self.run_id, "histograms": histograms, "counters": counters,
+                "peak_rss_bytes": peak_rss_bytes()}
+
+    ## The totals in the Prometheus text exposition format
+    def prometheus_text(self) -> str:
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            span_seconds = {labels: h.total for (name, labels), h in self.histograms.items() if name == "span_seconds"}
+        seen = set()
+        for (name, labels), histogram in histograms:
+            metric = f"{PREFIX}_{name}"
+            if metric not in seen:
+                lines += [f"# HELP {metric} {_HELP.get(name, name)}", f"# TYPE {metric} histogram"]
+                seen.add(metric)
+            cumulative = 0
+            for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.total:.6f}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.n}")
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}"
+            if metric not in seen:
+                lines += [f"# HELP {metric} {_HELP.get(name, name)}", f"# TYPE {metric} counter"]
+                seen.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+        # throughput per span, from the rows counted and the time spent
+        rates = [(labels, value / span_seconds[labels]) for (name, labels), value in counters
+                 if name == "rows_total" and span_seconds.get(labels, 0) > 0]
+        if rates:
+            metric = f"{PREFIX}_rows_per_second"
+            lines += [f"# HELP {metric} {_HELP['rows_per_second']}", f"# TYPE {metric} gauge"]
+            lines += [f"{metric}{_format_labels(labels)} {rate:.3f}" for labels, rate in rates]
+        peak = peak_rss_bytes()
+        if peak is not None:
+            metric = f"{PREFIX}_process_peak_rss_bytes"
+            lines += [f"# HELP {metric} {_HELP['peak_rss']}", f"# TYPE {metric} gauge", f"{metric} {peak}"]
+        return "\n".join(lines) + "\n"
+
+    ## Write the Prometheus file and a closing summary line to the run log
+    def export(self):
+        if self.prometheus_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.prometheus_path)), exist_ok=True)
+            partial = self.prometheus_path + ".partial"
+            with open(partial, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+            # written then renamed, so a scraper never reads half a file
+            os.replace(partial, self.prometheus_path)
+        self.log({"type": "summary", **self.snapshot()})
+        if self._log is not None:
+            with self.lock:
+                self._log.flush()
+
+    def close(self):
+        self.export()
+        if self._log is not None:
+            with self.lock:
+                self._log.close()
+                self._log = None
+
+
+_HELP = {
+    "span_seconds": "Wall time of instrumented stages and functions.",
+    "rows_total": "Rows handled by instrumented stages and functions.",
+    "http_request_seconds": "Latency of requests to external services, to the response headers.",
+    "http_requests_total": "Requests to external services, by status.",
+    "rows_per_second": "Rows handled per second of instrumented time.",
+    "peak_rss": "Peak resident set size of the process.",
+}
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+# THE INSTRUMENTATION SURFACE
+
+_RECORDER: Optional[Recorder] = None
+
+
+class Span:
+    """A timing in progress; set `rows` (or call add_rows) to record throughput."""
+
+    def __init__(self, recorder: Recorder, name: str, labels: Labels):
+        self.recorder = recorder
+        self.name = name
+        self.labels = labels
+        self.rows: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def add_rows(self, rows: int):
+        self.rows = (self.rows or 0) + int(rows)
+
+    def __enter__(self) -> "Span":
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.recorder.finish_span(self, time.perf_counter() - self._start)
+        return False
+
+
+class _NoSpan:
+    """What `span` returns while instrumentation is off."""
+    rows = None
+
+    def add_rows(self, rows: int):
+        pass
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enabled() -> bool:
+    return _RECORDER is not None
+
+
+## Start recording (returns the recorder)
+def enable(jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> Recorder:
+    """
+    Turns instrumentation on for the rest of the process. Finished spans are
+    appended to `jsonl_path`; `export()` (also run at exit) writes the totals
+    to `prometheus_path`.
+    """
+    global _RECORDER
+    if _RECORDER is not None:
+        _RECORDER.close()
+    _RECORDER = Recorder(jsonl_path, prometheus_path)
+    logging.info(f'Instrumentation on (run {_RECORDER.run_id}): log {jsonl_path}, metrics {prometheus_path}')
+    return _RECORDER
+
+
+## Stop recording, writing out what was recorded
+def disable():
+    global _RECORDER
+    if _RECORDER is not None:
+        _RECORDER.close()
+    _RECORDER = None
+
+
+def export():
+    if _RECORDER is not None:
+        _RECORDER.export()
+
+
+def snapshot() -> Optional[dict]:
+    return _RECORDER.snapshot() if _RECORDER is not None else None
+
+
+## Time a block: `with span("load", rows=len(df)):` or `with span("scrape") as s: ... s.add_rows(n)`
+def span(name: str, rows: Optional[int] = None, **labels) -> Union[Span, _NoSpan]:
+    recorder = _RECORDER
+    if recorder is None:
+        return _NO_SPAN
+    current = Span(recorder, name, _labels(labels))
+    if rows is not None:
+        current.rows = int(rows)
+    return current
+
+
+## Record one value in a histogram (e.g. a request latency)
+def observe(name: str, value: float, **labels):
+    recorder = _RECORDER
+    if recorder is not None:
+        recorder.observe(name, value, _labels(labels))
+
+
+## Add to a counter
+def count(name: str, value: float = 1, **labels):
+    recorder = _RECORDER
+    if recorder is not None:
+        recorder.count(name, value, _labels(labels))
+
+
+def _rows_of(value) -> Optional[int]:
+    # a count (e.g. rows written) is taken as it is, anything sized by its length
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+## Decorator: run the function in a span
+def timed(name: Optional[str] = None, rows: Union[int, str, None] = None):
+    """
+    Wraps a function (or coroutine function) in a span named `name` (default:
+    its qualified name). `rows` says what to count: the length of a positional
+    argument (its index), of a keyword argument (its name) or of the result ("result").
+    """
+    def decorate(func):
+        span_name = name or func.__qualname__
+
+        def rows_for(args, kwargs, result):
+            if rows == "result":
+                return _rows_of(result)
+            if isinstance(rows, int):
+                return _rows_of(args[rows]) if len(args) > rows else None
+            if isinstance(rows, str):
+                return _rows_of(kwargs[rows]) if rows in kwargs else None
+            return None
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _RECORDER is None:
+                    return await func(*args, **kwargs)
+                with span(span_name) as current:
+                    result = await func(*args, **kwargs)
+                    current.rows = rows_for(args, kwargs, result)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _RECORDER is None:
+                return func(*args, **kwargs)
+            with span(span_name) as current:
+                result = func(*args, **kwargs)
+                current.rows = rows_for(args, kwargs, result)
+            return result
+        return wrapper
+    return decorate
+
+
+## Record a request to an external service
+def record_request(service: str, endpoint: str, status, seconds: float):
+    recorder = _RECORDER
+    if recorder is None:
+        return
+    recorder.observe("http_request_seconds", seconds, _labels({"service": service, "endpoint": endpoint}))
+    recorder.count("http_requests_total", 1, _labels({"service": service, "endpoint": endpoint, "status": status}))
+
+
+## httpx event hooks that time every request an AsyncClient makes
+def httpx_event_hooks(service: str, endpoint=None) -> dict:
+    """
+    Returns `event_hooks` for an httpx.AsyncClient, recording the time to the
+    response headers of each request, labelled by `endpoint(path)` (default: the path).
+    """
+    async def on_request(request):
+        if _RECORDER is not None:
+            request.extensions["instrumentation_start"] = time.perf_counter()
+
+    async def on_response(response):
+        start = response.request.extensions.get("instrumentation_start")
+        if start is not None and _RECORDER is not None:
+            path = response.request.url.path
+            record_request(service, endpoint(path) if endpoint else path, response.status_code,
+                           time.perf_counter() - start)
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+## Turn instrumentation on from the environment: RENTAL_METRICS_DIR=<folder>
+def enable_from_env():
+    folder = os.environ.get("RENTAL_METRICS_DIR")
+    if folder and _RECORDER is None:
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        enable(os.path.join(folder, f"run-{stamp}.jsonl"), os.path.join(folder, "metrics.prom"))
+
+
+## A forked child (a process pool worker, say) starts with recording off, so it never writes to its
+## parent's log or metrics file; the parent's recorder is kept referenced so that the child never
+## flushes the log lines it inherited in the buffer
+_FORKED_FROM = []
+
+
+def _after_fork_in_child():
+    global _RECORDER
+    if _RECORDER is not None:
+        _FORKED_FROM.append(_RECORDER)
+        _RECORDER = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(disable)
+enable_from_env()
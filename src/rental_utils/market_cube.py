@@ -0,0 +1,400 @@
+# This module keeps a materialised aggregate cube of rents in properties.db,
+# so market summaries (median rent per bed by area x bedrooms x commute band,
+# say) are read from a few thousand pre-aggregated cells instead of the whole
+# table. A cell is one (geohash, bedrooms, property type, travel-time band,
+# month) combination and holds the count, sum and sum of squares of the
+# monthly rent per bed, plus a quantile sketch: counts in logarithmic buckets
+# 2% wide, which add up across cells and support removals, so quantiles of any
+# roll-up come out within 1% of the exact value. The cube follows the change
+# log in replication.py like a replication target, with its own high-water
+# mark: on each update only the listings changed since the last one are taken
+# out of their old cell (kept in market_cube_members) and added to their new one.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union
+
+# Database Connection
+from sqlalchemy import text
+from rental_utils import property_queries as pq
+from rental_utils import replication as repl
+from rental_utils import instrumentation as instr
+
+# Tracking
+import logging
+
+
+# SETTINGS
+
+## Geohash characters stored per cell (5 is about 4.9km x 4.9km); roll-ups can use any shorter prefix
+GEOHASH_PRECISION = 5
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+## Travel-time bands, as (label, upper bound in minutes); travel_time is stored in seconds
+TRAVEL_BANDS = (("0-15", 15), ("15-30", 30), ("30-45", 45), ("45-60", 60), ("60-90", 90), ("90+", np.inf))
+
+## What a missing dimension is stored as
+UNKNOWN = "unknown"
+
+## Rents per bed outside this range are treated as errors, as in property_queries.regression_query
+PRICE_BOUNDS = (100, 10000)
+
+## Relative accuracy of the quantile sketch: bucket k holds values in (GAMMA^(k-1), GAMMA^k]
+SKETCH_ACCURACY = 0.01
+GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+
+## The cube's name in replication_state (so change log compaction waits for it)
+TARGET = "market_cube"
+
+## The dimensions a roll-up can group by
+DIMENSIONS = ("geohash", "bedrooms", "property_type", "travel_band", "month")
+
+
+# SQL
+
+CREATE_CUBE_SQL_QUERIES = [
+    """
+    CREATE TABLE IF NOT EXISTS market_cube (
+        cell INTEGER PRIMARY KEY,
+        geohash TEXT NOT NULL,
+        bedrooms INTEGER NOT NULL,
+        property_type TEXT NOT NULL,
+        travel_band TEXT NOT NULL,
+        month TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        total REAL NOT NULL DEFAULT 0,
+        total_sq REAL NOT NULL DEFAULT 0,
+        UNIQUE (geohash, bedrooms, property_type, travel_band, month)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS market_cube_buckets (
+        cell INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (cell, bucket)
+    );
+    """,
+    # which cell and bucket each listing was counted in, so it can be taken out again when it changes
+    """
+    CREATE TABLE IF NOT EXISTS market_cube_members (
+        id INTEGER PRIMARY KEY,
+        cell INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        value REAL NOT NULL
+    );
+    """,
+]
+
+## The listings to (re)count, with the columns the cube's dimensions come from
+GET_CUBE_ROWS_SQL_QUERY = f"""
+SELECT p.id, p.latitude, p.longitude, p.bedrooms, p."propertySubType" AS property_type,
+       p.travel_time, p."firstVisibleDate" AS first_visible, ({pq.MONTHLY_PRICE_PER_BED}) AS value
+FROM properties_data p
+JOIN cube_changed c ON c.id = p.id
+WHERE p.bedrooms >= 1
+  AND ({pq.MONTHLY_PRICE_PER_BED}) BETWEEN :price_low AND :price_high
+"""
+
+_SAME_CELL = " AND ".join(f"c.{d} = n.{d}" for d in DIMENSIONS)
+
+
+# DIMENSIONS AND SKETCHES
+
+## Geohash a column of coordinates (missing coordinates give "")
+def geohash(latitude, longitude, precision: int = GEOHASH_PRECISION) -> np.ndarray:
+    """
+    Encodes coordinates as geohash strings, vectorised: the longitude and
+    latitude ranges are halved alternately (longitude first) and every 5
+    bits become one base-32 character.
+    """
+    lat = np.asarray(latitude, dtype=float)
+    lon = np.asarray(longitude, dtype=float)
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    x = np.clip(((np.where(valid, lon, 0) + 180) / 360 * (1 << lon_bits)).astype(np.int64), 0, (1 << lon_bits) - 1)
+    y = np.clip(((np.where(valid, lat, 0) + 90) / 180 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1)
+    code = np.zeros(lat.shape, dtype=np.int64)
+    for i in range(bits):
+        # even bits (from the most significant) come from the longitude, odd ones from the latitude
+        if i % 2 == 0:
+            bit = (x >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+    chars = np.array(list(GEOHASH_ALPHABET))
+    digits = [chars[(code >> (5 * (precision - 1 - k))) & 31] for k in range(precision)]
+    hashes = np.array(["".join(parts) for parts in zip(*digits)], dtype=object)
+    return np.where(valid, hashes, "")
+
+
+## The band label of each travel time (in seconds)
+def travel_band(travel_time) -> np.ndarray:
+    minutes = np.asarray(travel_time, dtype=float) / 60
+    labels = np.array([label for label, _ in TRAVEL_BANDS] + [UNKNOWN], dtype=object)
+    edges = np.array([upper for _, upper in TRAVEL_BANDS])
+    index = np.searchsorted(edges, minutes, side="left")
+    return labels[np.where(np.isnan(minutes), len(TRAVEL_BANDS), index)]
+
+
+## The sketch bucket of each (positive) value
+def sketch_bucket(values) -> np.ndarray:
+    return np.ceil(np.log(np.asarray(values, dtype=float)) / np.log(GAMMA)).astype(np.int64)
+
+
+## The value a bucket stands for (within SKETCH_ACCURACY of everything in it)
+def bucket_value(buckets) -> np.ndarray:
+    return 2 * GAMMA ** np.asarray(buckets, dtype=float) / (GAMMA + 1)
+
+
+## Work out each listing's cell dimensions and bucket
+def cube_rows(rows: pd.DataFrame, precision: int = GEOHASH_PRECISION) -> pd.DataFrame:
+    month = rows["first_visible"].fillna("").astype(str).str.slice(0, 7)
+    return pd.DataFrame({
+        "id": rows["id"].astype("int64"),
+        "geohash": geohash(rows["latitude"], rows["longitude"], precision),
+        "bedrooms": rows["bedrooms"].astype("int64"),
+        "property_type": rows["property_type"].fillna(UNKNOWN).astype(str),
+        "travel_band": travel_band(rows["travel_time"]),
+        "month": month.where(month.str.match(r"^\d{4}-\d{2}$"), UNKNOWN),
+        "bucket": sketch_bucket(rows["value"]),
+        "value": rows["value"].astype(float),
+    })
+
+
+# MAINTENANCE
+
+## Create the cube's tables and register it with the change log
+def ensure_cube(engine):
+    repl.ensure_change_tracking(engine)
+    with engine.begin() as connection:
+        for query in CREATE_CUBE_SQL_QUERIES:
+            connection.execute(text(query))
+
+
+## Bring the cube up to date with properties_data
+@instr.timed("update_cube")
+def update_cube(engine, rebuild: bool = False) -> Dict[str, int]:
+    """
+    Recounts the listings changed since the cube's last update (or, the first
+    time and with `rebuild`, every listing), in one transaction.
+
+    Each changed listing is removed from the cell and bucket it was counted in
+    and added to the ones it belongs to now; listings that were deleted, or no
+    longer have a usable rent, are just removed. Cells left empty are dropped.
+    If the change log has been compacted past the cube's high-water mark, the
+    cube is rebuilt.
+
+    Returns:
+        dict: Listings recounted, cells touched, and the new high-water mark.
+    """
+    ensure_cube(engine)
+    with engine.begin() as connection:
+        after = connection.execute(
+            text("SELECT last_seq FROM replication_state WHERE target = :target"), {"target": TARGET}
+        ).scalar()
+        upto = connection.execute(text(repl.GET_HEAD_SEQ_SQL_QUERY)).scalar()
+        oldest = connection.execute(text("SELECT MIN(seq) FROM properties_changes")).scalar()
+        # with every entry since the mark compacted away the log is empty, but the head has still moved
+        if after is not None and upto > after and (oldest is None or oldest > after + 1):
+            logging.warning('The change log was compacted past the market cube, so it is being rebuilt')
+            rebuild = True
+        rebuild = rebuild or after is None
+
+        connection.execute(text("DROP TABLE IF EXISTS cube_changed"))
+        connection.execute(text("CREATE TEMP TABLE cube_changed (id INTEGER PRIMARY KEY)"))
+        if rebuild:
+            for table in ("market_cube", "market_cube_buckets", "market_cube_members"):
+                connection.execute(text(f"DELETE FROM {table}"))
+            connection.execute(text("INSERT INTO cube_changed (id) SELECT id FROM properties_data"))
+        else:
+            connection.execute(text(
+                "INSERT INTO cube_changed (id) SELECT DISTINCT id FROM properties_changes "
+                "WHERE seq > :after AND seq <= :upto"
+            ), {"after": after, "upto": upto})
+        changed = connection.execute(text("SELECT COUNT(*) FROM cube_changed")).scalar()
+
+        rows = pd.read_sql(text(GET_CUBE_ROWS_SQL_QUERY), connection,
+                           params={"price_low": PRICE_BOUNDS[0], "price_high": PRICE_BOUNDS[1]})
+        new = cube_rows(rows)
+        connection.execute(text("DROP TABLE IF EXISTS cube_new"))
+        connection.execute(text(
+            "CREATE TEMP TABLE cube_new (id INTEGER PRIMARY KEY, geohash TEXT, bedrooms INTEGER, "
+            "property_type TEXT, travel_band TEXT, month TEXT, bucket INTEGER, value REAL)"
+        ))
+        if not new.empty:
+            connection.execute(text(
+                "INSERT INTO cube_new VALUES (:id, :geohash, :bedrooms, :property_type, :travel_band, :month, "
+                ":bucket, :value)"
+            ), new.to_dict(orient="records"))
+        dims = ", ".join(DIMENSIONS)
+        connection.execute(text(f"INSERT OR IGNORE INTO market_cube ({dims}) SELECT DISTINCT {dims} FROM cube_new"))
+
+        # every change as a signed contribution: -1 from where a listing was, +1 to where it is now
+        connection.execute(text("DROP TABLE IF EXISTS cube_delta"))
+        connection.execute(text(
+            "CREATE TEMP TABLE cube_delta (cell INTEGER, bucket INTEGER, value REAL, sign INTEGER)"
+        ))
+        connection.execute(text(
+            "INSERT INTO cube_delta SELECT m.cell, m.bucket, m.value, -1 "
+            "FROM market_cube_members m JOIN cube_changed c ON c.id = m.id"
+        ))
+        connection.execute(text(
+            f"INSERT INTO cube_delta SELECT c.cell, n.bucket, n.value, 1 "
+            f"FROM cube_new n JOIN market_cube c ON {_SAME_CELL}"
+        ))
+        connection.execute(text("CREATE INDEX cube_delta_cell ON cube_delta (cell, bucket)"))
+        cells = connection.execute(text("SELECT COUNT(DISTINCT cell) FROM cube_delta")).scalar()
+
+        connection.execute(text("""
+            UPDATE market_cube SET
+                count = count + (SELECT SUM(sign) FROM cube_delta d WHERE d.cell = market_cube.cell),
+                total = total + (SELECT SUM(sign * value) FROM cube_delta d WHERE d.cell = market_cube.cell),
+                total_sq = total_sq + (SELECT SUM(sign * value * value) FROM cube_delta d
+                                       WHERE d.cell = market_cube.cell)
+            WHERE cell IN (SELECT cell FROM cube_delta)
+        """))
+        # the WHERE true stops SQLite reading ON CONFLICT as part of the SELECT
+        connection.execute(text("""
+            INSERT INTO market_cube_buckets (cell, bucket, count)
+            SELECT cell, bucket, SUM(sign) FROM cube_delta WHERE true GROUP BY cell, bucket
+            ON CONFLICT (cell, bucket) DO UPDATE SET count = market_cube_buckets.count + excluded.count
+        """))
+        connection.execute(text(
+            "DELETE FROM market_cube_buckets WHERE count <= 0 AND cell IN (SELECT cell FROM cube_delta)"
+        ))
+        connection.execute(text(
+            "DELETE FROM market_cube WHERE count <= 0 AND cell IN (SELECT cell FROM cube_delta)"
+        ))
+
+        connection.execute(text("DELETE FROM market_cube_members WHERE id IN (SELECT id FROM cube_changed)"))
+        connection.execute(text(
+            f"INSERT INTO market_cube_members (id, cell, bucket, value) "
+            f"SELECT n.id, c.cell, n.bucket, n.value FROM cube_new n JOIN market_cube c ON {_SAME_CELL}"
+        ))
+        for table in ("cube_changed", "cube_new", "cube_delta"):
+            connection.execute(text(f"DROP TABLE {table}"))
+        connection.execute(text("""
+            INSERT INTO replication_state (target, last_seq, rows_shipped, synced_at)
+            VALUES (:target, :last_seq, :shipped, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+            ON CONFLICT (target) DO UPDATE SET
+                last_seq = excluded.last_seq,
+                rows_shipped = replication_state.rows_shipped + excluded.rows_shipped,
+                synced_at = excluded.synced_at
+        """), {"target": TARGET, "last_seq": upto, "shipped": len(new)})
+
+    result = {"listings": changed, "counted": len(new), "cells": cells, "last_seq": upto, "rebuilt": rebuild}
+    logging.info(f'Market cube updated: {result}')
+    return result
+
+
+# ROLL-UPS
+
+def _rollup_filters(geohash_prefix, bedrooms, property_types, travel_bands, months) -> Tuple[str, dict]:
+    conditions, params = [], {}
+
+    def add_in(column: str, values):
+        if values is None:
+            return
+        names = []
+        for i, value in enumerate(values):
+            params[f"{column}_{i}"] = value
+            names.append(f":{column}_{i}")
+        conditions.append(f"c.{column} IN ({', '.join(names) or 'NULL'})")
+
+    if geohash_prefix is not None:
+        prefixes = [geohash_prefix] if isinstance(geohash_prefix, str) else list(geohash_prefix)
+        parts = []
+        for i, prefix in enumerate(prefixes):
+            # a range on the text, so the cube's (geohash, ...) index can be used
+            params[f"prefix_{i}_low"], params[f"prefix_{i}_high"] = prefix, prefix + "~"
+            parts.append(f"(c.geohash >= :prefix_{i}_low AND c.geohash < :prefix_{i}_high)")
+        conditions.append(f"({' OR '.join(parts) or '0'})")
+    add_in("bedrooms", None if bedrooms is None else [int(b) for b in bedrooms])
+    add_in("property_type", property_types)
+    add_in("travel_band", travel_bands)
+    if months is not None:
+        low, high = months
+        if low is not None:
+            params["month_low"] = low
+            conditions.append("c.month >= :month_low")
+        if high is not None:
+            params["month_high"] = high
+            conditions.append("c.month <= :month_high")
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+## Summarise rents per bed over any grouping of the cube's dimensions
+@instr.timed("cube_rollup", rows="result")
+def rollup(engine, by: Sequence[str] = (), geohash_precision: Optional[int] = None,
+           quantiles: Sequence[float] = (0.25, 0.5, 0.75),
+           geohash_prefix: Union[str, Iterable[str], None] = None, bedrooms: Optional[Iterable[int]] = None,
+           property_types: Optional[Iterable[str]] = None, travel_bands: Optional[Iterable[str]] = None,
+           months: Optional[Tuple[Optional[str], Optional[str]]] = None) -> pd.DataFrame:
+    """
+    Rolls the cube up to the `by` dimensions, over the cells matching the filters.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The database holding the cube (see update_cube).
+        by (sequence): Dimensions to group by, out of DIMENSIONS (none gives one overall row).
+        geohash_precision (int): Group geohashes by their first this many characters (default: as stored).
+        quantiles (sequence): Quantiles of rent per bed to estimate, e.g. 0.5 for the median.
+        geohash_prefix (str or list): Keep cells inside these geohash areas.
+        bedrooms, property_types, travel_bands (lists): Keep cells with these values.
+        months (tuple): Inclusive ("YYYY-MM", "YYYY-MM") range; either end may be None.
+
+    Returns:
+        pd.DataFrame: One row per group with listings, mean and sd of the monthly rent per bed,
+        and a p<q> column per quantile (e.g. p50), accurate to SKETCH_ACCURACY.
+    """
+    by = list(by)
+    unknown = set(by) - set(DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Unknown cube dimensions: {sorted(unknown)}")
+    selected = [f"substr(c.geohash, 1, {int(geohash_precision)}) AS geohash"
+                if d == "geohash" and geohash_precision else f"c.{d} AS {d}" for d in by]
+    where, params = _rollup_filters(geohash_prefix, bedrooms, property_types, travel_bands, months)
+    keys = [str(i + 1) for i in range(len(by))]
+    # both queries list the groups in the same order, so the bucket rows line up with the totals
+    group = f" GROUP BY {', '.join(keys)} ORDER BY {', '.join(keys)}" if by else ""
+    totals_sql = (f"SELECT {', '.join(selected + ['SUM(c.count)', 'SUM(c.total)', 'SUM(c.total_sq)'])} "
+                  f"FROM market_cube c{where}{group}")
+    bucket_keys = ", ".join(keys + [str(len(by) + 1)])
+    buckets_sql = (f"SELECT {', '.join(selected + ['b.bucket', 'SUM(b.count)'])} "
+                   f"FROM market_cube c JOIN market_cube_buckets b ON b.cell = c.cell{where} "
+                   f"GROUP BY {bucket_keys} ORDER BY {bucket_keys}")
+    with engine.connect() as connection:
+        totals = connection.execute(text(totals_sql), params).all()
+        buckets = connection.execute(text(buckets_sql), params).all()
+
+    # with no `by` an empty cube still sums to one row of NULLs
+    totals = [row for row in totals if row[-3]]
+    result = pd.DataFrame([row[:-3] for row in totals], columns=by)
+    n = np.array([row[-3] for row in totals], dtype=float)
+    total = np.array([row[-2] for row in totals], dtype=float)
+    total_sq = np.array([row[-1] for row in totals], dtype=float)
+    result["listings"] = n.astype("int64")
+    result["mean"] = total / n if len(n) else []
+    # the sample sd from the running sums (clipped, as rounding can take the variance just below 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = np.clip((total_sq - n * (total / n) ** 2) / (n - 1), 0, None)
+    result["sd"] = np.sqrt(np.where(n > 1, variance, np.nan)) if len(n) else []
+
+    # a quantile is read off the running count of each group's buckets, which come in order
+    counts = np.array([row[-1] for row in buckets], dtype=np.int64)
+    values = bucket_value([row[-2] for row in buckets])
+    group_keys = [row[:-2] for row in buckets]
+    starts = np.array([i for i in range(len(buckets)) if i == 0 or group_keys[i] != group_keys[i - 1]], dtype=np.int64)
+    if len(starts) != len(result):
+        raise RuntimeError("The market cube changed while it was being read")
+    running = np.cumsum(counts)
+    before = np.where(starts > 0, running[starts - 1], 0) if len(starts) else starts
+    for q in quantiles:
+        # the first bucket holding the listing ranked q * (n - 1), counting from 0
+        first = np.searchsorted(running, before + q * (n - 1), side="right")
+        result[f"p{q * 100:g}"] = values[first] if len(first) else []
+    return result
@@ -0,0 +1,162 @@
+# This module compares candidate models of rent per bedroom with K-fold
+# cross-validation, running every (candidate, fold) pair in parallel across
+# cores. The feature matrix is written once to .npy files that each worker
+# memory-maps, so workers share one copy instead of receiving a pickle each.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+# Regressions
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.linear_model import Lasso, LinearRegression, Ridge
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+# Parallel Processing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# File and System Operations
+import os
+import tempfile
+import time
+
+# Tracking
+import logging
+
+
+# CANDIDATES
+
+## Each candidate is a builder for the estimator (a class or module-level function,
+## so it pickles to the workers) and the features it uses (None means every feature)
+def _ridge():
+    return make_pipeline(StandardScaler(), Ridge(alpha=10.0))
+
+def _lasso():
+    return make_pipeline(StandardScaler(), Lasso(alpha=1.0, max_iter=5000))
+
+def _boosting():
+    return HistGradientBoostingRegressor(max_iter=300, learning_rate=0.05, random_state=0)
+
+def _spatial_knn():
+    return make_pipeline(StandardScaler(), KNeighborsRegressor(n_neighbors=15, weights="distance"))
+
+
+CANDIDATES = {
+    # the nb04.py model
+    "baseline_linear": (LinearRegression, ["travel_time", "bathrooms"]),
+    "linear": (LinearRegression, None),
+    "ridge": (_ridge, None),
+    "lasso": (_lasso, None),
+    "gradient_boosting": (_boosting, None),
+    # spatial models: neighbours in location, and boosting on location plus commute
+    "spatial_knn": (_spatial_knn, ["latitude", "longitude"]),
+    "spatial_boosting": (_boosting, ["latitude", "longitude", "travel_time", "bedrooms", "bathrooms"]),
+}
+
+
+# WORKERS
+
+_thread_limits = None
+
+def _limit_threads():
+    # each process already has a core, so stop numpy/OpenMP from oversubscribing it
+    global _thread_limits
+    from threadpoolctl import threadpool_limits
+    _thread_limits = threadpool_limits(1)
+
+
+## Fit and score one candidate on one fold
+def _run_fold(data_dir: str, feature_names: List[str], name: str, fold: int) -> Dict[str, float]:
+    X = np.load(os.path.join(data_dir, "X.npy"), mmap_mode="r")
+    y = np.load(os.path.join(data_dir, "y.npy"), mmap_mode="r")
+    folds = np.load(os.path.join(data_dir, "folds.npy"), mmap_mode="r")
+
+    build, columns = CANDIDATES[name]
+    col_idx = [feature_names.index(c) for c in columns] if columns else list(range(len(feature_names)))
+    train, test = folds != fold, folds == fold
+    # np.ix_ picks rows and columns in one step, so each fold copies just its own
+    # rows x columns out of the shared map (X[train][:, col_idx] would first copy every column)
+    X_train, X_test = X[np.ix_(train, col_idx)], X[np.ix_(test, col_idx)]
+
+    estimator = build()
+    start = time.perf_counter()
+    estimator.fit(X_train, y[train])
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    predictions = estimator.predict(X_test)
+    predict_seconds = time.perf_counter() - start
+
+    return {
+        "candidate": name,
+        "fold": fold,
+        "rmse": float(np.sqrt(mean_squared_error(y[test], predictions))),
+        "mae": float(mean_absolute_error(y[test], predictions)),
+        "r2": float(r2_score(y[test], predictions)),
+        "fit_seconds": fit_seconds,
+        "predict_seconds": predict_seconds,
+        "n_train": int(train.sum()),
+        "n_test": int(test.sum()),
+    }
+
+
+# THE SEARCH
+
+## Cross-validate every candidate in parallel
+def run_search(X: pd.DataFrame, y, candidates: Optional[Sequence[str]] = None, folds: int = 5,
+               n_jobs: Optional[int] = None, random_state: int = 0) -> pd.DataFrame:
+    """
+    Cross-validates candidate models on a feature matrix, spreading the
+    (candidate, fold) fits over a process pool.
+
+    Args:
+        X (pd.DataFrame): The feature matrix (e.g. from modeling.FeatureBuilder).
+        y (array-like): The target.
+        candidates (list): Names from CANDIDATES (default: all of them).
+        folds (int): Number of folds.
+        n_jobs (int): Worker processes (default: every core).
+        random_state (int): Seed for the fold assignment.
+
+    Returns:
+        pd.DataFrame: One row per candidate with mean (and std) RMSE, MAE, R2,
+        fit time and predict time across folds, best RMSE first.
+    """
+    candidates = list(candidates or CANDIDATES)
+    unknown = [c for c in candidates if c not in CANDIDATES]
+    if unknown:
+        raise ValueError(f"Unknown candidates {unknown}, expected some of {list(CANDIDATES)}")
+    feature_names = list(X.columns)
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    rng = np.random.default_rng(random_state)
+    fold_of_row = rng.permutation(np.arange(len(X)) % folds)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        np.save(os.path.join(data_dir, "X.npy"), X.to_numpy(dtype=np.float64))
+        np.save(os.path.join(data_dir, "y.npy"), np.asarray(y, dtype=np.float64))
+        np.save(os.path.join(data_dir, "folds.npy"), fold_of_row.astype(np.int16))
+
+        results = []
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_limit_threads) as pool:
+            futures = [pool.submit(_run_fold, data_dir, feature_names, name, fold)
+                       for name in candidates for fold in range(folds)]
+            for future in as_completed(futures):
+                result = future.result()
+                logging.info(f'{result["candidate"]} fold {result["fold"]}: rmse {result["rmse"]:.1f} '
+                             f'(fit {result["fit_seconds"]:.2f}s)')
+                results.append(result)
+        logging.info(f'Model search finished in {time.perf_counter() - start:.1f}s on {n_jobs} workers')
+
+    per_fold = pd.DataFrame(results)
+    summary = per_fold.groupby("candidate").agg(
+        rmse=("rmse", "mean"), rmse_std=("rmse", "std"),
+        mae=("mae", "mean"), r2=("r2", "mean"),
+        fit_seconds=("fit_seconds", "mean"), predict_seconds=("predict_seconds", "mean"),
+    )
+    return summary.sort_values("rmse").reset_index()
@@ -0,0 +1,279 @@
+# This module fits and applies hedonic models of rent per bedroom.
+# It builds a reusable feature matrix from properties_data, fits models with
+# cross-validation, saves versioned model artifacts, and scores only the
+# rows that do not have a prediction yet.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Regressions
+from sklearn.base import clone
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import KFold, cross_validate
+import joblib
+
+# Database Connection
+from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+from rental_utils import functions as rent
+from rental_utils import uncertainty
+from rental_utils.text_features import KEYWORDS, TextEmbedder, keyword_flags, listing_text
+from rental_utils import instrumentation as instr
+
+# File and System Operations
+import os
+import json
+from datetime import datetime, timezone
+
+# Tracking
+import logging
+
+
+# FEATURES
+
+## Numeric characteristics used as they are (missing values are filled with the training median)
+NUMERIC_FEATURES = ["bedrooms", "bathrooms", "travel_time", "distance", "latitude", "longitude"]
+
+@dataclass
+class FeatureBuilder:
+    """
+    Turns properties_data rows into a numeric feature matrix.
+
+    `fit` learns what depends on the training data (fill values and the property
+    types to one-hot encode), so `transform` gives the same columns on new rows.
+    With `embedding_model` set, the listing text is also embedded (see
+    text_features.TextEmbedder) into `emb_*` columns, cached on disk at
+    `embedding_cache` so each text is only encoded once.
+    """
+    numeric: List[str] = field(default_factory=lambda: list(NUMERIC_FEATURES))
+    categorical: str = "propertySubType"
+    max_categories: int = 12
+    keywords: Dict[str, str] = field(default_factory=lambda: dict(KEYWORDS))
+    fill_values: Dict[str, float] = field(default_factory=dict)
+    categories: List[str] = field(default_factory=list)
+    embedding_model: Optional[str] = None
+    embedding_cache: Optional[str] = None
+    embedding_dim: int = 0
+    _embedder: Optional[TextEmbedder] = field(default=None, init=False, repr=False, compare=False)
+
+    def __getstate__(self):
+        # the embedder holds a model and an open cache, so it is recreated after loading
+        state = self.__dict__.copy()
+        state["_embedder"] = None
+        return state
+
+    def _embed(self, df: pd.DataFrame) -> np.ndarray:
+        if self._embedder is None:
+            self._embedder = TextEmbedder(self.embedding_model, cache_path=self.embedding_cache)
+        return self._embedder.embed(listing_text(df).tolist())
+
+    def fit(self, df: pd.DataFrame) -> "FeatureBuilder":
+        self.fill_values = {
+            col: float(pd.to_numeric(df[col], errors="coerce").median()) if col in df.columns else 0.0
+            for col in self.numeric
+        }
+        if self.categorical in df.columns:
+            counts = df[self.categorical].fillna("Unknown").value_counts()
+            self.categories = counts.index[:self.max_categories].tolist()
+        if self.embedding_model:
+            self.embedding_dim = self._embed(df.head(1)).shape[1]
+        return self
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        features = pd.DataFrame(index=df.index)
+        for col in self.numeric:
+            values = pd.to_numeric(df[col], errors="coerce") if col in df.columns else pd.Series(np.nan, index=df.index)
+            features[col] = values.astype(float).fillna(self.fill_values.get(col, 0.0))
+        if self.categories:
+            kind = df[self.categorical].fillna("Unknown") if self.categorical in df.columns else pd.Series("Unknown", index=df.index)
+            # the first category is the baseline, and unseen types fall into it too
+            for category in self.categories[1:]:
+                features[f"type_{category}"] = (kind == category).astype(np.int8)
+        features = features.join(keyword_flags(df, self.keywords))
+        if self.embedding_model and len(df):
+            embedded = pd.DataFrame(self._embed(df), index=df.index,
+                                    columns=[f"emb_{i}" for i in range(self.embedding_dim)])
+            features = features.join(embedded)
+        elif self.embedding_model:
+            features = features.reindex(columns=self.feature_names)
+        return features
+
+    @property
+    def feature_names(self) -> List[str]:
+        return (list(self.numeric) + [f"type_{c}" for c in self.categories[1:]]
+                + [f"kw_{name}" for name in self.keywords]
+                + [f"emb_{i}" for i in range(self.embedding_dim if self.embedding_model else 0)])
+
+
+# MODELS
+
+@dataclass
+class HedonicModel:
+    """A fitted feature builder and estimator, with the cross-validation scores they got."""
+    builder: FeatureBuilder
+    estimator: object
+    cv_scores: Dict[str, float] = field(default_factory=dict)
+    n_rows: int = 0
+    version: Optional[str] = None
+    bootstrap: Optional[uncertainty.LinearBootstrap] = None
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        return self.estimator.predict(self.builder.transform(df).to_numpy())
+
+    ## Standard deviation of each prediction (None if the model has no bootstrap)
+    def predict_sd(self, df: pd.DataFrame) -> Optional[np.ndarray]:
+        if self.bootstrap is None:
+            return None
+        return self.bootstrap.predict_sd(self.builder.transform(df).to_numpy())
+
+    ## Prediction intervals (None if the model has no bootstrap)
+    def predict_intervals(self, df: pd.DataFrame, level: float = 0.9) -> Optional[pd.DataFrame]:
+        if self.bootstrap is None:
+            return None
+        intervals = self.bootstrap.intervals(self.builder.transform(df).to_numpy(), level)
+        intervals.index = df.index
+        return intervals
+
+
+## Fit a model on cleaned regression data, reporting its cross-validated accuracy
+@instr.timed("fit_model", rows=0)
+def fit_model(reg_data: pd.DataFrame, estimator=None, cv: int = 5,
+              target: str = "price_per_bed", random_state: int = 0, n_bootstrap: int = 0,
+              embedding_model: Optional[str] = None, embedding_cache: Optional[str] = None) -> HedonicModel:
+    """
+    Fits a hedonic model of `target` on the output of `clean_for_reg`.
+
+    The estimator (LinearRegression by default) is scored with K-fold
+    cross-validation first, then refit on all the rows.
+
+    Args:
+        reg_data (pd.DataFrame): Cleaned rows to fit on.
+        estimator: Any scikit-learn regressor.
+        cv (int): Number of folds.
+        target (str): The column to predict.
+        random_state (int): Seed for the fold shuffle.
+        n_bootstrap (int): Bootstrap replicates to keep for prediction intervals
+            (linear regressions only; see uncertainty.bootstrap_predictions for others).
+        embedding_model (str): A sentence-transformers model to embed the listing
+            text with (default: keyword flags only). Needs torch and transformers.
+        embedding_cache (str): SQLite file caching the embeddings between runs.
+
+    Returns:
+        HedonicModel: The fitted model.
+    """
+    estimator = LinearRegression() if estimator is None else estimator
+    builder = FeatureBuilder(embedding_model=embedding_model, embedding_cache=embedding_cache).fit(reg_data)
+    X = builder.transform(reg_data).to_numpy()
+    y = reg_data[target].to_numpy(dtype=float)
+
+    folds = KFold(n_splits=cv, shuffle=True, random_state=random_state)
+    scores = cross_validate(clone(estimator), X, y, cv=folds,
+                            scoring=("r2", "neg_root_mean_squared_error", "neg_mean_absolute_error"))
+    cv_scores = {
+        "r2": float(np.mean(scores["test_r2"])),
+        "rmse": float(-np.mean(scores["test_neg_root_mean_squared_error"])),
+        "mae": float(-np.mean(scores["test_neg_mean_absolute_error"])),
+    }
+    logging.info(f'Cross-validated {type(estimator).__name__}: {cv_scores}')
+
+    fitted = clone(estimator).fit(X, y)
+    bootstrap = None
+    if n_bootstrap:
+        if type(estimator) is LinearRegression:
+            bootstrap = uncertainty.bootstrap_ols(X, y, n_boot=n_bootstrap, seed=random_state)
+        else:
+            logging.warning(f'No stored bootstrap for {type(estimator).__name__}; '
+                            'use uncertainty.bootstrap_predictions instead')
+    return HedonicModel(builder=builder, estimator=fitted, cv_scores=cv_scores, n_rows=len(reg_data),
+                        bootstrap=bootstrap)
+
+
+# ARTIFACTS
+
+## Save a model as the next version in a folder
+def save_model(model: HedonicModel, model_dir: str) -> str:
+    """
+    Writes the model to `model_dir/<version>/` (model.joblib plus metadata.json)
+    and points `model_dir/LATEST` at it. Versions count up: v0001, v0002, ...
+
+    Returns:
+        str: The new version.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    existing = [int(name[1:]) for name in os.listdir(model_dir) if name.startswith("v") and name[1:].isdigit()]
+    version = f"v{max(existing, default=0) + 1:04d}"
+    path = os.path.join(model_dir, version)
+    os.makedirs(path)
+
+    model.version = version
+    joblib.dump(model, os.path.join(path, "model.joblib"))
+    metadata = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "estimator": type(model.estimator).__name__,
+        "features": model.builder.feature_names,
+        "n_rows": model.n_rows,
+        "cv_scores": model.cv_scores,
+        "bootstrap_replicates": 0 if model.bootstrap is None else len(model.bootstrap.coefs),
+    }
+    with open(os.path.join(path, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    with open(os.path.join(model_dir, "LATEST"), "w", encoding="utf-8") as f:
+        f.write(version)
+    logging.info(f'Saved model {version} to {path}')
+    return version
+
+
+## Load a saved model (the latest unless a version is given)
+def load_model(model_dir: str, version: Optional[str] = None) -> Optional[HedonicModel]:
+    """Returns the saved model, or None if nothing has been saved in `model_dir` yet."""
+    if version is None:
+        latest = os.path.join(model_dir, "LATEST")
+        if not os.path.exists(latest):
+            return None
+        with open(latest, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    return joblib.load(os.path.join(model_dir, version, "model.joblib"))
+
+
+# SCORING
+
+## Predict only the rows that have no prediction yet
+@instr.timed("score_missing", rows="result")
+def score_missing(engine, model: HedonicModel, query: Optional[pq.PropertyQuery] = None,
+                  batch_size: int = 10_000) -> int:
+    """
+    Fills in predicted_price_per_bed for rows where it is NULL, in batches,
+    writing each batch back with `bulk_update`. Rows that already have a
+    prediction are never read. Models with a bootstrap also fill in prediction_sd.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The database holding properties_data.
+        model (HedonicModel): The model to score with.
+        query (PropertyQuery): Which rows are eligible (default: those `clean_for_reg` keeps).
+        batch_size (int): Rows scored at a time.
+
+    Returns:
+        int: The number of rows scored.
+    """
+    query = (query or pq.regression_query()).but(predicted_missing=True)
+    # only the ids are read up front, so writing predictions never disturbs an open cursor
+    ids = query.but(columns=["id"]).read(engine)["id"].tolist()
+    scored = 0
+    for start in range(0, len(ids), batch_size):
+        batch = query.but(ids=ids[start:start + batch_size]).read(engine)
+        batch = rent.clean_for_reg(batch)
+        if batch.empty:
+            continue
+        updates = pd.DataFrame({"id": batch["id"], "predicted_price_per_bed": model.predict(batch)})
+        if model.bootstrap is not None:
+            updates["prediction_sd"] = model.predict_sd(batch)
+        scored += sqlq.bulk_update("properties_data", updates, "id", list(updates.columns[1:]),
+                                   engine, only_null=True)
+    logging.info(f'Scored {scored} new properties with model {model.version}')
+    return scored
@@ -0,0 +1,233 @@
+# This module fits linear hedonic models incrementally. Instead of refitting
+# on the whole history for every crawl, it keeps the sufficient statistics of
+# ordinary least squares (X'X, X'y, y'y and the row count) per segment, e.g.
+# per city, property type and month, adds each new batch of rows to them, and
+# gets the coefficients from a small (p+1) x (p+1) solve. Refreshing the
+# model therefore costs O(new rows), and segments can be pooled for free.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Sequence
+
+# Database Connection
+from sqlalchemy import text
+
+# File and System Operations
+import json
+
+# Tracking
+import logging
+
+
+# SQL
+
+## One row of statistics per model and segment
+CREATE_REGRESSION_STATS_SQL_QUERY = """
+CREATE TABLE IF NOT EXISTS regression_stats (
+    model TEXT NOT NULL,
+    segment TEXT NOT NULL,
+    n REAL NOT NULL,
+    xtx TEXT NOT NULL,
+    xty TEXT NOT NULL,
+    yty REAL NOT NULL,
+    features TEXT NOT NULL,
+    shift TEXT NOT NULL,
+    PRIMARY KEY (model, segment)
+);
+"""
+
+
+# SEGMENTS
+
+## Build segment labels from columns of a dataframe
+def make_segments(df: pd.DataFrame, by: Sequence[str] = ("propertySubType", "month")) -> pd.Series:
+    """
+    Returns one segment label per row, joining the values of the `by` columns
+    with "|". "month" is derived from firstVisibleDate (YYYY-MM) when the frame
+    has no month column; missing values become "NA".
+    """
+    parts = []
+    for col in by:
+        if col == "month" and "month" not in df.columns:
+            values = pd.to_datetime(df["firstVisibleDate"], errors="coerce", utc=True).dt.strftime("%Y-%m")
+        else:
+            values = df[col]
+        parts.append(values.astype(object).where(values.notna(), "NA").astype(str))
+    if not parts:
+        return pd.Series("ALL", index=df.index)
+    labels = parts[0]
+    for part in parts[1:]:
+        labels = labels + "|" + part
+    return labels
+
+
+# THE ESTIMATOR
+
+@dataclass
+class SegmentStats:
+    """The OLS sufficient statistics of one segment, for the design [1, X - shift]."""
+    n: float
+    xtx: np.ndarray
+    xty: np.ndarray
+    yty: float
+
+    def __add__(self, other: "SegmentStats") -> "SegmentStats":
+        return SegmentStats(self.n + other.n, self.xtx + other.xtx, self.xty + other.xty, self.yty + other.yty)
+
+
+@dataclass
+class IncrementalLinearRegression:
+    """
+    Ordinary least squares with an intercept, fitted from accumulated X'X and X'y.
+
+    `partial_fit` adds rows (or, with negative weights, takes them back out), per
+    segment. Coefficients for a segment, or for all segments pooled, solve the
+    normal equations and match a batch LinearRegression fit on the same rows.
+    Features are shifted by the first batch's means before accumulating, which
+    keeps X'X well conditioned without changing the fitted model.
+    """
+    features: List[str]
+    stats: Dict[Hashable, SegmentStats] = field(default_factory=dict)
+    shift: Optional[np.ndarray] = None
+
+    @property
+    def n_params(self) -> int:
+        return len(self.features) + 1
+
+    def _design(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=float)
+        return np.column_stack([np.ones(len(X)), X - self.shift])
+
+    ## Add a batch of rows to the statistics
+    def partial_fit(self, X, y, segments=None, sample_weight=None) -> "IncrementalLinearRegression":
+        """
+        Accumulates rows into the statistics of their segments.
+
+        Args:
+            X (array-like): n x p feature matrix, columns in the order of `features`.
+            y (array-like): The n targets.
+            segments (array-like): A segment label per row (default: one "ALL" segment).
+            sample_weight (array-like): Row weights; -1 removes rows added earlier.
+        """
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if len(X) == 0:
+            return self
+        if self.shift is None:
+            self.shift = X.mean(axis=0)
+        design = self._design(X)
+        weights = np.ones(len(X)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+        labels = np.full(len(X), "ALL", dtype=object) if segments is None else np.asarray(segments, dtype=object)
+
+        codes, uniques = pd.factorize(labels)
+        for code, segment in enumerate(uniques):
+            rows = codes == code
+            Xs, ys, ws = design[rows], y[rows], weights[rows]
+            Xw = Xs * ws[:, None]
+            batch = SegmentStats(ws.sum(), Xw.T @ Xs, Xw.T @ ys, float(ws @ (ys * ys)))
+            self.stats[segment] = self.stats[segment] + batch if segment in self.stats else batch
+        return self
+
+    ## Pool the statistics of some (or all) segments
+    def pooled(self, segments=None) -> SegmentStats:
+        chosen = self.stats.keys() if segments is None else segments
+        total = SegmentStats(0.0, np.zeros((self.n_params, self.n_params)), np.zeros(self.n_params), 0.0)
+        for segment in chosen:
+            if segment in self.stats:
+                total = total + self.stats[segment]
+        return total
+
+    ## Solve for the coefficients of a segment (None pools every segment)
+    def coefficients(self, segment=None) -> Dict[str, float]:
+        """
+        Returns {"intercept": ..., feature: ...} for one segment, or for all
+        segments pooled. Rank-deficient systems get the minimum-norm solution.
+        """
+        stats = self.pooled() if segment is None else self.stats[segment]
+        beta = _solve(stats)
+        # undo the shift: y = b0 + b.(x - shift) = (b0 - b.shift) + b.x
+        intercept = beta[0] - beta[1:] @ self.shift
+        return {"intercept": float(intercept), **dict(zip(self.features, beta[1:].tolist()))}
+
+    ## Residual variance of a segment's (or the pooled) fit
+    def residual_variance(self, segment=None) -> float:
+        stats = self.pooled() if segment is None else self.stats[segment]
+        beta = _solve(stats)
+        # RSS = y'y - 2 b'X'y + b'X'X b
+        rss = stats.yty - 2 * beta @ stats.xty + beta @ stats.xtx @ beta
+        dof = max(stats.n - self.n_params, 1.0)
+        return float(max(rss, 0.0) / dof)
+
+    ## Predict, using each row's segment model where it has enough rows and the pooled model otherwise
+    def predict(self, X, segments=None, min_rows: Optional[int] = None) -> np.ndarray:
+        design = self._design(X)
+        pooled_beta = _solve(self.pooled())
+        if segments is None:
+            return design @ pooled_beta
+        min_rows = 2 * self.n_params if min_rows is None else min_rows
+        labels = np.asarray(segments, dtype=object)
+        predictions = design @ pooled_beta
+        codes, uniques = pd.factorize(labels)
+        for code, segment in enumerate(uniques):
+            stats = self.stats.get(segment)
+            if stats is None or stats.n < min_rows:
+                continue
+            rows = codes == code
+            predictions[rows] = design[rows] @ _solve(stats)
+        return predictions
+
+    ## Convenience wrapper taking a dataframe
+    def partial_fit_frame(self, df: pd.DataFrame, target: str = "price_per_bed",
+                          segment_by: Sequence[str] = ("propertySubType", "month")) -> "IncrementalLinearRegression":
+        """Accumulates the rows of a (cleaned) dataframe, segmented by `segment_by`."""
+        rows = df.dropna(subset=list(self.features) + [target])
+        return self.partial_fit(rows[self.features].to_numpy(dtype=float), rows[target].to_numpy(dtype=float),
+                                make_segments(rows, segment_by) if segment_by else None)
+
+    # PERSISTENCE
+
+    ## Write the statistics to the database
+    def save(self, engine, name: str):
+        """Upserts one regression_stats row per segment under the model name `name`."""
+        rows = [{
+            "model": name, "segment": str(segment), "n": float(s.n),
+            "xtx": json.dumps(s.xtx.tolist()), "xty": json.dumps(s.xty.tolist()), "yty": float(s.yty),
+            "features": json.dumps(self.features), "shift": json.dumps(self.shift.tolist()),
+        } for segment, s in self.stats.items()]
+        with engine.begin() as connection:
+            connection.execute(text(CREATE_REGRESSION_STATS_SQL_QUERY))
+            connection.execute(text("DELETE FROM regression_stats WHERE model = :model"), {"model": name})
+            if rows:
+                connection.execute(text("""
+                    INSERT INTO regression_stats (model, segment, n, xtx, xty, yty, features, shift)
+                    VALUES (:model, :segment, :n, :xtx, :xty, :yty, :features, :shift)
+                """), rows)
+        logging.info(f'Saved regression statistics for {name} ({len(rows)} segments)')
+
+    ## Read statistics saved earlier
+    @classmethod
+    def load(cls, engine, name: str) -> Optional["IncrementalLinearRegression"]:
+        """Returns the model saved as `name`, or None if there is none."""
+        with engine.begin() as connection:
+            connection.execute(text(CREATE_REGRESSION_STATS_SQL_QUERY))
+            rows = connection.execute(
+                text("SELECT * FROM regression_stats WHERE model = :model"), {"model": name}
+            ).mappings().all()
+        if not rows:
+            return None
+        model = cls(features=json.loads(rows[0]["features"]), shift=np.array(json.loads(rows[0]["shift"])))
+        for row in rows:
+            model.stats[row["segment"]] = SegmentStats(
+                row["n"], np.array(json.loads(row["xtx"])), np.array(json.loads(row["xty"])), row["yty"]
+            )
+        return model
+
+
+def _solve(stats: SegmentStats) -> np.ndarray:
+    # lstsq on the normal equations gives the exact solution when X'X is full rank
+    # and the minimum-norm one when it is not (e.g. a segment with very few rows)
+    return np.linalg.lstsq(stats.xtx, stats.xty, rcond=None)[0]
@@ -0,0 +1,563 @@
+# This module runs the nb01-nb05 steps unattended, as a graph of stages:
+# scrape -> load -> travel_time -> model -> {sync, recommend, cube}. Each stage
+# fingerprints its inputs (the scrape parameters, the scraped file, the rows
+# still missing travel times, the regression data, the change log) and is
+# skipped when they are as it left them after its last successful run.
+# Given several towns, scrape and load become the multi-city crawl in
+# crawl.py: concurrent per-town scrapes, cleaned in worker processes.
+# Stages whose dependencies are done run concurrently, and every run appends
+# the per-stage wall times to a JSON lines log.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Database Connection
+from sqlalchemy import text
+from rental_utils import functions as rent
+from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+from rental_utils import replication as repl
+from rental_utils import modeling
+from rental_utils import ranking
+from rental_utils import crawl
+from rental_utils import market_cube
+from rental_utils import scrape_archive
+from rental_utils import instrumentation as instr
+
+# Parallel Processing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+
+# File and System Operations
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from datetime import datetime, timezone
+
+# Tracking
+import logging
+
+
+# PARAMETERS
+
+@dataclass(frozen=True)
+class PipelineParams:
+    """
+    Everything the interactive scripts used to ask for, plus where things live.
+
+    Args:
+        data_dir (str): Folder holding properties.db, the scraped json, models and pipeline state.
+        city (str): The UK town or city to scrape.
+        cities (tuple): Towns to crawl together instead of `city` (see crawl); listings are tagged with their town.
+        total_results (int): How many listings to scrape.
+        scrape_max_age_hours (float): A scrape younger than this is reused.
+        transportation_type (str): The TravelTime transport mode.
+        refit (bool): Fit a new model when the regression data has changed (otherwise only score new rows).
+        n_bootstrap (int): Bootstrap replicates kept with a newly fitted model.
+        embedding_model (str): Also embed the listing text with this sentence-transformers model
+            when fitting (see modeling.FeatureBuilder); the embeddings are cached in models/embeddings.db.
+        budgets (tuple): Budgets (rent per bedroom) to write recommendations for.
+        k (int): Listings recommended per budget.
+        rank_by (str): "savings" or "savings_z".
+        sync (bool): Replicate to Supabase after modelling.
+        travel_credentials_path (str): TravelTime credentials (app_id, api_key).
+        supabase_credentials_path (str): Supabase credentials (host, password).
+        jobs (int): Stages run at once.
+        workers (int): Processes cleaning the towns of a multi-city crawl (default: one per core).
+        crawl_concurrency (int): Towns scraped at once in a multi-city crawl.
+        metrics (bool): Record spans and metrics to data_dir/metrics (see instrumentation).
+    """
+    data_dir: str
+    city: str = "london"
+    cities: Tuple[str, ...] = ()
+    total_results: int = 250
+    scrape_max_age_hours: float = 24.0
+    transportation_type: str = "public_transport"
+    refit: bool = False
+    n_bootstrap: int = 2000
+    embedding_model: Optional[str] = None
+    budgets: Tuple[float, ...] = (1000.0,)
+    k: int = 50
+    rank_by: str = "savings_z"
+    sync: bool = True
+    travel_credentials_path: Optional[str] = None
+    supabase_credentials_path: Optional[str] = None
+    jobs: int = 2
+    workers: Optional[int] = None
+    crawl_concurrency: int = crawl.CRAWL_CONCURRENCY
+    metrics: bool = False
+
+    @property
+    def db_path(self) -> str:
+        return os.path.join(self.data_dir, "properties.db")
+
+    @property
+    def scrape_path(self) -> str:
+        return os.path.join(self.data_dir, "rightmove_properties.json")
+
+    @property
+    def partition_paths(self) -> List[str]:
+        return [crawl.partition_path(self.data_dir, city) for city in crawl.unique_cities(self.cities)]
+
+    @property
+    def archive_dir(self) -> str:
+        return crawl.archive_path(self.data_dir)
+
+    @property
+    def model_dir(self) -> str:
+        return os.path.join(self.data_dir, "models")
+
+    @property
+    def embedding_cache_path(self) -> str:
+        return os.path.join(self.model_dir, "embeddings.db")
+
+    @property
+    def recommendations_path(self) -> str:
+        return os.path.join(self.data_dir, "recommendations.json")
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.data_dir, "pipeline_state.json")
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.data_dir, "pipeline_runs.jsonl")
+
+    @property
+    def metrics_dir(self) -> str:
+        return os.path.join(self.data_dir, "metrics")
+
+
+# STAGES
+
+@dataclass
+class Stage:
+    """
+    One step of the pipeline.
+
+    `run` does the work and returns a small summary; `fingerprint` describes
+    the stage's inputs as JSON-able data. A stage is skipped when its
+    fingerprint equals the one taken straight after its last successful run,
+    all its `outputs` exist, and that run is younger than `max_age` seconds.
+    A stage waits for its `deps`, and is blocked if one of them fails; it also
+    waits for the stages in `after`, but runs whether or not they succeed
+    (used to keep two SQLite writers apart).
+    """
+    name: str
+    run: Callable[[PipelineParams], Dict[str, object]]
+    fingerprint: Callable[[PipelineParams], object]
+    deps: Tuple[str, ...] = ()
+    after: Tuple[str, ...] = ()
+    outputs: Callable[[PipelineParams], List[str]] = field(default=lambda params: [])
+    max_age: Optional[float] = None
+
+
+## A stable digest of any JSON-able value
+def digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+## A digest of a file's contents, read in blocks
+def file_digest(path: str, block_size: int = 1 << 20) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+## A digest of the rows a query returns, ignoring some columns
+def frame_digest(engine, query: pq.PropertyQuery, exclude: Tuple[str, ...] = ()) -> str:
+    rows = query.read(engine)
+    rows = rows.drop(columns=[c for c in exclude if c in rows.columns]).sort_values("id")
+    hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+    return hashlib.sha256(hashes.tobytes() + ",".join(rows.columns).encode("utf-8")).hexdigest()
+
+
+## The number of changes ever logged on properties_data (it only grows, even after compaction)
+def data_version(engine) -> int:
+    with engine.connect() as connection:
+        version = connection.execute(text(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'properties_changes'"
+        )).scalar()
+    return int(version or 0)
+
+
+def _engine(params: PipelineParams):
+    return sqlq.get_sql_engine(params.db_path)
+
+
+def _load_credentials(path: Optional[str], purpose: str) -> dict:
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError(f"No {purpose} credentials found at {path}")
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+## scrape (nb01.py)
+
+def _scrape(params: PipelineParams) -> Dict[str, object]:
+    if params.cities:
+        return _scrape_cities(params)
+
+    async def search():
+        chosen_id = (await rent.find_locations(params.city))[0]
+        logging.info(f'City id found to be: {chosen_id}')
+        return await rent.scrape_search(chosen_id, params.total_results)
+
+    results = asyncio.run(search())
+    # written to a temporary file first, so a failed scrape never leaves half a file behind
+    partial = params.scrape_path + ".partial"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+    os.replace(partial, params.scrape_path)
+    # the file only holds the latest scrape, so every scrape is also kept in the archive
+    archived = scrape_archive.ScrapeArchive(params.archive_dir).add(results, source=crawl.city_slug(params.city))
+    return {"listings": len(results), "archived": archived}
+
+
+def _scrape_cities(params: PipelineParams) -> Dict[str, object]:
+    results = asyncio.run(crawl.crawl_cities(params.cities, params.data_dir, params.total_results,
+                                             concurrency=params.crawl_concurrency))
+    failed = sorted(city for city, result in results.items() if "error" in result)
+    if len(failed) == len(results):
+        raise RuntimeError(f"Every town failed to crawl: {failed}")
+    # towns that failed leave no partition, so the stage is not current and runs again next time
+    return {"towns": len(results), "failed": failed,
+            "listings": sum(result.get("listings", 0) for result in results.values())}
+
+
+def _scrape_fingerprint(params: PipelineParams):
+    if params.cities:
+        return {"cities": [crawl.city_slug(city) for city in crawl.unique_cities(params.cities)],
+                "total_results": params.total_results}
+    return {"city": params.city.lower(), "total_results": params.total_results}
+
+
+def _scrape_outputs(params: PipelineParams) -> List[str]:
+    return params.partition_paths if params.cities else [params.scrape_path]
+
+
+## load (nb02.py)
+
+def _load(params: PipelineParams) -> Dict[str, object]:
+    if params.cities:
+        return _load_cities(params)
+    with open(params.scrape_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    clean_df = rent.clean_column_names(rent.filter_df(pd.json_normalize(data, max_level=1)))
+    clean_df["city"] = crawl.city_slug(params.city)
+    # listings already in the table are left alone (bar a missing city), so reloading the same file changes nothing
+    merged = crawl.merge_city(clean_df, _engine(params))
+    return {"listings": len(clean_df), "new": merged["new"], "tagged": merged["tagged"]}
+
+
+def _load_cities(params: PipelineParams) -> Dict[str, object]:
+    # travel times are fetched by the workers when there are credentials, otherwise left to travel_time
+    credentials = None
+    if params.travel_credentials_path and os.path.exists(params.travel_credentials_path):
+        credentials = _load_credentials(params.travel_credentials_path, "TravelTime")
+    results = crawl.load_cities(params.cities, params.data_dir, _engine(params), workers=params.workers,
+                                credentials=credentials, transportation_type=params.transportation_type)
+    failed = sorted(city for city, result in results.items() if "error" in result)
+    if len(failed) == len(results):
+        raise RuntimeError(f"Every town failed to load: {failed}")
+    return {"towns": len(results), "failed": failed,
+            "listings": sum(result.get("listings", 0) for result in results.values()),
+            "new": sum(result.get("new", 0) for result in results.values()),
+            "tagged": sum(result.get("tagged", 0) for result in results.values())}
+
+
+def _load_fingerprint(params: PipelineParams):
+    if params.cities:
+        return [file_digest(path) for path in params.partition_paths]
+    return file_digest(params.scrape_path)
+
+
+## travel_time (nb03.py)
+
+def _missing_travel_times() -> pq.PropertyQuery:
+    # rows without coordinates cannot be sent (the bounds also exclude NULLs)
+    return pq.PropertyQuery(columns=["id", "latitude", "longitude"], travel_time_missing=True,
+                            latitude=(-90, 90), longitude=(-180, 180))
+
+
+def _travel_time(params: PipelineParams) -> Dict[str, object]:
+    engine = _engine(params)
+    missing = _missing_travel_times().read(engine)
+    if missing.empty:
+        return {"requested": 0, "updated": 0}
+    credentials = _load_credentials(params.travel_credentials_path, "TravelTime")
+    results = rent.fetch_travel_times(missing, credentials, params.transportation_type)
+    # the API returns ids as strings, so cast back to match the table's key
+    updates = results[["id", "travel_time", "distance"]].astype({"id": int})
+    updated = sqlq.bulk_update("properties_data", updates, "id", ["travel_time", "distance"], engine, only_null=True)
+    return {"requested": len(missing), "updated": updated}
+
+
+def _travel_time_fingerprint(params: PipelineParams):
+    # the listings the API could not reach stay missing, and are not asked about again until new ones arrive
+    missing = _missing_travel_times().but(columns=["id"]).read(_engine(params))["id"]
+    return {"transportation_type": params.transportation_type,
+            "missing": len(missing), "ids": digest(sorted(missing.tolist()))}
+
+
+## model (nb04.py)
+
+PREDICTION_COLUMNS = ("predicted_price_per_bed", "prediction_sd", "updated_at")
+
+
+def _model(params: PipelineParams) -> Dict[str, object]:
+    engine = _engine(params)
+    model = modeling.load_model(params.model_dir)
+    fitted = model is None or params.refit
+    if fitted:
+        reg_data = rent.clean_for_reg(pq.regression_query().read(engine))
+        model = modeling.fit_model(reg_data, n_bootstrap=params.n_bootstrap, embedding_model=params.embedding_model,
+                                   embedding_cache=params.embedding_cache_path)
+        modeling.save_model(model, params.model_dir)
+        # a new model replaces every prediction, so clear the old ones first
+        with engine.begin() as connection:
+            connection.execute(text("UPDATE properties_data SET predicted_price_per_bed = NULL, prediction_sd = NULL"))
+    scored = modeling.score_missing(engine, model)
+    return {"model": model.version, "fitted": fitted, "scored": scored}
+
+
+def _model_fingerprint(params: PipelineParams):
+    # the predictions are the stage's own output, so they are left out of its inputs
+    rows = frame_digest(_engine(params), pq.regression_query(), exclude=PREDICTION_COLUMNS)
+    latest = os.path.join(params.model_dir, "LATEST")
+    version = open(latest, "r", encoding="utf-8").read().strip() if os.path.exists(latest) else None
+    fingerprint = {"rows": rows, "model": version, "refit": params.refit, "n_bootstrap": params.n_bootstrap}
+    if params.embedding_model:
+        fingerprint["embedding_model"] = params.embedding_model
+    return fingerprint
+
+
+## sync (the end of nb04.py)
+
+def _sync(params: PipelineParams) -> Dict[str, object]:
+    credentials = _load_credentials(params.supabase_credentials_path, "Supabase")
+    engine = _engine(params)
+    supabase_engine = sqlq.get_supabase_engine(
+        user="postgres",
+        password=credentials['password'],
+        host=credentials['host'],
+        port=5432,
+        database="postgres"
+    )
+    # a new cloud database gets the full table; one created before these columns existed gets them added
+    with supabase_engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    sqlq.ensure_column(supabase_engine, "properties_data", "prediction_sd", "REAL")
+    sqlq.ensure_column(supabase_engine, "properties_data", "city", "TEXT")
+    sqlq.ensure_column(supabase_engine, "properties_data", "summary", "TEXT")
+    synced = repl.replicate(engine, supabase_engine, "supabase",
+                            query=pq.regression_query(predicted_missing=False))
+    sqlq.ensure_indexes(supabase_engine)
+    repl.compact_change_log(engine)
+    return synced
+
+
+def _sync_fingerprint(params: PipelineParams):
+    return data_version(_engine(params))
+
+
+## recommend (nb05.py)
+
+def _recommend(params: PipelineParams) -> Dict[str, object]:
+    engine = _engine(params)
+    properties = pq.PropertyQuery(predicted_missing=False).read(engine)
+    index = ranking.UnderpricedIndex(properties, rank_by=params.rank_by)
+    queries = [ranking.BudgetQuery(budget=budget, k=params.k) for budget in params.budgets]
+    columns = ["id", "price_per_bed", "predicted_price_per_bed", "prediction_sd", "savings", "savings_z",
+               "bedrooms", "bathrooms", "travel_time", "distance", "latitude", "longitude"]
+    results = index.query_many(queries, columns=columns)
+    for result in results:
+        # NaN is not JSON, so missing values are written as null
+        result["listings"] = [{key: None if isinstance(value, float) and math.isnan(value) else value
+                               for key, value in row.items()} for row in result["listings"]]
+    output = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "rank_by": params.rank_by,
+        "results": results,
+    }
+    partial = params.recommendations_path + ".partial"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2, default=str)
+    os.replace(partial, params.recommendations_path)
+    return {"budgets": len(queries), "listings": sum(len(r["listings"]) for r in output["results"])}
+
+
+def _recommend_fingerprint(params: PipelineParams):
+    return {"data": data_version(_engine(params)), "budgets": list(params.budgets),
+            "k": params.k, "rank_by": params.rank_by}
+
+
+## cube (market_cube.py)
+
+def _cube(params: PipelineParams) -> Dict[str, object]:
+    return market_cube.update_cube(_engine(params))
+
+
+def _cube_fingerprint(params: PipelineParams):
+    return data_version(_engine(params))
+
+
+## The stages, in dependency order
+def build_stages(params: PipelineParams) -> List[Stage]:
+    stages = [
+        Stage("scrape", _scrape, _scrape_fingerprint,
+              outputs=_scrape_outputs, max_age=params.scrape_max_age_hours * 3600),
+        Stage("load", _load, _load_fingerprint, deps=("scrape",)),
+        Stage("travel_time", _travel_time, _travel_time_fingerprint, deps=("load",)),
+        Stage("model", _model, _model_fingerprint, deps=("travel_time",)),
+        Stage("recommend", _recommend, _recommend_fingerprint, deps=("model",),
+              outputs=lambda p: [p.recommendations_path]),
+        Stage("cube", _cube, _cube_fingerprint, deps=("model",)),
+    ]
+    if params.sync:
+        # cube and sync both write to properties.db (the cube in one long transaction, sync its
+        # high-water marks), so sync waits for the cube rather than queueing on the SQLite lock
+        stages.append(Stage("sync", _sync, _sync_fingerprint, deps=("model",), after=("cube",)))
+    return stages
+
+
+# RUNNING
+
+## The tables every stage relies on
+def prepare_database(params: PipelineParams):
+    os.makedirs(params.data_dir, exist_ok=True)
+    engine = _engine(params)
+    with engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    sqlq.ensure_indexes(engine)
+    sqlq.ensure_column(engine, "properties_data", "prediction_sd", "REAL")
+    sqlq.ensure_column(engine, "properties_data", "summary", "TEXT")
+    crawl.ensure_city_column(engine)
+    # the change log gives the later stages a cheap version number for the table
+    repl.ensure_change_tracking(engine)
+
+
+def _read_state(path: str) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_state(path: str, state: Dict[str, dict]):
+    partial = path + ".partial"
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(partial, path)
+
+
+def _is_current(stage: Stage, params: PipelineParams, previous: Optional[dict], fingerprint: str) -> bool:
+    if previous is None or previous.get("fingerprint") != fingerprint:
+        return False
+    if not all(os.path.exists(path) for path in stage.outputs(params)):
+        return False
+    return stage.max_age is None or time.time() - previous.get("finished_at", 0) <= stage.max_age
+
+
+## Run (or skip) every stage, as many at once as their dependencies allow
+def run_pipeline(params: PipelineParams, force: Tuple[str, ...] = (), only: Optional[Tuple[str, ...]] = None,
+                 stages: Optional[List[Stage]] = None) -> Dict[str, dict]:
+    """
+    Runs the stage graph and returns, per stage, its status ("ran", "skipped",
+    "failed" or "blocked" by a failed dependency), wall time and summary.
+
+    Args:
+        params (PipelineParams): The run's parameters.
+        force (tuple): Stages to run even if their inputs are unchanged.
+        only (tuple): Run just these stages (their dependencies count as done).
+        stages (list): The stage graph (default: build_stages(params)).
+
+    Returns:
+        dict: The outcome of each stage, also appended to params.log_path.
+    """
+    if params.metrics and not instr.enabled():
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        instr.enable(os.path.join(params.metrics_dir, f"run-{stamp}.jsonl"),
+                     os.path.join(params.metrics_dir, "metrics.prom"))
+    prepare_database(params)
+    stages = stages if stages is not None else build_stages(params)
+    if only is not None:
+        stages = [s for s in stages if s.name in only]
+    names = {s.name for s in stages}
+    unknown = set(force) - names
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}")
+    state = _read_state(params.state_path)
+    state_lock = threading.Lock()
+    started = time.time()
+
+    def execute(stage: Stage) -> dict:
+        with instr.span("pipeline_stage", stage=stage.name):
+            return run_stage(stage)
+
+    def run_stage(stage: Stage) -> dict:
+        start = time.perf_counter()
+        before = digest(stage.fingerprint(params))
+        if stage.name not in force and _is_current(stage, params, state.get(stage.name), before):
+            logging.info(f'Stage {stage.name}: up to date, skipped')
+            return {"status": "skipped", "seconds": time.perf_counter() - start}
+        logging.info(f'Stage {stage.name}: running')
+        try:
+            summary = stage.run(params)
+        except Exception as error:
+            logging.exception(f'Stage {stage.name}: failed')
+            return {"status": "failed", "seconds": time.perf_counter() - start, "error": repr(error)}
+        # the fingerprint is retaken afterwards, since running a stage changes some of its own inputs
+        # (new travel times, a new model version), and the next run should compare against that
+        after = digest(stage.fingerprint(params))
+        seconds = time.perf_counter() - start
+        with state_lock:
+            state[stage.name] = {"fingerprint": after, "finished_at": time.time(), "seconds": seconds}
+            _write_state(params.state_path, state)
+        logging.info(f'Stage {stage.name}: done in {seconds:.2f}s ({summary})')
+        return {"status": "ran", "seconds": seconds, "summary": summary}
+
+    results: Dict[str, dict] = {}
+    pending = {s.name: s for s in stages}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, params.jobs)) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                deps = [d for d in stage.deps if d in names]
+                waits_for = deps + [d for d in stage.after if d in names]
+                if any(results.get(d, {}).get("status") in ("failed", "blocked") for d in deps):
+                    results[name] = {"status": "blocked", "seconds": 0.0}
+                    logging.warning(f'Stage {name}: blocked by a failed dependency')
+                    del pending[name]
+                elif all(d in results for d in waits_for):
+                    running[pool.submit(execute, stage)] = name
+                    del pending[name]
+            if not running:
+                if pending:
+                    raise ValueError(f"Stages {sorted(pending)} depend on each other in a cycle")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    record = {
+        "started_at": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+        "seconds": time.time() - started,
+        "params": asdict(params),
+        "stages": results,
+    }
+    with open(params.log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+    instr.export()
+    return results
@@ -0,0 +1,194 @@
+# This module builds filtered queries against properties_data, so that
+# cleaning filters, budget cuts and rankings run inside the database
+# (using the indexes in sql_queries.PROPERTIES_INDEXES) instead of in pandas
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+from dataclasses import dataclass, replace
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Database Connection
+from sqlalchemy import text
+from rental_utils import sql_queries as sqlq
+
+
+# EXPRESSIONS
+
+## Rent per bedroom converted to monthly, as done in functions.clean_for_reg
+MONTHLY_PRICE_PER_BED = (
+    "CASE WHEN \"priceFrequency\" = 'weekly' "
+    "THEN price_per_bed * 52.0 / 12 ELSE price_per_bed END"
+)
+
+## How much cheaper a flat is than the model predicts, as in functions.find_underpriced
+SAVINGS = "(predicted_price_per_bed - price_per_bed)"
+
+## Savings in standard deviations of the prediction, as in uncertainty.savings_z
+SAVINGS_Z = f"({SAVINGS} / NULLIF(prediction_sd, 0))"
+
+
+## An inclusive range; either end may be left open
+Bounds = Tuple[Optional[float], Optional[float]]
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+# THE QUERY BUILDER
+
+@dataclass(frozen=True)
+class PropertyQuery:
+    """
+    A typed description of a filtered, ranked read of properties_data.
+
+    Every filter is optional; `build` turns the set ones into a single
+    parameterised SELECT. Ranges are inclusive, like pandas' `between`.
+    """
+    columns: Optional[List[str]] = None
+    ids: Optional[List[int]] = None
+    cities: Optional[List[str]] = None
+    price_frequencies: Optional[List[str]] = None
+    price_per_bed: Optional[Bounds] = None
+    monthly_price_per_bed: Optional[Bounds] = None
+    travel_time: Optional[Bounds] = None
+    bathrooms: Optional[Bounds] = None
+    bedrooms: Optional[Bounds] = None
+    latitude: Optional[Bounds] = None
+    longitude: Optional[Bounds] = None
+    predicted_missing: Optional[bool] = None
+    travel_time_missing: Optional[bool] = None
+    updated_after: Optional[str] = None
+    with_savings: bool = False
+    order_by_savings: bool = False
+    by_z_score: bool = False
+    limit: Optional[int] = None
+    table: str = "properties_data"
+
+    ## Return a copy of the query with some fields changed
+    def but(self, **changes) -> "PropertyQuery":
+        return replace(self, **changes)
+
+    ## Render the SQL and its bound parameters
+    def build(self) -> Tuple[str, Dict[str, object]]:
+        """
+        Returns the SQL string and the parameters to bind to it.
+        """
+        params: Dict[str, object] = {}
+        conditions: List[str] = []
+
+        def add_bounds(expression: str, name: str, bounds: Optional[Bounds]):
+            if bounds is None:
+                return
+            low, high = bounds
+            if low is not None:
+                params[f"{name}_low"] = low
+                conditions.append(f"{expression} >= :{name}_low")
+            if high is not None:
+                params[f"{name}_high"] = high
+                conditions.append(f"{expression} <= :{name}_high")
+
+        if self.ids is not None:
+            names = []
+            for i, property_id in enumerate(self.ids):
+                params[f"id_{i}"] = int(property_id)
+                names.append(f":id_{i}")
+            conditions.append(f"id IN ({', '.join(names) or 'NULL'})")
+        if self.cities is not None:
+            names = []
+            for i, city in enumerate(self.cities):
+                params[f"city_{i}"] = city
+                names.append(f":city_{i}")
+            conditions.append(f"city IN ({', '.join(names) or 'NULL'})")
+        if self.price_frequencies is not None:
+            names = []
+            for i, frequency in enumerate(self.price_frequencies):
+                params[f"frequency_{i}"] = frequency
+                names.append(f":frequency_{i}")
+            conditions.append(f"\"priceFrequency\" IN ({', '.join(names) or 'NULL'})")
+        add_bounds("price_per_bed", "price_per_bed", self.price_per_bed)
+        add_bounds(f"({MONTHLY_PRICE_PER_BED})", "monthly_price_per_bed", self.monthly_price_per_bed)
+        add_bounds("travel_time", "travel_time", self.travel_time)
+        add_bounds("bathrooms", "bathrooms", self.bathrooms)
+        add_bounds("bedrooms", "bedrooms", self.bedrooms)
+        add_bounds("latitude", "latitude", self.latitude)
+        add_bounds("longitude", "longitude", self.longitude)
+        if self.predicted_missing is not None:
+            conditions.append(
+                "predicted_price_per_bed IS " + ("NULL" if self.predicted_missing else "NOT NULL")
+            )
+        if self.travel_time_missing is not None:
+            conditions.append("travel_time IS " + ("NULL" if self.travel_time_missing else "NOT NULL"))
+        if self.updated_after is not None:
+            # updated_at only exists on replication targets (see replication.replicate)
+            params["updated_after"] = self.updated_after
+            conditions.append("updated_at > :updated_after")
+
+        selected = ", ".join(_quote(c) for c in self.columns) if self.columns else "*"
+        if self.with_savings or self.order_by_savings:
+            selected += f", {SAVINGS} AS savings"
+            if self.by_z_score:
+                selected += f", {SAVINGS_Z} AS savings_z"
+        sql = f"SELECT {selected} FROM {_quote(self.table)}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if self.order_by_savings:
+            # rows without a prediction go last, as pandas' sort_values does with NaN
+            ranking = SAVINGS_Z if self.by_z_score else SAVINGS
+            sql += f" ORDER BY {ranking} IS NULL, {ranking} DESC"
+        if self.limit is not None:
+            params["limit"] = int(self.limit)
+            sql += " LIMIT :limit"
+        return sql, params
+
+    ## Run the query and return the rows as a dataframe
+    def read(self, engine) -> pd.DataFrame:
+        sql, params = self.build()
+        with engine.connect() as connection:
+            return pd.read_sql(text(sql), connection, params=params)
+
+    ## Run the query and stream the rows back as typed dataframe chunks
+    def iter_chunks(self, engine, chunksize: int = 50_000) -> Iterator[pd.DataFrame]:
+        sql, params = self.build()
+        return sqlq.iter_query(engine, sql, params, chunksize=chunksize)
+
+
+# COMMON QUERIES
+
+## The rows that survive functions.clean_for_reg
+def regression_query(**changes) -> PropertyQuery:
+    """
+    Returns a query applying the same filters as `clean_for_reg`, so only usable
+    rows are transferred. Prices come back unconverted; running `clean_for_reg`
+    on the result still does the weekly to monthly conversion.
+    """
+    return PropertyQuery(
+        price_frequencies=["monthly", "weekly"],
+        travel_time=(60, 5400),
+        bathrooms=(1, 6),
+        monthly_price_per_bed=(100, 10000),
+    ).but(**changes)
+
+
+## The k most underpriced flats within a budget, as ranked by functions.find_underpriced
+def underpriced_query(user_budget: float = 1200, k: int = 10, **changes) -> PropertyQuery:
+    """
+    Returns a query for the `k` flats with the largest savings among those whose
+    rent per bedroom is within `user_budget`, most underpriced first.
+    """
+    return PropertyQuery(
+        price_per_bed=(None, user_budget),
+        order_by_savings=True,
+        limit=k,
+    ).but(**changes)
+
+
+## Stream the whole table (or some of its columns) in chunks
+def iter_properties(engine, columns: Optional[List[str]] = None, chunksize: int = 50_000) -> Iterator[pd.DataFrame]:
+    """
+    Yields properties_data as typed DataFrame chunks, restricted to `columns` if given.
+    Memory use is bounded by `chunksize`, whatever the size of the table.
+    """
+    return PropertyQuery(columns=columns).iter_chunks(engine, chunksize=chunksize)
@@ -0,0 +1,159 @@
+# This module answers "the most underpriced flats within my budget" for many
+# budgets without redoing the work each time. Listings are sorted by rent
+# once, with their savings attached, so a budget is a binary search for the
+# affordable prefix and the best k of that prefix come from a partial sort
+# (argpartition) instead of a full one. Results come back as data, not prints.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+from rental_utils import uncertainty
+
+# Tracking
+import logging
+
+
+## An inclusive range; either end may be left open (as in property_queries)
+Bounds = Tuple[Optional[float], Optional[float]]
+
+
+@dataclass
+class BudgetQuery:
+    """
+    One ranking request: the `k` best listings with rent per bedroom within
+    `budget`, optionally restricted by inclusive `bounds` on other columns
+    (e.g. {"bedrooms": (2, None), "travel_time": (None, 2700)}).
+    """
+    budget: float
+    k: int = 10
+    bounds: Dict[str, Bounds] = field(default_factory=dict)
+
+
+class UnderpricedIndex:
+    """
+    Listings sorted by rent per bedroom, with the score they are ranked by.
+
+    The ranking matches `functions.find_underpriced`: highest score first and
+    listings without a score last. Exact ties, which find_underpriced leaves in
+    no particular order, keep the order of the input frame.
+
+    For every full block of `block_size` listings in price order, the best
+    `max_k` are found in advance, so a query for k <= max_k only looks at those
+    and the partial block at the end of its affordable range.
+
+    Args:
+        properties (pd.DataFrame): Listings with price_per_bed and predicted_price_per_bed
+            (and the reference's spread, see uncertainty.SPREAD_COLUMNS, to rank by savings_z).
+        rank_by (str): "savings", or "savings_z" for savings in standard deviations of the reference.
+        reference_col (str): The price savings are measured against.
+        block_size (int): Listings per precomputed block.
+        max_k (int): Largest k answered from the precomputed blocks.
+    """
+
+    def __init__(self, properties: pd.DataFrame, rank_by: str = "savings",
+                 reference_col: str = "predicted_price_per_bed", block_size: int = 1024, max_k: int = 100):
+        if rank_by == "savings_z" and not uncertainty.has_spread(properties, reference_col):
+            spread_col = uncertainty.SPREAD_COLUMNS.get(reference_col, "spread")
+            raise ValueError(f"rank_by='savings_z' needs a {spread_col} column for {reference_col}; "
+                             "use rank_by='savings' without one")
+        properties = properties.reset_index(drop=True).copy()
+        properties["savings"] = properties[reference_col] - properties["price_per_bed"]
+        if uncertainty.has_spread(properties, reference_col):
+            properties["savings_z"] = uncertainty.savings_z(properties, reference_col)
+        self.rank_by = rank_by
+        prices = pd.to_numeric(properties["price_per_bed"], errors="coerce").to_numpy(dtype=float)
+        # listings without a price can never be within a budget, so they are not indexed
+        priced = np.flatnonzero(~np.isnan(prices))
+        order = priced[np.argsort(prices[priced], kind="stable")]
+        self.properties = properties.iloc[order].reset_index(drop=True)
+        self.prices = prices[order]
+        score = self.properties[rank_by].to_numpy(dtype=float)
+        # missing scores rank last; the input position breaks ties as a stable sort would
+        self.scores = np.where(np.isnan(score), -np.inf, score)
+        self.positions = order
+        self._columns: Dict[str, np.ndarray] = {}
+
+        self.block_size = block_size
+        self.max_k = min(max_k, block_size)
+        n_blocks = len(self.prices) // block_size
+        block_scores = self.scores[:n_blocks * block_size].reshape(n_blocks, block_size)
+        block_positions = self.positions[:n_blocks * block_size].reshape(n_blocks, block_size)
+        # rank inside each block by score, then input position, and keep the best max_k
+        ranked = np.lexsort((block_positions, -block_scores), axis=1)[:, :self.max_k]
+        self.block_tops = ranked + (np.arange(n_blocks) * block_size)[:, None]
+        logging.info(f'Indexed {len(self.prices)} listings by price, ranked by {rank_by}')
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def _column(self, name: str) -> np.ndarray:
+        # filter columns are converted to float arrays once, on first use
+        if name not in self._columns:
+            self._columns[name] = pd.to_numeric(self.properties[name], errors="coerce").to_numpy(dtype=float)
+        return self._columns[name]
+
+    ## Row numbers (into self.properties) of the best k listings for one query
+    def top_rows(self, budget: float, k: int = 10, bounds: Optional[Dict[str, Bounds]] = None) -> np.ndarray:
+        """
+        Finds the affordable prefix with a binary search, applies any bounds to
+        it, and takes the top `k` by score with argpartition, so the cost is
+        O(affordable listings) rather than a sort of the whole table.
+        """
+        end = int(np.searchsorted(self.prices, budget, side="right"))
+        if not bounds and k <= self.max_k:
+            # the best k of the affordable range are among the best k of each full block
+            # and the rows of the partial block at its end
+            full = end // self.block_size
+            candidates = np.concatenate([self.block_tops[:full, :k].ravel(),
+                                         np.arange(full * self.block_size, end)])
+        else:
+            candidates = np.arange(end)
+        for name, (low, high) in (bounds or {}).items():
+            values = self._column(name)[candidates]
+            keep = np.ones(len(candidates), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            candidates = candidates[keep]
+        if k <= 0 or len(candidates) == 0:
+            return candidates[:0]
+        scores = self.scores[candidates]
+        if len(candidates) > k:
+            chosen = np.argpartition(-scores, k - 1)[:k]
+            # argpartition does not keep ties at the cut-off in input order, so take every
+            # listing tied with the k-th score and let the final sort pick among them
+            cutoff = scores[chosen].min()
+            chosen = np.union1d(np.flatnonzero(scores > cutoff), np.flatnonzero(scores == cutoff))
+            candidates, scores = candidates[chosen], scores[chosen]
+        ranked = np.lexsort((self.positions[candidates], -scores))[:k]
+        return candidates[ranked]
+
+    ## The best k listings for one budget, as a dataframe
+    def query(self, budget: float, k: int = 10, bounds: Optional[Dict[str, Bounds]] = None) -> pd.DataFrame:
+        return self.properties.iloc[self.top_rows(budget, k, bounds)]
+
+    ## Answer many budgets (and filters) in one call
+    def query_many(self, queries: Iterable[BudgetQuery], columns: Optional[List[str]] = None) -> List[Dict[str, object]]:
+        """
+        Answers each query and returns, per query, a dict holding the query
+        (budget, k, bounds) and its ranked listings as records (restricted to `columns`).
+        """
+        columns = [c for c in (columns or self.properties.columns) if c in self.properties.columns]
+        # records are built from plain column arrays, which is much quicker than slicing the frame per query
+        arrays = [self.properties[c].to_numpy() for c in columns]
+        results = []
+        for query in queries:
+            rows = self.top_rows(query.budget, query.k, query.bounds)
+            values = zip(*(array[rows].tolist() for array in arrays))
+            results.append({
+                "budget": query.budget,
+                "k": query.k,
+                "bounds": query.bounds,
+                "listings": [dict(zip(columns, row)) for row in values],
+            })
+        return results
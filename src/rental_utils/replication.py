@@ -0,0 +1,255 @@
+# This module replicates properties_data from the local SQLite database
+# (properties.db) to another database such as the Supabase cloud copy.
+# Changes are tracked locally by triggers writing to a change log, and each
+# target keeps a high-water mark, so a sync only ships what changed since
+# the last one: new rows, updated travel times, predictions and prices,
+# and deletions.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+from typing import Dict, Optional
+
+# Database Connection
+from sqlalchemy import text
+from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+
+# File and System Operations
+from datetime import datetime, timezone
+
+# Tracking
+import logging
+
+
+# SQL
+
+## The change log: one row per insert, update or delete on properties_data
+CREATE_CHANGE_LOG_SQL_QUERY = """
+CREATE TABLE IF NOT EXISTS properties_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+"""
+
+## Triggers that fill the change log (SQLite syntax)
+CHANGE_TRIGGERS_SQL_QUERIES = [
+    """
+    CREATE TRIGGER IF NOT EXISTS properties_data_log_insert AFTER INSERT ON properties_data
+    BEGIN INSERT INTO properties_changes (id, op) VALUES (NEW.id, 'I'); END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS properties_data_log_update AFTER UPDATE ON properties_data
+    BEGIN INSERT INTO properties_changes (id, op) VALUES (NEW.id, 'U'); END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS properties_data_log_delete AFTER DELETE ON properties_data
+    BEGIN INSERT INTO properties_changes (id, op) VALUES (OLD.id, 'D'); END;
+    """,
+]
+
+## Where each target got up to
+CREATE_REPLICATION_STATE_SQL_QUERY = """
+CREATE TABLE IF NOT EXISTS replication_state (
+    target TEXT PRIMARY KEY,
+    last_seq INTEGER NOT NULL,
+    rows_shipped INTEGER NOT NULL DEFAULT 0,
+    synced_at TEXT
+);
+"""
+
+## The latest change per id within a window of the log
+GET_PENDING_CHANGES_SQL_QUERY = """
+SELECT c.id, c.op, c.seq
+FROM properties_changes c
+JOIN (
+    SELECT id, MAX(seq) AS seq
+    FROM properties_changes
+    WHERE seq > :after AND seq <= :upto
+    GROUP BY id
+) latest ON c.seq = latest.seq
+ORDER BY c.seq
+"""
+
+## The last sequence number handed out (AUTOINCREMENT keeps it even once compaction has emptied the log)
+GET_HEAD_SEQ_SQL_QUERY = """
+SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'properties_changes'), 0)
+"""
+
+
+# CHANGE TRACKING
+
+## Install the change log and its triggers on the local database
+def ensure_change_tracking(engine):
+    """
+    Creates the change log, the triggers feeding it and the replication state table.
+
+    The first time tracking is installed every existing row is logged as an
+    insert, so a target's first sync ships the whole table. Only SQLite sources
+    are supported, since the triggers use SQLite syntax.
+    """
+    if engine.dialect.name != "sqlite":
+        raise ValueError(f"Change tracking needs a SQLite source, not {engine.dialect.name}")
+    with engine.begin() as connection:
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'properties_changes'"
+        )).first()
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+        connection.execute(text(CREATE_CHANGE_LOG_SQL_QUERY))
+        connection.execute(text(CREATE_REPLICATION_STATE_SQL_QUERY))
+        if not exists:
+            connection.execute(text(
+                "INSERT INTO properties_changes (id, op) SELECT id, 'I' FROM properties_data ORDER BY id"
+            ))
+        for trigger in CHANGE_TRIGGERS_SQL_QUERIES:
+            connection.execute(text(trigger))
+
+
+## Read the high-water marks of every target
+def replication_status(engine) -> pd.DataFrame:
+    """Returns one row per target with its high-water mark, rows shipped and last sync time."""
+    ensure_change_tracking(engine)
+    with engine.connect() as connection:
+        status = pd.read_sql(text("SELECT * FROM replication_state ORDER BY target"), connection)
+        head = connection.execute(text(GET_HEAD_SEQ_SQL_QUERY)).scalar()
+    status["pending_changes"] = head - status["last_seq"]
+    return status
+
+
+## Drop log entries every target has already received
+def compact_change_log(engine) -> int:
+    """
+    Deletes change log entries at or below the lowest high-water mark across targets.
+    Returns the number of entries removed (none if no target has synced yet).
+    """
+    with engine.begin() as connection:
+        low = connection.execute(text("SELECT MIN(last_seq) FROM replication_state")).scalar()
+        if low is None:
+            return 0
+        result = connection.execute(text("DELETE FROM properties_changes WHERE seq <= :low"), {"low": low})
+    return result.rowcount
+
+
+# REPLICATION
+
+## Targets stamp each upserted row with the time of the sync, in a format that sorts as text
+UPDATED_AT_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+UPDATED_AT_INDEX = {"idx_properties_updated_at": "updated_at"}
+
+## Ship everything that changed since the target's last sync
+def replicate(source_engine, target_engine, target: str, query: Optional[pq.PropertyQuery] = None,
+              batch_size: int = 2000) -> Dict[str, int]:
+    """
+    Brings `target_engine`'s properties_data up to date with the local database.
+
+    Only ids logged since the target's high-water mark are read. Their current
+    rows are upserted in batches (COPY-staged on Postgres, see sql_queries.bulk_load),
+    and ids that were deleted, or no longer match `query`, are deleted from the
+    target. The high-water mark advances after every batch, so an interrupted
+    sync resumes where it stopped. If the change log has been compacted past
+    the target's high-water mark (e.g. a target added after compact_change_log
+    ran), the changes it missed are gone, so every row matching `query` is
+    copied instead and rows the target should no longer hold are deleted; the
+    mark only moves once that copy is complete. Upserted rows are stamped with updated_at on
+    the target, which lets readers of the target (see cloud_cache) fetch only
+    what changed.
+
+    Args:
+        source_engine (sqlalchemy.engine.Engine): The local SQLite database.
+        target_engine (sqlalchemy.engine.Engine): The database to replicate to.
+        target (str): A name for the target, used to key its high-water mark.
+        query (PropertyQuery): Restricts which rows the target holds (default: all rows).
+        batch_size (int): Ids per batch.
+
+    Returns:
+        dict: The number of rows upserted and deleted, and the new high-water mark.
+    """
+    ensure_change_tracking(source_engine)
+    query = query or pq.PropertyQuery()
+    with target_engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    sqlq.ensure_column(target_engine, "properties_data", "updated_at", "TEXT")
+    sqlq.ensure_indexes(target_engine, indexes=UPDATED_AT_INDEX)
+
+    # fix the window up front, so changes made during the sync wait for the next one
+    with source_engine.connect() as connection:
+        after = connection.execute(
+            text("SELECT last_seq FROM replication_state WHERE target = :target"), {"target": target}
+        ).scalar() or 0
+        upto = connection.execute(text(GET_HEAD_SEQ_SQL_QUERY)).scalar()
+        oldest = connection.execute(text("SELECT MIN(seq) FROM properties_changes")).scalar()
+        # entries after the mark were compacted away if the log now starts later (or is empty)
+        compacted = upto > after and (oldest is None or oldest > after + 1)
+        pending = None if compacted else pd.read_sql(text(GET_PENDING_CHANGES_SQL_QUERY), connection,
+                                                     params={"after": after, "upto": upto})
+    if compacted:
+        logging.warning(f'The change log was compacted past {target}, so it gets a full copy')
+        return _replicate_all(source_engine, target_engine, target, query, upto, batch_size)
+    logging.info(f'{len(pending)} changed properties to replicate to {target}')
+
+    totals = {"upserted": 0, "deleted": 0, "last_seq": after}
+    for start in range(0, len(pending), batch_size):
+        batch = pending.iloc[start:start + batch_size]
+        live_ids = batch.loc[batch["op"] != "D", "id"].tolist()
+        rows = query.but(ids=live_ids).read(source_engine) if live_ids else pd.DataFrame(columns=["id"])
+        # dropped: deleted locally, or filtered out by the query
+        dropped = sorted(set(batch["id"]) - set(rows["id"]))
+
+        totals["upserted"] += _upsert_rows(target_engine, rows)
+        totals["deleted"] += _delete_ids(target_engine, dropped)
+        totals["last_seq"] = int(batch["seq"].max())
+        _save_high_water_mark(source_engine, target, totals["last_seq"], len(rows))
+
+    logging.info(f'Replicated to {target}: {totals}')
+    return totals
+
+
+## Copy every row matching the query, for a target whose missed changes are no longer in the log
+def _replicate_all(source_engine, target_engine, target, query, upto, batch_size) -> Dict[str, int]:
+    totals = {"upserted": 0, "deleted": 0, "last_seq": upto}
+    kept = set()
+    for rows in query.iter_chunks(source_engine, chunksize=batch_size):
+        kept.update(int(i) for i in rows["id"])
+        totals["upserted"] += _upsert_rows(target_engine, rows)
+    with target_engine.connect() as connection:
+        held = connection.execute(text("SELECT id FROM properties_data")).scalars().all()
+    stale = sorted(set(held) - kept)
+    for start in range(0, len(stale), batch_size):
+        totals["deleted"] += _delete_ids(target_engine, stale[start:start + batch_size])
+    _save_high_water_mark(source_engine, target, upto, totals["upserted"])
+    logging.info(f'Copied to {target}: {totals}')
+    return totals
+
+
+## Upsert rows into the target, stamped with the time of the sync
+def _upsert_rows(target_engine, rows: pd.DataFrame) -> int:
+    if rows.empty:
+        return 0
+    rows = rows.drop(columns=["savings"], errors="ignore")
+    rows["updated_at"] = datetime.now(timezone.utc).strftime(UPDATED_AT_FORMAT)
+    return sqlq.bulk_load("properties_data", rows, "id", target_engine, upsert=True)
+
+
+def _delete_ids(target_engine, ids) -> int:
+    if not ids:
+        return 0
+    with target_engine.begin() as connection:
+        params = {f"id_{i}": int(d) for i, d in enumerate(ids)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        result = connection.execute(text(f"DELETE FROM properties_data WHERE id IN ({placeholders})"), params)
+    return result.rowcount
+
+
+def _save_high_water_mark(engine, target, last_seq, shipped):
+    with engine.begin() as connection:
+        connection.execute(text("""
+            INSERT INTO replication_state (target, last_seq, rows_shipped, synced_at)
+            VALUES (:target, :last_seq, :shipped, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+            ON CONFLICT (target) DO UPDATE SET
+                last_seq = excluded.last_seq,
+                rows_shipped = replication_state.rows_shipped + excluded.rows_shipped,
+                synced_at = excluded.synced_at
+        """), {"target": target, "last_seq": last_seq, "shipped": shipped})
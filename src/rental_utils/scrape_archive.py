@@ -0,0 +1,377 @@
+# This module keeps every raw scrape instead of overwriting one JSON file.
+# Each crawl (one city's search, or a batch of property pages) is written as
+# zstd-compressed NDJSON segments under <root>/<crawl id>/. Listings go into
+# independently compressed frames of a few hundred lines each, and an SQLite
+# index (<root>/index.db) maps every listing id to its crawl, segment, the
+# frame's byte range and the line's place in the frame. Fetching one listing
+# is then an index lookup, one seek and one small frame to decompress, however
+# big the archive grows, and a whole crawl can still be streamed back line by
+# line, since concatenated frames read as one zstd stream.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Compression
+import zstandard
+
+# Database Connection
+from sqlalchemy import text
+from rental_utils import sql_queries as sqlq
+
+# File and System Operations
+import io
+import json
+import os
+import re
+import shutil
+from datetime import datetime, timezone
+
+# Tracking
+import logging
+
+
+# SETTINGS
+
+## Lines (or uncompressed bytes) per compressed frame; a random read decompresses one frame
+FRAME_RECORDS = 256
+FRAME_BYTES = 1 << 20
+
+## A new segment file is started once the current one passes this many compressed bytes
+SEGMENT_BYTES = 64 << 20
+
+## zstd compression level
+COMPRESSION_LEVEL = 6
+
+## Index rows written per batch while a crawl is being archived
+INDEX_BATCH = 50_000
+
+
+# SQL
+
+CREATE_ARCHIVE_SQL_QUERIES = [
+    # a crawl only becomes visible once its row here is written, after all its segments are
+    """
+    CREATE TABLE IF NOT EXISTS archive_crawls (
+        crawl TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        listings INTEGER NOT NULL,
+        segments INTEGER NOT NULL,
+        raw_bytes INTEGER NOT NULL,
+        compressed_bytes INTEGER NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS archive_index (
+        id INTEGER NOT NULL,
+        crawl TEXT NOT NULL,
+        segment INTEGER NOT NULL,
+        frame_offset INTEGER NOT NULL,
+        frame_length INTEGER NOT NULL,
+        line_start INTEGER NOT NULL,
+        line_length INTEGER NOT NULL,
+        PRIMARY KEY (id, crawl)
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_archive_index_crawl ON archive_index (crawl)",
+]
+
+## Where a listing is in its latest (or a given) crawl
+GET_LOCATION_SQL_QUERY = """
+SELECT i.id, i.crawl, i.segment, i.frame_offset, i.frame_length, i.line_start, i.line_length
+FROM archive_index i
+JOIN archive_crawls c ON c.crawl = i.crawl
+WHERE i.id = :id {crawl_condition}
+ORDER BY i.crawl DESC
+LIMIT 1
+"""
+
+
+# WRITING
+
+## A name for a crawl that sorts by time ("20250314T091502123456Z-london")
+def crawl_id(source: str, when: Optional[datetime] = None) -> str:
+    when = when or datetime.now(timezone.utc)
+    slug = re.sub(r"[^a-z0-9]+", "-", source.strip().lower()).strip("-") or "crawl"
+    return f"{when.strftime('%Y%m%dT%H%M%S%fZ')}-{slug}"
+
+
+def segment_name(segment: int) -> str:
+    return f"segment-{segment:05d}.ndjson.zst"
+
+
+class ArchiveWriter:
+    """
+    Writes one crawl into the archive; use it as a context manager.
+
+    Listings are buffered into frames of FRAME_RECORDS lines, each compressed
+    on its own, and the frames are appended to segment files of about
+    SEGMENT_BYTES. Index rows are written as segments fill up, but the crawl
+    only appears in the archive when the writer is closed; if the block
+    raises, its files and index rows are removed again.
+    """
+
+    def __init__(self, archive: "ScrapeArchive", source: str, kind: str = "search",
+                 level: int = COMPRESSION_LEVEL):
+        self.archive = archive
+        self.crawl = crawl_id(source)
+        self.source = source
+        self.kind = kind
+        self.directory = os.path.join(archive.root, self.crawl)
+        os.makedirs(self.directory, exist_ok=False)
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._file = None
+        self._segment = -1
+        self._offset = 0
+        self._lines: List[bytes] = []
+        self._ids: List[int] = []
+        self._frame_bytes = 0
+        self._index_rows: List[tuple] = []
+        self.listings = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def write(self, listing: dict):
+        line = json.dumps(listing, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
+        self._lines.append(line)
+        self._ids.append(int(listing["id"]))
+        self._frame_bytes += len(line)
+        if len(self._lines) >= FRAME_RECORDS or self._frame_bytes >= FRAME_BYTES:
+            self._flush_frame()
+
+    def write_many(self, listings: Iterable[dict]):
+        for listing in listings:
+            self.write(listing)
+
+    def _flush_frame(self):
+        if not self._lines:
+            return
+        if self._file is None or self._offset >= SEGMENT_BYTES:
+            self._next_segment()
+        raw = b"".join(self._lines)
+        frame = self._compressor.compress(raw)
+        self._file.write(frame)
+        start = 0
+        for listing_id, line in zip(self._ids, self._lines):
+            # the line is stored without its newline
+            self._index_rows.append((listing_id, self.crawl, self._segment, self._offset, len(frame),
+                                     start, len(line) - 1))
+            start += len(line)
+        self._offset += len(frame)
+        self.listings += len(self._lines)
+        self.raw_bytes += len(raw)
+        self.compressed_bytes += len(frame)
+        self._lines, self._ids, self._frame_bytes = [], [], 0
+        if len(self._index_rows) >= INDEX_BATCH:
+            self._flush_index()
+
+    def _next_segment(self):
+        if self._file is not None:
+            self._file.close()
+        self._segment += 1
+        self._offset = 0
+        self._file = open(os.path.join(self.directory, segment_name(self._segment)), "wb")
+
+    def _flush_index(self):
+        if not self._index_rows:
+            return
+        with self.archive.engine.begin() as connection:
+            # a listing repeated within a crawl (it can appear on two result pages) keeps its last copy
+            connection.exec_driver_sql(
+                "INSERT OR REPLACE INTO archive_index (id, crawl, segment, frame_offset, frame_length, "
+                "line_start, line_length) VALUES (?, ?, ?, ?, ?, ?, ?)", self._index_rows
+            )
+        self._index_rows = []
+
+    ## Finish the crawl and make it visible
+    def close(self) -> str:
+        self._flush_frame()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._flush_index()
+        with self.archive.engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO archive_crawls (crawl, source, kind, created_at, listings, segments, raw_bytes, "
+                "compressed_bytes) VALUES (:crawl, :source, :kind, :created_at, :listings, :segments, "
+                ":raw_bytes, :compressed_bytes)"
+            ), {"crawl": self.crawl, "source": self.source, "kind": self.kind,
+                "created_at": datetime.now(timezone.utc).isoformat(), "listings": self.listings,
+                "segments": self._segment + 1, "raw_bytes": self.raw_bytes,
+                "compressed_bytes": self.compressed_bytes})
+        logging.info(f'Archived {self.listings} listings as {self.crawl} '
+                     f'({self.raw_bytes:,} bytes compressed to {self.compressed_bytes:,})')
+        return self.crawl
+
+    ## Throw away a crawl that did not finish
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        with self.archive.engine.begin() as connection:
+            connection.execute(text("DELETE FROM archive_index WHERE crawl = :crawl"), {"crawl": self.crawl})
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+# THE ARCHIVE
+
+class ScrapeArchive:
+    """
+    A folder of archived crawls and the index over them.
+
+    Args:
+        root (str): The archive folder (created if missing), e.g. data/archive.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.engine = sqlq.get_sql_engine(os.path.join(root, "index.db"))
+        with self.engine.begin() as connection:
+            for query in CREATE_ARCHIVE_SQL_QUERIES:
+                connection.execute(text(query))
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    ## Start writing a crawl
+    def writer(self, source: str, kind: str = "search", level: int = COMPRESSION_LEVEL) -> ArchiveWriter:
+        return ArchiveWriter(self, source, kind, level)
+
+    ## Archive a list of listings as one crawl, returning its id
+    def add(self, listings: Iterable[dict], source: str, kind: str = "search") -> str:
+        with self.writer(source, kind) as writer:
+            writer.write_many(listings)
+        return writer.crawl
+
+    ## Every finished crawl, oldest first
+    def crawls(self, source: Optional[str] = None, kind: Optional[str] = None) -> pd.DataFrame:
+        conditions, params = [], {}
+        if source is not None:
+            conditions.append("source = :source")
+            params["source"] = source
+        if kind is not None:
+            conditions.append("kind = :kind")
+            params["kind"] = kind
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        with self.engine.connect() as connection:
+            return pd.read_sql(text(f"SELECT * FROM archive_crawls{where} ORDER BY crawl"), connection, params=params)
+
+    ## The latest crawl (of a source or kind), if there is one
+    def latest(self, source: Optional[str] = None, kind: Optional[str] = None) -> Optional[str]:
+        crawls = self.crawls(source, kind)
+        return None if crawls.empty else crawls["crawl"].iloc[-1]
+
+    ## The crawls a listing appears in, oldest first
+    def history(self, listing_id: int) -> List[str]:
+        with self.engine.connect() as connection:
+            return list(connection.execute(text(
+                "SELECT i.crawl FROM archive_index i JOIN archive_crawls c ON c.crawl = i.crawl "
+                "WHERE i.id = :id ORDER BY i.crawl"
+            ), {"id": int(listing_id)}).scalars())
+
+    def _segment_path(self, crawl: str, segment: int) -> str:
+        return os.path.join(self.root, crawl, segment_name(segment))
+
+    def _read_frame(self, crawl: str, segment: int, offset: int, length: int) -> bytes:
+        with open(self._segment_path(crawl, segment), "rb") as f:
+            f.seek(offset)
+            return self._decompressor.decompress(f.read(length))
+
+    ## One listing as it was scraped, from its latest crawl (or from `crawl`)
+    def get(self, listing_id: int, crawl: Optional[str] = None) -> Optional[dict]:
+        """
+        Returns the raw listing, or None if the archive has never seen it.
+        Only the frame holding the listing is read and decompressed.
+        """
+        sql = GET_LOCATION_SQL_QUERY.format(crawl_condition="AND i.crawl = :crawl" if crawl else "")
+        params = {"id": int(listing_id)}
+        if crawl:
+            params["crawl"] = crawl
+        with self.engine.connect() as connection:
+            location = connection.execute(text(sql), params).first()
+        if location is None:
+            return None
+        _, crawl, segment, offset, length, start, size = location
+        frame = self._read_frame(crawl, segment, offset, length)
+        return json.loads(frame[start:start + size])
+
+    ## Many listings, decompressing each frame they share only once
+    def get_many(self, listing_ids: Iterable[int], crawl: Optional[str] = None) -> Dict[int, dict]:
+        """
+        Returns {id: raw listing} for the ids the archive has (from their latest
+        crawl, or from `crawl`); ids it has never seen are left out.
+        """
+        ids = sorted({int(i) for i in listing_ids})
+        if not ids:
+            return {}
+        with self.engine.connect() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS archive_wanted"))
+            connection.execute(text("CREATE TEMP TABLE archive_wanted (id INTEGER PRIMARY KEY)"))
+            connection.exec_driver_sql("INSERT INTO archive_wanted (id) VALUES (?)", [(i,) for i in ids])
+            crawl_condition = "AND i.crawl = :crawl" if crawl else ""
+            rows = connection.execute(text(f"""
+                SELECT i.id, i.crawl, i.segment, i.frame_offset, i.frame_length, i.line_start, i.line_length
+                FROM archive_index i
+                JOIN archive_wanted w ON w.id = i.id
+                JOIN archive_crawls c ON c.crawl = i.crawl
+                WHERE true {crawl_condition}
+                ORDER BY i.id, i.crawl DESC
+            """), {"crawl": crawl} if crawl else {}).all()
+            connection.execute(text("DROP TABLE archive_wanted"))
+        # keep each id's latest crawl, then read the frames in file order
+        latest = {}
+        for row in rows:
+            latest.setdefault(row[0], row)
+        by_frame: Dict[Tuple[str, int, int, int], List[tuple]] = {}
+        for row in latest.values():
+            by_frame.setdefault(row[1:5], []).append(row)
+        listings = {}
+        for (crawl_name, segment, offset, length), members in sorted(by_frame.items()):
+            frame = self._read_frame(crawl_name, segment, offset, length)
+            for listing_id, *_, start, size in members:
+                listings[listing_id] = json.loads(frame[start:start + size])
+        return listings
+
+    ## Stream a crawl back in order, a chunk of listings at a time
+    def iter_crawl(self, crawl: str, chunk_size: int = 10_000) -> Iterator[List[dict]]:
+        """
+        Yields the listings of a crawl in the order they were written, in lists
+        of at most `chunk_size`. Segments are decompressed as a stream, so
+        memory use does not depend on the size of the crawl.
+        """
+        with self.engine.connect() as connection:
+            segments = connection.execute(
+                text("SELECT segments FROM archive_crawls WHERE crawl = :crawl"), {"crawl": crawl}
+            ).scalar()
+        if segments is None:
+            raise KeyError(f"No finished crawl called {crawl!r} in {self.root}")
+        chunk: List[dict] = []
+        for segment in range(segments):
+            with open(self._segment_path(crawl, segment), "rb") as f:
+                reader = self._decompressor.stream_reader(f, read_across_frames=True)
+                for line in io.TextIOWrapper(io.BufferedReader(reader), encoding="utf-8"):
+                    chunk.append(json.loads(line))
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+        if chunk:
+            yield chunk
+
+    ## Delete a crawl's files and index entries
+    def remove(self, crawl: str):
+        with self.engine.begin() as connection:
+            connection.execute(text("DELETE FROM archive_crawls WHERE crawl = :crawl"), {"crawl": crawl})
+            connection.execute(text("DELETE FROM archive_index WHERE crawl = :crawl"), {"crawl": crawl})
+        shutil.rmtree(os.path.join(self.root, crawl), ignore_errors=True)
@@ -0,0 +1,325 @@
+# This module serves valuations and underpriced rankings over HTTP from one
+# long-lived process. The model and the property table are loaded once;
+# concurrent valuation requests are gathered into micro-batches so the model
+# predicts on one frame per batch instead of once per request; and latency
+# percentiles are kept per endpoint. It can listen on a TCP port or, for
+# local dashboards and bots, on a Unix socket.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Optional
+
+# Server
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socketserver
+import threading
+import queue
+from collections import deque
+from concurrent.futures import Future
+
+# Database Connection
+from rental_utils import property_queries as pq
+from rental_utils import functions as rent
+from rental_utils import modeling
+from rental_utils import comparables as cmp
+from rental_utils import ranking
+
+# File and System Operations
+import json
+import os
+import time
+
+# Tracking
+import logging
+
+
+# THE PROPERTY TABLE
+
+## Columns kept in memory: enough to value, rank and link to each listing
+SERVICE_COLUMNS = [
+    "id", "displayAddress", "propertyUrl", "propertySubType", "priceFrequency",
+    "price_per_bed", "predicted_price_per_bed", "prediction_sd", "bedrooms", "bathrooms",
+    "travel_time", "distance", "latitude", "longitude",
+]
+
+## Fields returned for each ranked listing
+RANKING_FIELDS = ["id", "displayAddress", "propertyUrl", "price_per_bed", "predicted_price_per_bed",
+                  "prediction_sd", "savings", "savings_z"]
+
+
+# MICRO-BATCHING
+
+class MicroBatcher:
+    """
+    Gathers rows submitted from many threads into batches for one vectorised call.
+
+    A background thread takes the first waiting request, then keeps collecting
+    for up to `max_wait_ms` or until `max_rows` rows are waiting, calls
+    `predict` once on all of them, and hands each request its slice of the result.
+    """
+
+    def __init__(self, predict, max_rows: int = 4096, max_wait_ms: float = 2.0):
+        self.predict = predict
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes = deque(maxlen=1000)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    ## Queue rows for prediction, returning a future for their results
+    def submit(self, rows: pd.DataFrame) -> Future:
+        future = Future()
+        self._queue.put((rows, future))
+        return future
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            n_rows = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while n_rows < self.max_rows:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                n_rows += len(item[0])
+            self._predict_batch(pending)
+
+    def _predict_batch(self, pending):
+        self.batch_sizes.append(len(pending))
+        try:
+            batch = pd.concat([rows for rows, _ in pending], ignore_index=True)
+            predictions = self.predict(batch)
+        except Exception as error:
+            for _, future in pending:
+                future.set_exception(error)
+            return
+        start = 0
+        for rows, future in pending:
+            future.set_result(predictions[start:start + len(rows)])
+            start += len(rows)
+
+
+# LATENCY
+
+class LatencyTracker:
+    """Keeps the most recent request latencies per endpoint and reports their percentiles."""
+
+    def __init__(self, window: int = 10_000):
+        self.window = window
+        self._latencies: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            recent = {endpoint: np.array(values) for endpoint, values in self._latencies.items()}
+            counts = dict(self._counts)
+        return {
+            endpoint: {
+                "count": counts[endpoint],
+                **{f"p{q}_ms": float(np.percentile(values, q) * 1000) for q in (50, 90, 95, 99)},
+                "max_ms": float(values.max() * 1000),
+            }
+            for endpoint, values in recent.items() if len(values)
+        }
+
+
+# THE SERVICE
+
+class ScoringService:
+    """
+    Answers valuation and ranking requests from a model and property table held in memory.
+
+    Args:
+        model (HedonicModel): The model used for valuations.
+        properties (pd.DataFrame): The property table (at least SERVICE_COLUMNS' prices).
+        comparables (ComparablesIndex): Optional index; valuations then include a comparable price.
+        rank_by (str): "savings" or "savings_z", as in ranking.UnderpricedIndex.
+        max_batch_rows (int): Largest micro-batch.
+        max_wait_ms (float): How long a batch waits for more requests.
+    """
+
+    def __init__(self, model: modeling.HedonicModel, properties: pd.DataFrame,
+                 comparables: Optional[cmp.ComparablesIndex] = None, rank_by: str = "savings",
+                 max_batch_rows: int = 4096, max_wait_ms: float = 2.0):
+        self.model = model
+        self.index = ranking.UnderpricedIndex(properties, rank_by=rank_by)
+        self.comparables = comparables
+        self.batcher = MicroBatcher(self._predict, max_batch_rows, max_wait_ms)
+        self.latency = LatencyTracker()
+        self.started = time.time()
+
+    ## Load the model and property table once
+    @classmethod
+    def from_database(cls, engine, model_dir: str, with_comparables: bool = True, **kwargs) -> "ScoringService":
+        model = modeling.load_model(model_dir)
+        if model is None:
+            raise FileNotFoundError(f"No saved model in {model_dir}; run nb04.py first")
+        properties = pq.PropertyQuery(columns=SERVICE_COLUMNS).read(engine)
+        comparables = cmp.ComparablesIndex().fit(rent.clean_for_reg(properties)) if with_comparables else None
+        logging.info(f'Loaded model {model.version} and {len(properties)} properties')
+        return cls(model, properties, comparables, **kwargs)
+
+    def _predict(self, rows: pd.DataFrame) -> np.ndarray:
+        predictions = self.model.predict(rows)
+        if self.comparables is None:
+            return predictions[:, None]
+        # the listing being valued is new, so nothing is excluded from its comparables
+        comparable = self.comparables.comparables(rows, exclude_self=False)["comparable_price_per_bed"]
+        return np.column_stack([predictions, comparable.to_numpy()])
+
+    ## Value one or many listings
+    def value(self, listings: List[dict]) -> List[dict]:
+        rows = pd.DataFrame.from_records(listings)
+        results = self.batcher.submit(rows).result()
+        values = []
+        for listing, result in zip(listings, results):
+            value = {"id": listing.get("id"), "predicted_price_per_bed": _number(result[0])}
+            if self.comparables is not None:
+                value["comparable_price_per_bed"] = _number(result[1])
+            values.append(value)
+        return values
+
+    ## Rank the most underpriced listings for one or many budgets
+    def rank(self, queries: List[ranking.BudgetQuery]) -> List[dict]:
+        rankings = self.index.query_many(queries, columns=RANKING_FIELDS)
+        for result in rankings:
+            result["listings"] = [{key: _number(value) for key, value in row.items()} for row in result["listings"]]
+        return rankings
+
+    def metrics(self) -> dict:
+        batch_sizes = np.array(self.batcher.batch_sizes) if self.batcher.batch_sizes else np.zeros(1)
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "model_version": self.model.version,
+            "properties": len(self.index),
+            "latency": self.latency.summary(),
+            "mean_requests_per_batch": float(batch_sizes.mean()),
+        }
+
+
+def _number(value):
+    # JSON has no NaN, and numpy scalars are not serialisable
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    return value
+
+
+# HTTP
+
+## Read one ranking request from its JSON form
+def _budget_query(body: dict) -> ranking.BudgetQuery:
+    bounds = {str(name): (None if low is None else float(low), None if high is None else float(high))
+              for name, (low, high) in body.get("bounds", {}).items()}
+    unknown = [name for name in bounds if name not in SERVICE_COLUMNS]
+    if unknown:
+        raise ValueError(f"cannot filter on {unknown}")
+    return ranking.BudgetQuery(budget=float(body["budget"]), k=int(body.get("k", 10)), bounds=bounds)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET  /health                        liveness
+    GET  /metrics                       latency percentiles and batch sizes
+    POST /value      {"listing": {...}} or {"listings": [...]}
+    POST /underpriced {"budget": 1200, "k": 10, "bounds": {"bedrooms": [2, null]}}
+                      or {"queries": [{"budget": ..., "k": ..., "bounds": ...}, ...]}
+    """
+    service: ScoringService = None
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._respond(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._respond(200, self.service.metrics())
+        else:
+            self._respond(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/value":
+                single = "listing" in body
+                listings = [body["listing"]] if single else body["listings"]
+                values = self.service.value(listings)
+                status, payload = 200, values[0] if single else {"values": values}
+            elif self.path == "/underpriced":
+                single = "budget" in body
+                queries = [_budget_query(q) for q in ([body] if single else body["queries"])]
+                rankings = self.service.rank(queries)
+                status, payload = 200, rankings[0] if single else {"rankings": rankings}
+            else:
+                self._respond(404, {"error": f"Unknown path {self.path}"})
+                return
+        except (KeyError, ValueError, TypeError) as error:
+            status, payload = 400, {"error": f"Bad request: {error}"}
+        except Exception as error:
+            # anything else is the service's fault: answer, so the client is not left waiting on a dropped connection
+            logging.exception(f'POST {self.path} failed')
+            status, payload = 500, {"error": f"Internal error: {type(error).__name__}"}
+        # failed requests count towards the endpoint's latency too, as the client waited for them
+        self.service.latency.record(self.path, time.perf_counter() - start)
+        self._respond(status, payload)
+
+    def _respond(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logging.debug(f'{self.address_string()} {format % args}')
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a client address
+        return request, ("unix", 0)
+
+
+## Build (but do not start) a server for the service
+def make_server(service: ScoringService, host: str = "127.0.0.1", port: int = 8000,
+                unix_socket: Optional[str] = None):
+    """
+    Returns a threading HTTP server bound to `host:port`, or to the Unix socket
+    path `unix_socket` if one is given. Call `serve_forever()` on it to run.
+    """
+    handler = type("ScoringHandler", (_Handler,), {"service": service})
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, handler)
+        logging.info(f'Scoring service listening on {unix_socket}')
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        logging.info(f'Scoring service listening on http://{host}:{server.server_port}')
+    return server
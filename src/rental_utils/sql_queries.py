@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy import inspect, text
+from sqlalchemy import Integer
+from sqlalchemy.engine import URL, make_url
+import pandas as pd
+import io
 import logging
 import os
 import sys
+import threading
+from rental_utils import instrumentation as instr
 
 #Getting the engine
 
@@ -12,26 +18,160 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0,os.path.join(current_dir, '..'))
 
 
+# ENGINE REGISTRY
+
+## Pragmas run on every new SQLite connection
+## WAL lets readers carry on while the ingest writes, and NORMAL sync is safe under WAL
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,      # negative values are KiB, so a 64 MB page cache
+    "mmap_size": 268435456,    # memory-map up to 256 MB of the database file
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,      # wait up to 5s for a competing writer instead of failing
+}
+
+## Pool settings per database backend
+POOL_SETTINGS = {
+    "sqlite": {"pool_size": 5, "max_overflow": 10, "pool_timeout": 30},
+    "postgresql": {
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,   # supabase drops idle connections, so recycle before it does
+        "pool_pre_ping": True,
+    },
+}
+
+## One engine (and its metrics) per database URL
+_ENGINES = {}
+_ENGINE_METRICS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _apply_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def _track_pool_events(engine, metrics):
+    """Counts connects and checkouts on the engine's pool, and tracks peak concurrent use."""
+    lock = threading.Lock()
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        with lock:
+            metrics["connects"] += 1
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with lock:
+            metrics["checkouts"] += 1
+            metrics["checked_out"] += 1
+            metrics["peak_checked_out"] = max(metrics["peak_checked_out"], metrics["checked_out"])
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        with lock:
+            metrics["checkins"] += 1
+            metrics["checked_out"] = max(metrics["checked_out"] - 1, 0)
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with lock:
+            metrics["invalidations"] += 1
+
+
+## Get (or create once) the engine for a database URL
+def get_engine(url, pragmas=None, **pool_kwargs):
+    """
+    Returns the shared SQLAlchemy engine for a database URL, creating it on first use.
+
+    File-backed SQLite engines run SQLITE_PRAGMAS (or `pragmas`) on every new
+    connection. Pool settings come from POOL_SETTINGS for the backend and can be
+    overridden with keyword arguments the first time the engine is created.
+
+    Args:
+        url (str or sqlalchemy.engine.URL): The database URL.
+        pragmas (dict): SQLite pragmas to use instead of SQLITE_PRAGMAS.
+
+    Returns:
+        sqlalchemy.engine.Engine: The SQLAlchemy engine object.
+    """
+    url = make_url(url)
+    key = url.render_as_string(hide_password=False)
+    with _REGISTRY_LOCK:
+        if key in _ENGINES:
+            return _ENGINES[key]
+
+        backend = url.get_backend_name()
+        in_memory = backend == "sqlite" and url.database in (None, "", ":memory:")
+        # in-memory SQLite lives inside a single connection, so keep SQLAlchemy's default pool
+        settings = {} if in_memory else dict(POOL_SETTINGS.get(backend, {}))
+        settings.update(pool_kwargs)
+        engine = create_engine(url, **settings)
+
+        if backend == "sqlite" and not in_memory:
+            sqlite_pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+            event.listen(engine, "connect",
+                         lambda dbapi_connection, record: _apply_sqlite_pragmas(dbapi_connection, sqlite_pragmas))
+
+        metrics = {"connects": 0, "checkouts": 0, "checkins": 0, "checked_out": 0,
+                   "peak_checked_out": 0, "invalidations": 0}
+        _track_pool_events(engine, metrics)
+
+        _ENGINES[key] = engine
+        _ENGINE_METRICS[key] = metrics
+        logging.info(f'Created engine for {url!r}')
+        return engine
+
+
+## Report connection and checkout counts for the registered engines
+def engine_metrics():
+    """
+    Returns a dict keyed by (password-masked) URL with each engine's connection
+    and checkout counters, plus the pool's own status line.
+    """
+    report = {}
+    with _REGISTRY_LOCK:
+        for key, engine in _ENGINES.items():
+            stats = dict(_ENGINE_METRICS[key])
+            stats["pool_status"] = engine.pool.status()
+            report[repr(engine.url)] = stats
+    return report
+
+
+## Close every pooled connection and forget the engines
+def dispose_engines():
+    with _REGISTRY_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+        _ENGINE_METRICS.clear()
+
+
 # Connect to local database
 def get_sql_engine(data_path):
     """
     Returns a SQLAlchemy engine object for connecting to a SQLite database.
 
-    If the engine object has not been created yet, it will be created and stored
-    as a static attribute of the `get_sql_engine` function.
+    Engines are shared through the registry in `get_engine`, so each database
+    file gets one pooled engine running the SQLite performance pragmas.
 
     Returns:
         sqlalchemy.engine.Engine: The SQLAlchemy engine object.
     """
-    if not hasattr(get_sql_engine, 'engine'):
-        get_sql_engine.engine = create_engine('sqlite:///' + data_path)
-    return get_sql_engine.engine
+    return get_engine('sqlite:///' + data_path)
 
 # Connect to cloud engine in supabase
 def get_supabase_engine(user, password, host, port, database):
-    connection_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
-    engine = create_engine(connection_string)
-    return engine
+    # psycopg2 is the driver pinned in requirements.txt
+    connection_url = URL.create(
+        "postgresql+psycopg2", username=user, password=password, host=host, port=port, database=database
+    )
+    return get_engine(connection_url)
 
 
 
@@ -41,6 +181,325 @@ def make_table(df, name, engine, if_exists='append'):
         pass
     df.to_sql(name, engine, if_exists=if_exists, index=False)
 
+
+# BULK UPDATES
+
+## Convert a dataframe into plain python rows that any DBAPI driver can bind
+def _frame_rows(df, columns):
+    """
+    Returns the selected columns of a DataFrame as a list of tuples, with
+    missing values as None and numpy scalars converted to python types.
+    """
+    subset = df[columns].copy()
+    for col in columns:
+        if pd.api.types.is_datetime64_any_dtype(subset[col]):
+            # not every driver can bind pandas Timestamps; this is the format SQLAlchemy uses on SQLite
+            subset[col] = subset[col].dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+    subset = subset.astype(object)
+    subset = subset.where(subset.notna(), None)
+    return list(subset.itertuples(index=False, name=None))
+
+
+## A file-like object that renders a dataframe as CSV a slice at a time for COPY
+class _CsvStream(io.TextIOBase):
+    """Feeds COPY FROM STDIN without ever holding the whole dataframe as one CSV string."""
+
+    def __init__(self, df, rows_per_chunk=50_000):
+        self._chunks = (
+            df.iloc[start:start + rows_per_chunk].to_csv(index=False, header=False)
+            for start in range(0, len(df), rows_per_chunk)
+        )
+        self._buffer = ""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        out, self._buffer = self._buffer[:size], self._buffer[size:]
+        return out
+
+
+## Stream a dataframe into a Postgres table with COPY FROM STDIN
+def _copy_frame(connection, staging, table, df, columns):
+    """
+    Loads the selected columns into `staging` with COPY. Columns that are
+    INTEGER in `table` are cast to nullable ints first, since pandas stores
+    them as floats (1234.0) or bools once NaNs or flags are involved.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    integer_cols = {
+        col["name"] for col in inspect(connection).get_columns(table)
+        if isinstance(col["type"], Integer)
+    }
+    frame = df[columns].copy()
+    for col in columns:
+        if col in integer_cols:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce").astype(float).round().astype("Int64")
+    col_list = ", ".join(quote(c) for c in columns)
+    copy_sql = f"COPY {quote(staging)} ({col_list}) FROM STDIN WITH (FORMAT csv)"
+    cursor = connection.connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2 pulls from a file-like object
+            cursor.copy_expert(copy_sql, _CsvStream(frame))
+        else:
+            # psycopg (3) takes the data pushed into a copy context
+            stream = _CsvStream(frame)
+            with cursor.copy(copy_sql) as copy:
+                for block in iter(lambda: stream.read(1 << 20), ""):
+                    copy.write(block)
+    finally:
+        cursor.close()
+
+
+## Write dataframe rows into a table as fast as the backend allows
+def _write_frame(connection, into, table, df, columns):
+    """
+    Inserts the selected columns of a dataframe into `into`: with COPY on Postgres
+    (column types taken from `table`), and with one executemany elsewhere.
+    """
+    if df.empty:
+        return
+    if connection.dialect.name == "postgresql":
+        _copy_frame(connection, into, table, df, columns)
+        return
+    quote = connection.dialect.identifier_preparer.quote
+    col_list = ", ".join(quote(c) for c in columns)
+    # positional placeholders in the driver's own style, sent as one executemany
+    marker = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+    placeholders = ", ".join([marker] * len(columns))
+    connection.exec_driver_sql(
+        f"INSERT INTO {quote(into)} ({col_list}) VALUES ({placeholders})", _frame_rows(df, columns)
+    )
+
+
+## Copy rows into a staging table that mirrors the column types of the target
+def _stage_frame(connection, staging, table, df, columns):
+    """
+    Creates a temporary staging table with the same column types as `table`
+    (restricted to `columns`) and loads the dataframe into it: with COPY on
+    Postgres, and with one executemany elsewhere.
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    col_list = ", ".join(quote(c) for c in columns)
+    connection.execute(text(f"DROP TABLE IF EXISTS {quote(staging)}"))
+    # CREATE TEMP TABLE ... AS SELECT copies the declared types on both SQLite and Postgres
+    connection.execute(text(
+        f"CREATE TEMP TABLE {quote(staging)} AS "
+        f"SELECT {col_list} FROM {quote(table)} WHERE 1 = 0"
+    ))
+    _write_frame(connection, staging, table, df, columns)
+
+
+## Check whether the database understands UPDATE ... FROM
+def _supports_update_from(connection):
+    """UPDATE ... FROM exists on Postgres and on SQLite from version 3.33."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 33, 0)
+    return dialect == "postgresql"
+
+
+## Update many rows of a table in one set-based statement
+@instr.timed("bulk_update", rows=1)
+def bulk_update(table, df, key, columns, engine, only_null=False, staging=None):
+    """
+    Updates `columns` of `table` from a dataframe, matching rows on `key`.
+
+    The data is staged into an indexed temporary table and applied with a single
+    UPDATE ... FROM join (SQLite 3.33+ and Postgres), falling back to indexed
+    correlated subqueries on older SQLite. Everything runs in one transaction.
+
+    Args:
+        table (str): The table to update.
+        df (pd.DataFrame): Holds the key column and the new values (if a key repeats, its last row wins).
+        key (str): The column used to match rows (e.g. "id").
+        columns (list): The columns to overwrite.
+        engine (sqlalchemy.engine.Engine): The database to write to.
+        only_null (bool): Only fill in rows where any of the columns is still NULL.
+        staging (str): Name of the temporary staging table (default "staging_<table>").
+
+    Returns:
+        int: The number of rows updated.
+    """
+    columns = list(columns)
+    staging = staging or f"staging_{table}"
+    # the staging key is unique, so a repeated key keeps its last row (as in bulk_load)
+    df = df.drop_duplicates(subset=key, keep="last")
+    with engine.begin() as connection:
+        quote = connection.dialect.identifier_preparer.quote
+        _stage_frame(connection, staging, table, df, [key] + columns)
+        connection.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {quote(staging + '_key')} "
+            f"ON {quote(staging)} ({quote(key)})"
+        ))
+
+        target, stage, k = quote(table), quote(staging), quote(key)
+        null_filter = ""
+        if only_null:
+            null_filter = " AND (" + " OR ".join(f"{target}.{quote(c)} IS NULL" for c in columns) + ")"
+
+        if _supports_update_from(connection):
+            assignments = ", ".join(f"{quote(c)} = s.{quote(c)}" for c in columns)
+            statement = (
+                f"UPDATE {target} SET {assignments} "
+                f"FROM {stage} AS s WHERE {target}.{k} = s.{k}{null_filter}"
+            )
+        else:
+            assignments = ", ".join(
+                f"{quote(c)} = (SELECT s.{quote(c)} FROM {stage} AS s WHERE s.{k} = {target}.{k})"
+                for c in columns
+            )
+            statement = (
+                f"UPDATE {target} SET {assignments} "
+                f"WHERE {k} IN (SELECT {k} FROM {stage}){null_filter}"
+            )
+        result = connection.execute(text(statement))
+        connection.execute(text(f"DROP TABLE IF EXISTS {stage}"))
+    return result.rowcount
+
+
+# STREAMED READS
+
+## pandas dtypes for the columns of properties_data, so every chunk comes back with the same types
+## (nullable Int64 keeps INTEGER columns integral when they hold NULLs)
+PROPERTIES_DTYPES = {
+    "id": "Int64",
+    "price_per_bed": "float64",
+    "predicted_price_per_bed": "float64",
+    "prediction_sd": "float64",
+    "travel_time": "Int64",
+    "distance": "Int64",
+    "bedrooms": "Int64",
+    "bathrooms": "Int64",
+    "numberOfImages": "Int64",
+    "latitude": "float64",
+    "longitude": "float64",
+    "priceAmount": "Int64",
+    "premiumListing": "Int64",
+    "featuredProperty": "Int64",
+    "students": "Int64",
+    "savings": "float64",
+    "savings_z": "float64",
+}
+
+
+## Cast a chunk to the declared dtypes (columns that are not listed are left alone)
+def _apply_dtypes(chunk, dtypes):
+    present = {c: t for c, t in dtypes.items() if c in chunk.columns}
+    for col, dtype in present.items():
+        if dtype == "Int64":
+            # floats such as 1234.0 (from NULL-holding columns) need rounding before the cast
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce").round().astype("Int64")
+        else:
+            chunk[col] = chunk[col].astype(dtype)
+    return chunk
+
+
+## Read a query as a stream of dataframes
+def iter_query(engine, sql, params=None, chunksize=50_000, dtypes=None):
+    """
+    Yields the result of a query as DataFrame chunks of at most `chunksize` rows.
+
+    On Postgres the rows come through a server-side cursor, so neither the driver
+    nor pandas ever holds more than one chunk; on SQLite the cursor is read
+    `chunksize` rows at a time. Chunks are cast to `dtypes` (PROPERTIES_DTYPES by default).
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The database to read from.
+        sql (str): The SELECT to run.
+        params (dict): Parameters to bind to the query.
+        chunksize (int): Rows per chunk.
+        dtypes (dict): Column name to pandas dtype.
+
+    Yields:
+        pd.DataFrame: The next chunk of rows.
+    """
+    dtypes = PROPERTIES_DTYPES if dtypes is None else dtypes
+    with engine.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            connection = connection.execution_options(stream_results=True, max_row_buffer=chunksize)
+        for chunk in pd.read_sql(text(sql), connection, params=params, chunksize=chunksize):
+            yield _apply_dtypes(chunk, dtypes)
+
+
+# BULK LOADING
+
+## Append a dataframe to an existing table
+@instr.timed("bulk_insert", rows=1)
+def bulk_insert(table, df, engine):
+    """
+    Appends the rows of a dataframe to `table` in one transaction, with COPY on
+    Postgres and one executemany elsewhere. Much faster than `make_table`
+    (to_sql), which sends one INSERT per row on most drivers.
+
+    Returns:
+        int: The number of rows written.
+    """
+    with engine.begin() as connection:
+        _write_frame(connection, table, table, df, list(df.columns))
+    return len(df)
+
+
+## Insert (or upsert) a dataframe with the duplicate check done inside the database
+@instr.timed("bulk_load", rows=1)
+def bulk_load(table, df, key, engine, upsert=False, staging=None):
+    """
+    Loads the rows of a dataframe into `table`, skipping (or updating) rows whose
+    `key` already exists.
+
+    The frame is streamed into a temporary staging table (COPY FROM STDIN on
+    Postgres) and moved across with a single INSERT ... SELECT, so the existing
+    keys never leave the database. Only columns that exist in `table` are loaded.
+
+    Args:
+        table (str): The table to load into; `key` must be its primary key.
+        df (pd.DataFrame): The rows to load.
+        key (str): The column identifying a row (e.g. "id").
+        engine (sqlalchemy.engine.Engine): The database to write to.
+        upsert (bool): Overwrite rows that already exist instead of skipping them.
+        staging (str): Name of the temporary staging table (default "staging_<table>").
+
+    Returns:
+        int: The number of rows inserted or updated.
+    """
+    staging = staging or f"staging_{table}"
+    with engine.begin() as connection:
+        quote = connection.dialect.identifier_preparer.quote
+        table_cols = {col["name"] for col in inspect(connection).get_columns(table)}
+        columns = [c for c in df.columns if c in table_cols]
+        # a key may only appear once, otherwise the insert (or upsert) would hit it twice
+        rows = df.drop_duplicates(subset=key, keep="last")
+        _stage_frame(connection, staging, table, rows, columns)
+
+        target, stage, k = quote(table), quote(staging), quote(key)
+        col_list = ", ".join(quote(c) for c in columns)
+        if upsert:
+            assignments = ", ".join(f"{quote(c)} = excluded.{quote(c)}" for c in columns if c != key)
+            # with only the key in common there is nothing to overwrite, so existing rows are left alone
+            on_conflict = f"DO UPDATE SET {assignments}" if assignments else "DO NOTHING"
+            # the WHERE true stops SQLite reading ON CONFLICT as part of a join
+            statement = (
+                f"INSERT INTO {target} ({col_list}) SELECT {col_list} FROM {stage} WHERE true "
+                f"ON CONFLICT ({k}) {on_conflict}"
+            )
+        else:
+            statement = (
+                f"INSERT INTO {target} ({col_list}) SELECT {col_list} FROM {stage} AS s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {target} AS t WHERE t.{k} = s.{k})"
+            )
+        result = connection.execute(text(statement))
+        connection.execute(text(f"DROP TABLE IF EXISTS {stage}"))
+    return result.rowcount
+
 #SQL QUERIES
 # create a table if it doesn't exist
 CREATE_TABLE_SQL_QUERY = """
@@ -48,6 +507,7 @@ CREATE TABLE IF NOT EXISTS properties_data (
     id INTEGER PRIMARY KEY,
     price_per_bed REAL,
     predicted_price_per_bed REAL,
+    prediction_sd REAL,
     travel_time INTEGER,
     distance INTEGER,
     bedrooms INTEGER,
@@ -69,7 +529,9 @@ CREATE TABLE IF NOT EXISTS properties_data (
     "propertyUrl" TEXT,
     "firstVisibleDate" TEXT,
     "addedOrReduced" TEXT,
-    "propertyTypeFullDescription" TEXT
+    "propertyTypeFullDescription" TEXT,
+    summary TEXT,
+    city TEXT
 );
 """
 
@@ -89,7 +551,53 @@ SELECT
     *
 FROM properties_data
 """
+## Indexes kept on properties_data for the filters and rankings in property_queries
+PROPERTIES_INDEXES = {
+    "idx_properties_price_per_bed": "price_per_bed",
+    "idx_properties_travel_time": "travel_time",
+    "idx_properties_predicted_price_per_bed": "predicted_price_per_bed",
+    "idx_properties_location": "latitude, longitude",
+}
+
+
+## Create any of the managed indexes that are missing
+def ensure_indexes(engine, table="properties_data", indexes=None):
+    """
+    Creates the indexes in PROPERTIES_INDEXES (or `indexes`) on `table` if they do not exist yet.
+    Works on both SQLite and Postgres, and is cheap to call on every run.
+    """
+    indexes = PROPERTIES_INDEXES if indexes is None else indexes
+    with engine.begin() as connection:
+        for name, columns in indexes.items():
+            connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+## Add a column to an existing table if it is missing
+def ensure_column(engine, table, column, sql_type):
+    """
+    Adds `column` (of SQL type `sql_type`, e.g. "REAL") to `table` unless it is
+    already there, so databases created before a column was added to
+    CREATE_TABLE_SQL_QUERY pick it up. Returns True if the column was added.
+    """
+    with engine.begin() as connection:
+        existing = {col["name"] for col in inspect(connection).get_columns(table)}
+        if column in existing:
+            return False
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN "{column}" {sql_type}'))
+    logging.info(f'Added column {column} to {table}')
+    return True
+
+
+## Drop the managed indexes (e.g. before a very large load, to rebuild them afterwards)
+def drop_indexes(engine, indexes=None):
+    indexes = PROPERTIES_INDEXES if indexes is None else indexes
+    with engine.begin() as connection:
+        for name in indexes:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
 ## Update existing table with new data
+## (superseded by bulk_update, kept for notebooks that still run them directly)
 
 ### Update travel time and distance
 UPDATE_DIST_AND_TRAVEL_TIME = """
@@ -0,0 +1,244 @@
+# This module makes seeded, Rightmove-shaped test data: listings as the
+# `_search` API returns them (what functions.scrape_search collects) and
+# property pages carrying a PAGE_MODEL variable (what functions.extract_page_model
+# reads). Listings are drawn in fixed blocks, each seeded from (seed, block),
+# so listing i is the same however many are asked for or however they are
+# chunked, and a million of them can be streamed without holding them all.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import numpy as np
+from typing import Dict, Iterator, List
+from functools import lru_cache
+
+# Response output
+import json
+
+# Keywords for the descriptions
+from rental_utils.text_features import KEYWORDS
+
+
+# SETTINGS
+
+## Listings drawn per seeded block
+BLOCK_SIZE = 10_000
+
+## Listings per page of search results (as in functions.scrape_search)
+RESULTS_PER_PAGE = 24
+
+## The first listing id (real ids are 9 digit numbers)
+FIRST_ID = 100_000_000
+
+PROPERTY_SUB_TYPES = ["Flat", "Apartment", "Studio", "Maisonette", "Terraced", "Semi-Detached", "Penthouse"]
+UPDATE_REASONS = ["new", "price_reduced", "price_increased"]
+STATIONS = ["Bank", "Liverpool Street", "King's Cross St. Pancras", "Waterloo", "Stratford", "Canada Water",
+            "Brixton", "Camden Town", "Clapham Junction", "Shoreditch High Street"]
+STREETS = ["High Street", "Station Road", "Church Lane", "Victoria Road", "Park Avenue", "Mill Lane",
+           "Queens Road", "Kings Road", "Green Lane", "The Broadway"]
+OUTCODES = ["E1", "E2", "E14", "N1", "N7", "NW1", "SE1", "SE15", "SW2", "SW11", "W2", "W12"]
+
+
+# LISTINGS
+
+## Draw one block of listings as columns (the last few are kept, since pages are asked for in order)
+@lru_cache(maxsize=4)
+def _draw_block(seed: int, block: int) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng([seed, block])
+    n = BLOCK_SIZE
+    bedrooms = rng.choice([0, 1, 2, 3, 4, 5], size=n, p=[0.08, 0.3, 0.32, 0.18, 0.08, 0.04])
+    weekly = rng.random(n) < 0.15
+    # monthly rents rise with bedrooms, with a long right tail
+    monthly = np.round(rng.lognormal(np.log(1400 + 650 * np.maximum(bedrooms, 1)), 0.35, n), -1)
+    amount = np.where(weekly, np.round(monthly * 12 / 52), monthly)
+    days = rng.integers(0, 365, n)
+    return {
+        "id": FIRST_ID + block * n + np.arange(n),
+        "bedrooms": bedrooms,
+        "bathrooms": np.where(rng.random(n) < 0.03, 0, np.minimum(np.maximum(bedrooms, 1), rng.integers(1, 4, n))),
+        "images": rng.integers(1, 40, n),
+        "latitude": np.round(51.51 + rng.normal(0, 0.07, n), 6),
+        "longitude": np.round(-0.12 + rng.normal(0, 0.11, n), 6),
+        "sub_type": rng.integers(0, len(PROPERTY_SUB_TYPES), n),
+        "reason": rng.integers(0, len(UPDATE_REASONS), n),
+        "amount": amount,
+        "weekly": weekly,
+        "premium": rng.random(n) < 0.05,
+        "featured": rng.random(n) < 0.02,
+        "students": rng.random(n) < 0.03,
+        "size": np.where(rng.random(n) < 0.4, rng.integers(25, 160, n), 0),
+        "days": days,
+        "street": rng.integers(0, len(STREETS), n),
+        "number": rng.integers(1, 300, n),
+        "outcode": rng.integers(0, len(OUTCODES), n),
+        "keywords": rng.integers(0, 1 << len(KEYWORDS), n),
+        "station": rng.integers(0, len(STATIONS), n),
+        "station_distance": np.round(rng.exponential(0.5, n) + 0.05, 2),
+        "branch": rng.integers(10_000, 99_999, n),
+    }
+
+
+def _date(days: int) -> str:
+    return str(np.datetime64("2025-01-01") + np.timedelta64(int(days), "D"))
+
+
+def _description(columns: Dict[str, np.ndarray], i: int) -> str:
+    mask = int(columns["keywords"][i])
+    words = [word for bit, word in enumerate(KEYWORDS) if mask >> bit & 1]
+    bedrooms = int(columns["bedrooms"][i])
+    kind = PROPERTY_SUB_TYPES[columns["sub_type"][i]].lower()
+    return (f"A {' and '.join(words) + ' ' if words else ''}{bedrooms} bedroom {kind} "
+            f"moments from {STATIONS[columns['station'][i]]} station.")
+
+
+def _address(columns: Dict[str, np.ndarray], i: int) -> str:
+    return f"{columns['number'][i]} {STREETS[columns['street'][i]]}, London {OUTCODES[columns['outcode'][i]]}"
+
+
+## One listing in the shape of the `_search` API's "properties" entries
+def _search_listing(columns: Dict[str, np.ndarray], i: int) -> dict:
+    listing_id = int(columns["id"][i])
+    bedrooms = int(columns["bedrooms"][i])
+    amount = float(columns["amount"][i])
+    frequency = "weekly" if columns["weekly"][i] else "monthly"
+    sub_type = PROPERTY_SUB_TYPES[columns["sub_type"][i]]
+    date = _date(columns["days"][i])
+    size = int(columns["size"][i])
+    return {
+        "id": listing_id,
+        "bedrooms": bedrooms,
+        "bathrooms": int(columns["bathrooms"][i]),
+        "numberOfImages": int(columns["images"][i]),
+        "numberOfFloorplans": 1,
+        "numberOfVirtualTours": 0,
+        "summary": _description(columns, i),
+        "displayAddress": _address(columns, i),
+        "countryCode": "GB",
+        "location": {"latitude": float(columns["latitude"][i]), "longitude": float(columns["longitude"][i])},
+        "propertySubType": sub_type,
+        "listingUpdate": {"listingUpdateReason": UPDATE_REASONS[columns["reason"][i]],
+                          "listingUpdateDate": f"{date}T09:00:00Z"},
+        "premiumListing": bool(columns["premium"][i]),
+        "featuredProperty": bool(columns["featured"][i]),
+        "price": {
+            "amount": amount,
+            "frequency": frequency,
+            "currencyCode": "GBP",
+            "displayPrices": [{"displayPrice": f"£{amount:,.0f} {'pw' if frequency == 'weekly' else 'pcm'}",
+                               "displayPriceQualifier": ""}],
+        },
+        "customer": {"branchId": int(columns["branch"][i]), "brandTradingName": "Synthetic Lettings"},
+        "transactionType": "rent",
+        "students": bool(columns["students"][i]),
+        "displaySize": f"{size} sq. m." if size else "",
+        "propertyUrl": f"/properties/{listing_id}#/?channel=RES_LET",
+        "channel": "RENT",
+        "firstVisibleDate": f"{date}T09:00:00Z",
+        "addedOrReduced": f"Added on {date[8:10]}/{date[5:7]}/{date[:4]}",
+        "propertyTypeFullDescription": f"{bedrooms} bedroom {sub_type.lower()}" if bedrooms else "Studio",
+    }
+
+
+## Stream n listings in chunks of at most chunk_size
+def iter_search_listings(n: int, seed: int = 0, chunk_size: int = BLOCK_SIZE) -> Iterator[List[dict]]:
+    """
+    Yields lists of `_search`-shaped listings, n in total. Listing i depends only
+    on (seed, i), so the output is the same for any chunk_size.
+    """
+    chunk: List[dict] = []
+    for block in range((n + BLOCK_SIZE - 1) // BLOCK_SIZE):
+        columns = _draw_block(seed, block)
+        for i in range(min(BLOCK_SIZE, n - block * BLOCK_SIZE)):
+            chunk.append(_search_listing(columns, i))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+## All n listings at once (the list functions.scrape_search returns)
+def search_listings(n: int, seed: int = 0) -> List[dict]:
+    return [listing for chunk in iter_search_listings(n, seed) for listing in chunk]
+
+
+## The `_search` response for the page starting at `index`
+def search_page(n: int, index: int = 0, seed: int = 0, per_page: int = RESULTS_PER_PAGE, first: int = 0) -> dict:
+    """
+    Returns the JSON body of one page of a search with n results, as the API
+    answers `index=<offset>&numberOfPropertiesPerPage=<per_page>`. The search
+    covers listings first to first + n - 1, so different searches (one per
+    location, say) can be given listings that do not overlap.
+    """
+    stop = min(index + per_page, n)
+    properties = []
+    if stop > index:
+        low, high = first + index, first + stop
+        for block in range(low // BLOCK_SIZE, (high - 1) // BLOCK_SIZE + 1):
+            columns = _draw_block(seed, block)
+            start = max(low, block * BLOCK_SIZE) - block * BLOCK_SIZE
+            end = min(high, (block + 1) * BLOCK_SIZE) - block * BLOCK_SIZE
+            properties.extend(_search_listing(columns, i) for i in range(start, end))
+    return {
+        "properties": properties,
+        "resultCount": f"{n:,}",
+        "pagination": {"total": (n + per_page - 1) // per_page, "page": str(index // per_page + 1),
+                       "next": str(stop) if stop < n else None},
+    }
+
+
+# PROPERTY PAGES
+
+## The PAGE_MODEL "propertyData" of listing i
+def page_model(i: int, seed: int = 0) -> dict:
+    """
+    Returns the property data a listing page carries in its PAGE_MODEL
+    variable, covering every path functions.parse_property reads.
+    """
+    block, row = divmod(i, BLOCK_SIZE)
+    columns = _draw_block(seed, block)
+    listing = _search_listing(columns, row)
+    size = int(columns["size"][row])
+    amount = listing["price"]["amount"]
+    return {
+        "id": str(listing["id"]),
+        "status": {"published": True, "archived": False},
+        "contactInfo": {"telephoneNumbers": {"localNumber": f"020 {7000 + row % 1000:04d} {row % 10000:04d}"}},
+        "bedrooms": listing["bedrooms"],
+        "bathrooms": listing["bathrooms"],
+        "transactionType": "RENT",
+        "propertySubType": listing["propertySubType"],
+        "tags": [],
+        "text": {"description": listing["summary"], "pageTitle": listing["propertyTypeFullDescription"],
+                 "propertyPhrase": f"{listing['propertyTypeFullDescription']} to rent"},
+        "prices": {"primaryPrice": listing["price"]["displayPrices"][0]["displayPrice"],
+                   "pricePerSqFt": f"£{amount / (size * 10.764):.2f} per sq. ft." if size else None},
+        "address": {"displayAddress": listing["displayAddress"], "outcode": OUTCODES[columns["outcode"][row]],
+                    "incode": "1AA"},
+        "location": listing["location"],
+        "keyFeatures": [word.capitalize() for word in KEYWORDS if word in listing["summary"]],
+        "listingHistory": {"listingUpdateReason": listing["listingUpdate"]["listingUpdateReason"]},
+        "images": [{"url": f"https://media.example/{listing['id']}/{k}.jpg", "caption": None}
+                   for k in range(min(listing["numberOfImages"], 5))],
+        "floorplans": [{"url": f"https://media.example/{listing['id']}/floorplan.jpg", "caption": "Floorplan"}],
+        "customer": {"branchId": listing["customer"]["branchId"], "branchName": "Central",
+                     "companyName": "Synthetic Lettings", "displayAddress": listing["displayAddress"],
+                     "commercial": False, "buildToRent": False, "isNewHomeDeveloper": False},
+        "industryAffiliations": [{"name": "ARLA Propertymark"}],
+        "nearestAirports": [{"name": "London City", "distance": 9.4}],
+        "nearestStations": [{"name": STATIONS[columns["station"][row]],
+                             "distance": float(columns["station_distance"][row])}],
+        "sizings": [{"unit": "sqm", "minimumSize": size, "maximumSize": size}] if size else [],
+        "brochures": [],
+    }
+
+
+## A listing page as the site serves it, with the data in a PAGE_MODEL script
+def page_model_html(i: int, seed: int = 0) -> str:
+    model = {"propertyData": page_model(i, seed), "metadata": {"publicsiteUrl": "https://www.rightmove.co.uk"}}
+    return (
+        "<!DOCTYPE html><html><head><title>Property to rent</title></head><body>"
+        "<div id=\"root\"></div>"
+        f"<script>window.PAGE_MODEL = {json.dumps(model)}</script>"
+        "</body></html>"
+    )
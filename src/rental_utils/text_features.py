@@ -0,0 +1,229 @@
+# This module turns listing text (the title, description and key features
+# extracted by parse_property) into model features: vectorised keyword flags
+# for the words the README cares about (luxury, spacious, renovated, ...), and
+# sentence embeddings computed on the CPU in length-sorted, token-budgeted
+# batches. Embeddings are cached on disk keyed by a hash of the text, so a
+# listing is only ever encoded once while its text stays the same.
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+# Database Connection (the embedding cache is a small SQLite file)
+import sqlite3
+
+# File and System Operations
+import hashlib
+import os
+
+# Tracking
+import logging
+
+
+# KEYWORD FLAGS
+
+## Listing words that may carry a premium, as regular expressions
+KEYWORDS = {
+    "luxury": r"luxur",
+    "spacious": r"spacious",
+    "renovated": r"renovat|refurbish|newly decorated",
+    "furnished": r"(?<!un)furnished",
+    "garden": r"garden",
+    "penthouse": r"penthouse",
+}
+
+## Free-text columns used, where present (properties_data columns and parse_property fields)
+TEXT_COLUMNS = ["propertyTypeFullDescription", "displayAddress", "summary", "title", "subtitle", "description", "features"]
+
+
+## Join a listing's text columns into one string per row
+def listing_text(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.Series:
+    """
+    Returns one string per row joining whichever of `columns` (default TEXT_COLUMNS)
+    the frame has. List-valued columns, such as key features, are joined with spaces.
+    """
+    columns = TEXT_COLUMNS if columns is None else columns
+    text = pd.Series("", index=df.index, dtype=object)
+    for col in (c for c in columns if c in df.columns):
+        values = df[col].map(lambda v: " ".join(map(str, v)) if isinstance(v, (list, tuple)) else v)
+        text = text + " " + values.fillna("").astype(str)
+    return text.str.strip()
+
+
+## One 0/1 column per keyword
+def keyword_flags(df: pd.DataFrame, keywords: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Returns a DataFrame with a `kw_<name>` 0/1 column per keyword pattern,
+    matched case-insensitively across the listing's text columns.
+    """
+    keywords = KEYWORDS if keywords is None else keywords
+    text = listing_text(df).str.lower()
+    return pd.DataFrame(
+        {f"kw_{name}": text.str.contains(pattern, regex=True).astype(np.int8) for name, pattern in keywords.items()},
+        index=df.index,
+    )
+
+
+# EMBEDDING CACHE
+
+## Hash a text (and the model) into a cache key
+def text_hash(text: str, model_name: str = "") -> str:
+    return hashlib.sha1(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings on disk, keyed by text hash, in a SQLite file holding float32 vectors.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+
+    def get_many(self, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        hashes = list(hashes)
+        # stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 900):
+            batch = hashes[start:start + 900]
+            rows = self.connection.execute(
+                f"SELECT hash, vector FROM embeddings WHERE hash IN ({', '.join('?' * len(batch))})", batch
+            )
+            found.update({h: np.frombuffer(v, dtype=np.float32) for h, v in rows})
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (hash, dim, vector) VALUES (?, ?, ?)",
+                [(h, len(v), np.asarray(v, dtype=np.float32).tobytes()) for h, v in vectors.items()],
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+# EMBEDDINGS
+
+class TextEmbedder:
+    """
+    Batched CPU sentence embeddings with an on-disk cache.
+
+    Texts are sorted by length and packed into batches of at most
+    `max_tokens_per_batch` padded tokens, so short listings are not padded to
+    the length of long ones. The default model is a distilled MiniLM; with
+    `quantize=True` its linear layers run as dynamic int8, which is faster on
+    CPUs at a small cost in accuracy. torch and transformers are only imported
+    when something actually needs encoding.
+    """
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 cache_path: Optional[str] = None, quantize: bool = False,
+                 max_tokens_per_batch: int = 8192, max_length: int = 256):
+        self.model_name = model_name
+        self.quantize = quantize
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_length = max_length
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self._tokenizer = None
+        self._model = None
+
+    @property
+    def cache_key(self) -> str:
+        # quantized vectors differ slightly, so they are cached separately
+        return self.model_name + (":int8" if self.quantize else "")
+
+    def _load(self):
+        if self._model is not None:
+            return
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        logging.info(f'Loading text model {self.cache_key}')
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = AutoModel.from_pretrained(self.model_name).eval()
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._model = model
+
+    ## Group texts into batches that stay under the padded-token budget
+    def _batches(self, lengths: np.ndarray) -> List[np.ndarray]:
+        order = np.argsort(lengths, kind="stable")
+        batches, current, longest = [], [], 0
+        for i in order:
+            longest_if_added = max(longest, int(lengths[i]))
+            if current and longest_if_added * (len(current) + 1) > self.max_tokens_per_batch:
+                batches.append(np.array(current))
+                current, longest_if_added = [], int(lengths[i])
+            current.append(i)
+            longest = longest_if_added
+        if current:
+            batches.append(np.array(current))
+        return batches
+
+    ## Encode texts without looking at the cache
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        import torch
+        self._load()
+        lengths = np.array([
+            len(ids) for ids in self._tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+        ])
+        out = None
+        with torch.inference_mode():
+            for batch in self._batches(lengths):
+                tokens = self._tokenizer([texts[i] for i in batch], padding=True, truncation=True,
+                                         max_length=self.max_length, return_tensors="pt")
+                hidden = self._model(**tokens).last_hidden_state
+                # mean-pool over real tokens, then L2-normalise (as sentence-transformers does)
+                mask = tokens["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+                if out is None:
+                    out = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+                out[batch] = pooled.numpy()
+        return out
+
+    ## Embed texts, encoding only the ones not already cached
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        """
+        Returns an (n, dim) float32 array of embeddings. Repeated texts are
+        encoded once, and cached texts are not encoded at all.
+        """
+        texts = ["" if t is None else str(t) for t in texts]
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        hashes = [text_hash(t, self.cache_key) for t in texts]
+        unique = dict(zip(hashes, texts))
+        vectors = self.cache.get_many(unique) if self.cache else {}
+        missing = [h for h in unique if h not in vectors]
+        logging.info(f'{len(texts)} texts: {len(unique) - len(missing)} cached, {len(missing)} to encode')
+        if missing:
+            encoded = self._encode([unique[h] for h in missing])
+            new = dict(zip(missing, encoded))
+            if self.cache:
+                self.cache.put_many(new)
+            vectors.update(new)
+        return np.vstack([vectors[h] for h in hashes])
+
+
+# FEATURE STAGE
+
+## Keyword flags plus (optionally) embedding columns for a frame of listings
+def text_features(df: pd.DataFrame, embedder: Optional[TextEmbedder] = None) -> pd.DataFrame:
+    """
+    Returns keyword flag columns for every row and, if an embedder is given,
+    `emb_0 ... emb_{d-1}` embedding columns of the listing text.
+    """
+    features = keyword_flags(df)
+    if embedder is not None:
+        vectors = embedder.embed(listing_text(df).tolist())
+        embedded = pd.DataFrame(vectors, index=df.index, columns=[f"emb_{i}" for i in range(vectors.shape[1])])
+        features = features.join(embedded)
+    return features
@@ -0,0 +1,283 @@
+# This module puts error bars on predicted rent per bedroom, so a listing that
+# looks underpriced by less than the model's own noise does not top the
+# ranking. Bootstrap replicates of a linear model are drawn as matrices of
+# resampling counts, a block of rows at a time, and solved together as batched
+# least squares;
+# non-linear models are refit on resamples across a process pool. Savings are
+# then reported in standard deviations of the prediction (z-scores).
+
+
+# IMPORT PACKAGES
+# Data Manipulation and Analysis
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+# Regressions
+from sklearn.base import clone
+
+# Parallel Processing
+from concurrent.futures import ProcessPoolExecutor
+from rental_utils import model_search
+
+# File and System Operations
+import os
+import tempfile
+
+# Tracking
+import logging
+
+
+# RESAMPLING
+
+## Largest block of resampling counts drawn at once. Drawing takes about 28 bytes per
+## row per replicate: the int64 indices, their offsets and counts, then the int32 copy kept
+COUNT_BLOCK_BYTES = 64 * 1024 * 1024
+DRAW_BYTES = 28
+
+
+## How often each row is drawn in each of n_boot resamples of n rows, a block of rows at a time
+def iter_resample_counts(n: int, n_boot: int, rng: np.random.Generator,
+                         row_block: int) -> Iterator[Tuple[slice, np.ndarray]]:
+    """
+    Yields (rows, counts) for consecutive blocks of `row_block` rows, where counts
+    is the n_boot x len(rows) int32 slice of one n_boot x n resampling matrix.
+
+    How many of each replicate's n draws land in each block is drawn first (a
+    multinomial over the blocks); the draws within a block are then uniform over
+    its rows. That is the same distribution as drawing n indices per replicate,
+    but each block is drawn for every replicate in a single call, and the full
+    matrix never exists.
+    """
+    starts = np.arange(0, n, row_block)
+    sizes = np.diff(np.append(starts, n))
+    per_block = rng.multinomial(n, sizes / n, size=n_boot) if n else np.zeros((n_boot, 0), dtype=np.int64)
+    for block, (start, size) in enumerate(zip(starts, sizes)):
+        draws = per_block[:, block]
+        # each replicate's draws are shifted into its own row of the block before counting
+        indices = rng.integers(0, size, size=draws.sum())
+        indices += np.repeat(np.arange(n_boot) * size, draws)
+        counts = np.bincount(indices, minlength=n_boot * size).astype(np.int32)
+        yield slice(start, start + size), counts.reshape(n_boot, size)
+
+
+## How often each row is drawn in each of n_boot resamples of n rows
+def resample_counts(n: int, n_boot: int, rng: np.random.Generator) -> np.ndarray:
+    """Returns the whole n_boot x n int32 matrix of counts, drawn as one block."""
+    counts = np.zeros((n_boot, n), dtype=np.int32)
+    for rows, block in iter_resample_counts(n, n_boot, rng, row_block=max(n, 1)):
+        counts[:, rows] = block
+    return counts
+
+
+# LINEAR MODELS
+
+@dataclass
+class LinearBootstrap:
+    """
+    Bootstrap replicates of an OLS fit with an intercept.
+
+    `coefs` holds one row of [intercept, slopes] per replicate, for features
+    shifted by `shift`; `beta` is the fit on all rows; `residuals` are its
+    (degrees-of-freedom scaled) residuals, added to the replicates to turn a
+    confidence interval for the mean into a prediction interval for one listing.
+    """
+    coefs: np.ndarray
+    beta: np.ndarray
+    shift: np.ndarray
+    residuals: np.ndarray
+
+    def _design(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=float)
+        return np.column_stack([np.ones(len(X)), X - self.shift])
+
+    ## Point prediction and its standard deviation, without drawing anything
+    def predict_sd(self, X) -> np.ndarray:
+        """
+        Returns the standard deviation of a new listing's rent at each row of X:
+        the spread of the replicate predictions plus the residual spread.
+        """
+        design = self._design(X)
+        covariance = np.cov(self.coefs, rowvar=False)
+        # the diagonal of D Cov D' without forming the n x n matrix
+        mean_variance = np.einsum("ij,jk,ik->i", design, covariance, design)
+        return np.sqrt(np.maximum(mean_variance, 0) + self.residuals.var())
+
+    ## Prediction draws: one column per replicate
+    def draws(self, X, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        rng = np.random.default_rng(0) if rng is None else rng
+        noise = rng.choice(self.residuals, size=len(self.coefs))
+        return self._design(X) @ self.coefs.T + noise
+
+    def intervals(self, X, level: float = 0.9, chunk_rows: int = 5_000, seed: int = 0) -> pd.DataFrame:
+        """Point prediction, standard deviation and `level` prediction interval for each row of X."""
+        X = np.asarray(X, dtype=float)
+        rng = np.random.default_rng(seed)
+        lower, upper = [], []
+        # the draws are rows x replicates, so quantiles are taken a block of rows at a time
+        for start in range(0, len(X), chunk_rows):
+            low, high = np.quantile(self.draws(X[start:start + chunk_rows], rng),
+                                    [(1 - level) / 2, (1 + level) / 2], axis=1)
+            lower.append(low)
+            upper.append(high)
+        return pd.DataFrame({
+            "predicted_price_per_bed": self._design(X) @ self.beta,
+            "prediction_sd": self.predict_sd(X),
+            "prediction_lower": np.concatenate(lower) if lower else np.empty(0),
+            "prediction_upper": np.concatenate(upper) if upper else np.empty(0),
+        })
+
+
+## Upper triangle of x_i x_i' for each row, in np.triu_indices order
+def _outer_upper(design: np.ndarray) -> np.ndarray:
+    # a product of column slices per feature, which is much faster than gathering with triu_indices
+    return np.concatenate([design[:, [i]] * design[:, i:] for i in range(design.shape[1])], axis=1)
+
+
+## Bootstrap an OLS fit with every replicate solved at once
+def bootstrap_ols(X, y, n_boot: int = 2000, seed: int = 0, row_block: int = 20_000) -> LinearBootstrap:
+    """
+    Draws `n_boot` pairs-bootstrap replicates of an OLS fit with an intercept.
+
+    The resampling counts W are drawn a block of rows at a time for every
+    replicate (see iter_resample_counts), so each block's row products x_i x_i'
+    and x_i y_i are formed once and enter every replicate's normal equations
+    through two matrix products, W @ (x_i x_i') and W @ (x_i y_i). The
+    equations are then solved as one batched least squares problem.
+
+    Args:
+        X (array-like): n x p features.
+        y (array-like): The n targets.
+        n_boot (int): Number of replicates.
+        seed (int): Seed for the resampling.
+        row_block (int): Most rows resampled at a time. Fewer are used when n_boot
+            is large, so drawing the counts stays under COUNT_BLOCK_BYTES.
+
+    Returns:
+        LinearBootstrap: The replicates, the full fit and its residuals.
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(X)
+    shift = X.mean(axis=0)
+    design = np.column_stack([np.ones(n), X - shift])
+    p = design.shape[1]
+    upper = np.triu_indices(p)
+
+    def solve(xtx_upper, xty):
+        # rebuild the symmetric X'X from its upper triangle, then use the pseudo-inverse,
+        # which also copes with replicates that happen to miss a rare property type
+        xtx = np.zeros((len(xty), p, p))
+        xtx[:, upper[0], upper[1]] = xtx_upper
+        xtx[:, upper[1], upper[0]] = xtx_upper
+        return (np.linalg.pinv(xtx, hermitian=True) @ xty[:, :, None])[:, :, 0]
+
+    beta = solve((design.T @ design)[upper][None, :], (design.T @ y)[None, :])[0]
+    residuals = (y - design @ beta) * np.sqrt(n / max(n - p, 1))
+
+    rng = np.random.default_rng(seed)
+    row_block = max(1, min(row_block, COUNT_BLOCK_BYTES // (DRAW_BYTES * max(n_boot, 1))))
+    xtx_upper = np.zeros((n_boot, len(upper[0])))
+    xty = np.zeros((n_boot, p))
+    for rows, counts in iter_resample_counts(n, n_boot, rng, row_block):
+        weights = counts.astype(np.float64)
+        xtx_upper += weights @ _outer_upper(design[rows])
+        xty += weights @ (design[rows] * y[rows, None])
+    coefs = solve(xtx_upper, xty)
+    logging.info(f'Drew {n_boot} bootstrap replicates of the linear model on {n} rows')
+    return LinearBootstrap(coefs=coefs, beta=beta, shift=shift, residuals=residuals)
+
+
+# OTHER MODELS
+
+## Refit an estimator on a list of resamples (runs in a worker process)
+def _fit_replicates(data_dir: str, estimator, seeds) -> np.ndarray:
+    X = np.load(os.path.join(data_dir, "X.npy"), mmap_mode="r")
+    y = np.load(os.path.join(data_dir, "y.npy"), mmap_mode="r")
+    X_new = np.load(os.path.join(data_dir, "X_new.npy"), mmap_mode="r")
+    predictions = np.empty((len(X_new), len(seeds)))
+    for j, seed in enumerate(seeds):
+        rows = np.random.default_rng(seed).integers(0, len(X), len(X))
+        predictions[:, j] = clone(estimator).fit(X[rows], y[rows]).predict(X_new)
+    return predictions
+
+
+## Bootstrap any scikit-learn regressor across cores
+def bootstrap_predictions(estimator, X, y, X_new, n_boot: int = 200, n_jobs: Optional[int] = None,
+                          seed: int = 0) -> np.ndarray:
+    """
+    Refits `estimator` on `n_boot` resamples of (X, y), spread over a process
+    pool, and returns its predictions at X_new as an m x n_boot matrix. As in
+    model_search, the data is written once and memory-mapped by the workers.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).generate_state(n_boot).tolist()
+    # a few chunks per worker keeps every core busy until the end
+    chunks = [chunk.tolist() for chunk in np.array_split(seeds, min(n_boot, n_jobs * 4))]
+    with tempfile.TemporaryDirectory() as data_dir:
+        np.save(os.path.join(data_dir, "X.npy"), np.asarray(X, dtype=np.float64))
+        np.save(os.path.join(data_dir, "y.npy"), np.asarray(y, dtype=np.float64))
+        np.save(os.path.join(data_dir, "X_new.npy"), np.asarray(X_new, dtype=np.float64))
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=model_search._limit_threads) as pool:
+            parts = list(pool.map(_fit_replicates, [data_dir] * len(chunks), [estimator] * len(chunks), chunks))
+    logging.info(f'Drew {n_boot} bootstrap replicates of {type(estimator).__name__} on {n_jobs} workers')
+    return np.hstack(parts)
+
+
+## Summarise prediction draws (rows x replicates) as intervals
+def summarize_draws(draws: np.ndarray, residuals=None, level: float = 0.9, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns the mean, standard deviation and `level` interval of each row of
+    `draws`. If `residuals` are given, resampled residuals are added first, so
+    the interval is for a single listing rather than for the mean.
+    """
+    if residuals is not None:
+        noise = np.random.default_rng(seed).choice(np.asarray(residuals, dtype=float), size=draws.shape[1])
+        draws = draws + noise
+    low, high = np.quantile(draws, [(1 - level) / 2, (1 + level) / 2], axis=1)
+    return pd.DataFrame({
+        "predicted_price_per_bed": draws.mean(axis=1),
+        "prediction_sd": draws.std(axis=1, ddof=1),
+        "prediction_lower": low,
+        "prediction_upper": high,
+    })
+
+
+# STANDARDISED SAVINGS
+
+## The spread each reference price is scaled by: the prediction's standard
+## deviation, or the median absolute deviation of the comparables' prices
+SPREAD_COLUMNS = {
+    "predicted_price_per_bed": "prediction_sd",
+    "comparable_price_per_bed": "comparable_mad",
+}
+
+## Turns a median absolute deviation into a standard deviation (for normally distributed prices)
+MAD_TO_SD = 1.4826
+
+
+## Whether savings against reference_col can be given as z-scores
+def has_spread(df: pd.DataFrame, reference_col: str = "predicted_price_per_bed") -> bool:
+    return SPREAD_COLUMNS.get(reference_col) in df.columns
+
+
+## Savings in standard deviations of the reference price
+def savings_z(df: pd.DataFrame, reference_col: str = "predicted_price_per_bed") -> pd.Series:
+    """
+    Returns (reference_col - price_per_bed) / spread, where the spread is
+    prediction_sd for the regression prediction and comparable_mad (scaled to a
+    standard deviation) for the comparable price, and NaN where there is no
+    spread to scale by. Other references have no spread, so raise ValueError.
+    (property_queries.SAVINGS_Z is the prediction's score in SQL.)
+    """
+    if reference_col not in SPREAD_COLUMNS:
+        raise ValueError(f"Savings z-scores are only defined against {', '.join(SPREAD_COLUMNS)}, not {reference_col}")
+    spread_col = SPREAD_COLUMNS[reference_col]
+    if spread_col not in df.columns:
+        raise ValueError(f"Savings z-scores against {reference_col} need a {spread_col} column")
+    sd = pd.to_numeric(df[spread_col], errors="coerce")
+    if spread_col == "comparable_mad":
+        sd = sd * MAD_TO_SD
+    savings = df[reference_col] - df["price_per_bed"]
+    return savings / sd.where(sd > 0)
@@ -0,0 +1,109 @@
+# Browse the archive of raw scrapes: list crawls, fetch listings by id, re-parse a past crawl into the database
+
+# Arguments
+import argparse
+
+# Response output
+import json
+
+# File and System Operations
+import os
+import sys
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "archive.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import sql_queries as sqlq
+from rental_utils import scrape_archive
+from rental_utils import crawl
+
+logging.info('Imported Custom Package')
+
+
+## Set Up The Paths of the Key Outside Directories/Files
+logging.info('Setting up other paths...')
+data_folder_path = os.path.join(current_dir, '..', '..', "data")
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Browse and reload the archive of raw scrapes.")
+    parser.add_argument("--archive", default=os.path.join(data_folder_path, "archive"), help="the archive folder")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    listing = commands.add_parser("list", help="list the archived crawls")
+    listing.add_argument("--source", help="only crawls of this town (or source)")
+
+    get = commands.add_parser("get", help="print listings as they were scraped")
+    get.add_argument("ids", type=int, nargs="+")
+    get.add_argument("--crawl", help="from this crawl (default: each listing's latest)")
+
+    history = commands.add_parser("history", help="list the crawls a listing appears in")
+    history.add_argument("id", type=int)
+
+    reload = commands.add_parser("reload", help="re-parse a crawl into the database")
+    reload.add_argument("crawl", help="the crawl id (see list), or 'latest'")
+    reload.add_argument("--db", default=os.path.join(data_folder_path, "properties.db"))
+    reload.add_argument("--chunk-size", type=int, default=10_000)
+
+    export = commands.add_parser("export", help="write a crawl out as one JSON array")
+    export.add_argument("crawl")
+    export.add_argument("output")
+
+    store = commands.add_parser("import", help="archive an existing scrape file (a JSON array of listings)")
+    store.add_argument("path")
+    store.add_argument("--source", required=True, help="the town (or other source) it was scraped for")
+    store.add_argument("--kind", default="search", choices=["search", "property"])
+    args = parser.parse_args()
+
+    archive = scrape_archive.ScrapeArchive(args.archive)
+    if args.command == "list":
+        print(archive.crawls(source=args.source).to_string(index=False))
+    elif args.command == "get":
+        listings = archive.get_many(args.ids, crawl=args.crawl)
+        for listing_id in args.ids:
+            print(json.dumps(listings.get(listing_id), indent=2))
+    elif args.command == "history":
+        print("\n".join(archive.history(args.id)))
+    elif args.command == "reload":
+        crawl_name = archive.latest(kind="search") if args.crawl == "latest" else args.crawl
+        print(crawl.load_archived(archive, crawl_name, sqlq.get_sql_engine(args.db), chunk_size=args.chunk_size))
+    elif args.command == "export":
+        ## Streamed out a chunk at a time, so the crawl is never held in memory whole
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("[")
+            first = True
+            for chunk in archive.iter_crawl(args.crawl):
+                for listing in chunk:
+                    f.write(("" if first else ",\n") + json.dumps(listing))
+                    first = False
+            f.write("]\n")
+    elif args.command == "import":
+        with open(args.path, "r", encoding="utf-8") as f:
+            listings = json.load(f)
+        print(archive.add(listings, source=args.source, kind=args.kind))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Benchmark the set-based bulk_update against the legacy temp_updates queries
+
+# Timing and arguments
+import argparse
+import time
+import tempfile
+
+# Data Manipulation
+import numpy as np
+import pandas as pd
+
+# File and System Operations
+import os
+import sys
+
+# Saving out data
+from sqlalchemy import create_engine, text
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "bench_bulk_update.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+# Import the sql queries sub-package
+from rental_utils import sql_queries as sqlq
+
+logging.info('Imported Custom Package')
+
+
+# HELPERS
+
+## Build a fresh database holding n properties without travel times
+def make_database(path, n_rows, seed=0):
+    """Creates properties_data in a new SQLite file with `n_rows` rows and NULL travel data."""
+    rng = np.random.default_rng(seed)
+    engine = create_engine('sqlite:///' + path)
+    with engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    base = pd.DataFrame({
+        "id": np.arange(1, n_rows + 1),
+        "price_per_bed": rng.uniform(400, 3000, n_rows).round(2),
+        "bedrooms": rng.integers(1, 5, n_rows),
+    })
+    base.to_sql("properties_data", engine, if_exists="append", index=False, chunksize=50_000)
+    updates = pd.DataFrame({
+        "id": base["id"],
+        "travel_time": rng.integers(300, 5400, n_rows),
+        "distance": rng.integers(500, 40_000, n_rows),
+    })
+    return engine, updates
+
+
+## The approach used by nb03.py before bulk_update existed
+def legacy_update(engine, updates):
+    sqlq.make_table(updates, "temp_updates", engine, if_exists="replace")
+    with engine.begin() as connection:
+        connection.execute(text(sqlq.UPDATE_DIST_AND_TRAVEL_TIME))
+
+
+## The set-based approach
+def bulk_update(engine, updates):
+    sqlq.bulk_update("properties_data", updates, "id", ["travel_time", "distance"], engine, only_null=True)
+
+
+## Time one approach on a fresh copy of the data
+def time_method(method, n_rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, updates = make_database(os.path.join(tmp, "bench.db"), n_rows)
+        start = time.perf_counter()
+        method(engine, updates)
+        elapsed = time.perf_counter() - start
+        with engine.connect() as connection:
+            missing = connection.execute(
+                text("SELECT COUNT(*) FROM properties_data WHERE travel_time IS NULL")
+            ).scalar()
+        engine.dispose()
+    if missing:
+        logging.warning(f'{method.__name__} left {missing} rows without travel times')
+    return elapsed
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk updates of properties_data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000],
+                        help="table sizes to benchmark")
+    parser.add_argument("--legacy-max", type=int, default=20_000,
+                        help="skip the quadratic legacy update above this many rows (20k rows already takes ~30s)")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'method':>8} {'seconds':>9} {'rows/s':>12}")
+    for n_rows in args.rows:
+        methods = [bulk_update]
+        if n_rows <= args.legacy_max:
+            methods.insert(0, legacy_update)
+        for method in methods:
+            elapsed = time_method(method, n_rows)
+            name = method.__name__.split("_")[0]
+            print(f"{n_rows:>10} {name:>8} {elapsed:>9.2f} {n_rows / elapsed:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
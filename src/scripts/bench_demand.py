@@ -0,0 +1,107 @@
+# Benchmark the demand contraction: plain vs SQUAREM, cold vs warm starts, serial vs parallel markets
+
+# Timing and arguments
+import argparse
+import time
+
+# Data Manipulation
+import numpy as np
+import pandas as pd
+
+# File and System Operations
+import os
+import sys
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "bench_demand.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import demand
+
+logging.info('Imported Custom Package')
+
+
+# HELPERS
+
+## Time one full share inversion of a problem
+def time_solve(problem, sigma, accelerate=True, warm=False):
+    """Returns the seconds taken, the contraction evaluations used and the solved delta."""
+    before = problem.stats["evaluations"]
+    start = time.perf_counter()
+    delta = problem.solve_delta(sigma, accelerate=accelerate, warm=warm)
+    return time.perf_counter() - start, problem.stats["evaluations"] - before, delta
+
+
+## Run every variant on one market size
+def bench_size(n_markets, products, n_draws, jobs, seed=0):
+    sim = demand.simulate_markets(n_markets, products, n_draws=n_draws, seed=seed)
+    results = []
+
+    def problem(n_jobs):
+        p = demand.DemandProblem(sim["markets"], sim["x_linear"], sim["instruments"],
+                                 n_draws=n_draws, n_jobs=n_jobs, seed=seed)
+        p.draws = sim["draws"]
+        return p
+
+    def record(variant, seconds, evaluations, delta):
+        results.append({
+            "markets": n_markets, "products": products, "variant": variant,
+            "seconds": seconds, "evaluations": evaluations,
+            "max_error": float(np.abs(delta - sim["delta"]).max()),
+        })
+
+    with problem(1) as serial:
+        record("plain", *time_solve(serial, sim["sigma"], accelerate=False))
+        record("squarem", *time_solve(serial, sim["sigma"]))
+        # an outer optimiser's next guess is close to its last one
+        seconds, evaluations, _ = time_solve(serial, sim["sigma"] * 1.01, warm=True)
+        record("squarem_warm", seconds, evaluations, serial.solve_delta(sim["sigma"], warm=True))
+    if jobs > 1:
+        with problem(jobs) as parallel:
+            # the first solve starts the pool, so time the second
+            parallel.solve_delta(sim["sigma"] * 1.01)
+            record(f"squarem_{jobs}_jobs", *time_solve(parallel, sim["sigma"]))
+    return results
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the BLP share-inversion contraction.")
+    parser.add_argument("--sizes", nargs="+", default=["20x25", "50x100", "100x250", "200x500"],
+                        help="market sizes as MARKETSxPRODUCTS")
+    parser.add_argument("--draws", type=int, default=200, help="simulated consumers per market")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes for the parallel run")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        n_markets, products = (int(part) for part in size.lower().split("x"))
+        logging.info(f'Benchmarking {n_markets} markets of {products} products')
+        results.extend(bench_size(n_markets, products, args.draws, args.jobs))
+
+    table = pd.DataFrame(results)
+    print(table.to_string(index=False, float_format=lambda v: f"{v:,.3g}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+# Benchmark each processing stage on synthetic Rightmove-shaped data, and save the results as JSON
+
+# Timing and arguments
+import argparse
+import time
+import tempfile
+import tracemalloc
+
+# Data Manipulation
+import numpy as np
+import pandas as pd
+
+# Response output
+import json
+import contextlib
+import io
+
+# File and System Operations
+import os
+import sys
+import shutil
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+# Saving out data
+from sqlalchemy import text
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "bench_pipeline.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import functions as rent
+from rental_utils import sql_queries as sqlq
+from rental_utils import synthetic
+
+logging.info('Imported Custom Package')
+
+
+## Set Up The Paths of the Key Outside Directories/Files
+logging.info('Setting up other paths...')
+data_folder_path = os.path.join(current_dir, '..', '..', "data")
+
+
+# DATA
+
+## The inputs every stage starts from, for one table size
+def make_inputs(n_rows, seed, tmp, chunk_size=100_000, memory=True):
+    """
+    Normalises the synthetic `_search` listings chunk by chunk (timing each
+    chunk, as nb02.py would handle them), and prepares the later stages'
+    inputs: the cleaned frame, travel times and predictions, and a SQLite
+    database holding the listings without them.
+    """
+    rng = np.random.default_rng(seed)
+    frames, normalize_seconds, normalize_peak = [], 0.0, None
+    # the raw listings are only held a chunk at a time, so a million of them fit in memory
+    for i, chunk in enumerate(synthetic.iter_search_listings(n_rows, seed, chunk_size=chunk_size)):
+        start = time.perf_counter()
+        frames.append(pd.json_normalize(chunk, max_level=1))
+        normalize_seconds += time.perf_counter() - start
+        if memory and i == 0:
+            # chunks are normalised independently, so the first one's peak stands for them all
+            tracemalloc.start()
+            pd.json_normalize(chunk, max_level=1)
+            normalize_peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+    normalized = pd.concat(frames, ignore_index=True)
+    del frames
+    clean = rent.clean_column_names(rent.filter_df(normalized))
+    travel = pd.DataFrame({
+        "id": clean["id"].to_numpy(),
+        "travel_time": rng.integers(300, 5400, len(clean)),
+        "distance": rng.integers(500, 40_000, len(clean)),
+    })
+    predictions = pd.DataFrame({
+        "id": clean["id"].to_numpy(),
+        "predicted_price_per_bed": clean["price_per_bed"].to_numpy() * rng.lognormal(0, 0.15, len(clean)),
+    })
+    # the database is built once per size and copied for every run that writes to it
+    template = os.path.join(tmp, f"template_{n_rows}.db")
+    engine = sqlq.get_sql_engine(template)
+    with engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    sqlq.ensure_indexes(engine)
+    sqlq.bulk_insert("properties_data", clean.replace([np.inf, -np.inf], np.nan), engine)
+    sqlq.dispose_engines()
+    return {
+        "normalized": normalized,
+        "clean": clean,
+        "travel": travel,
+        "predictions": predictions,
+        "scored": clean.merge(travel, on="id").merge(predictions, on="id"),
+        "template": template,
+        "tmp": tmp,
+        "seed": seed,
+        "normalize_seconds": normalize_seconds,
+        "normalize_peak": normalize_peak,
+    }
+
+
+## A fresh copy of the template database
+def fresh_engine(inputs):
+    path = os.path.join(inputs["tmp"], "run.db")
+    sqlq.dispose_engines()
+    shutil.copyfile(inputs["template"], path)
+    return sqlq.get_sql_engine(path)
+
+
+# STAGES
+## Each stage takes the inputs and returns (a zero-argument function to time, the number of items it handles);
+## anything done before returning (copying a database) is not timed
+
+def stage_filter_df(inputs):
+    return (lambda: rent.filter_df(inputs["normalized"])), len(inputs["normalized"])
+
+
+def stage_clean_column_names(inputs):
+    filtered = rent.filter_df(inputs["normalized"])
+    return (lambda: rent.clean_column_names(filtered)), len(filtered)
+
+
+def stage_create_payload(inputs):
+    locations = inputs["clean"][["id", "latitude", "longitude"]]
+    return (lambda: rent.create_payload(locations.copy())), len(locations)
+
+
+## What nb03.py does with the TravelTime results today
+def stage_update_travel_time(inputs):
+    engine = fresh_engine(inputs)
+    return (lambda: sqlq.bulk_update("properties_data", inputs["travel"], "id", ["travel_time", "distance"],
+                                     engine, only_null=True)), len(inputs["travel"])
+
+
+## The UPDATE_DIST_AND_TRAVEL_TIME query it replaced
+def stage_update_travel_time_legacy(inputs):
+    engine = fresh_engine(inputs)
+
+    def run():
+        sqlq.make_table(inputs["travel"], "temp_updates", engine, if_exists="replace")
+        with engine.begin() as connection:
+            connection.execute(text(sqlq.UPDATE_DIST_AND_TRAVEL_TIME))
+    return run, len(inputs["travel"])
+
+
+## What modeling.score_missing does with each batch of predictions
+def stage_update_predicted_price(inputs):
+    engine = fresh_engine(inputs)
+    return (lambda: sqlq.bulk_update("properties_data", inputs["predictions"], "id", ["predicted_price_per_bed"],
+                                     engine, only_null=True)), len(inputs["predictions"])
+
+
+## The UPDATE_PREDICTED_PRICE query it replaced
+def stage_update_predicted_price_legacy(inputs):
+    engine = fresh_engine(inputs)
+
+    def run():
+        sqlq.make_table(inputs["predictions"], "temp_updates", engine, if_exists="replace")
+        with engine.begin() as connection:
+            connection.execute(text(sqlq.UPDATE_PREDICTED_PRICE))
+    return run, len(inputs["predictions"])
+
+
+def stage_clean_for_reg(inputs):
+    return (lambda: rent.clean_for_reg(inputs["scored"])), len(inputs["scored"])
+
+
+def stage_find_underpriced(inputs):
+    def run():
+        # the recommendation it prints is not part of the benchmark output
+        with contextlib.redirect_stdout(io.StringIO()):
+            rent.find_underpriced(inputs["scored"], user_budget=1200)
+    return run, len(inputs["scored"])
+
+
+## Parsing listing pages (PAGE_MODEL) is per page, so only the first `pages` are parsed
+def stage_parse_page_model(inputs, pages=2_000):
+    n_pages = min(pages, len(inputs["clean"]))
+    html = [synthetic.page_model_html(i, inputs["seed"]) for i in range(n_pages)]
+    return (lambda: [rent.parse_property(rent.extract_page_model(page)) for page in html]), n_pages
+
+
+STAGES = {
+    "filter_df": stage_filter_df,
+    "clean_column_names": stage_clean_column_names,
+    "create_payload": stage_create_payload,
+    "update_travel_time": stage_update_travel_time,
+    "update_travel_time_legacy": stage_update_travel_time_legacy,
+    "update_predicted_price": stage_update_predicted_price,
+    "update_predicted_price_legacy": stage_update_predicted_price_legacy,
+    "clean_for_reg": stage_clean_for_reg,
+    "find_underpriced": stage_find_underpriced,
+    "parse_page_model": stage_parse_page_model,
+}
+
+## The legacy UPDATE queries are quadratic in SQLite, so they are only run on small tables
+LEGACY_STAGES = {"update_travel_time_legacy", "update_predicted_price_legacy"}
+
+
+# MEASURING
+
+## Time a stage a few times, then trace its allocations once
+def measure(stage, inputs, repeat, max_seconds, memory):
+    """
+    Returns the wall time of each run and the peak memory (MB) allocated
+    through Python and numpy during one further, traced run. Runs stop early
+    once one takes longer than `max_seconds`.
+    """
+    seconds = []
+    for _ in range(repeat):
+        run, items = stage(inputs)
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+        if seconds[-1] > max_seconds:
+            break
+    peak_mb = None
+    if memory:
+        # traced separately, since tracing slows the run down
+        run, items = stage(inputs)
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        run()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return seconds, items, peak_mb
+
+
+def result_record(n_rows, name, seconds, items, peak_mb):
+    median = float(np.median(seconds))
+    return {
+        "rows": n_rows,
+        "stage": name,
+        "items": items,
+        "seconds": [round(s, 6) for s in seconds],
+        "best": min(seconds),
+        "median": median,
+        "items_per_second": items / median if median > 0 else None,
+        "peak_mb": peak_mb,
+    }
+
+
+## Where and on what the benchmark ran
+def run_metadata(args):
+    def git(*command):
+        try:
+            return subprocess.run(["git", *command], cwd=current_dir, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+    }
+
+
+## Print how each (rows, stage) compares to a saved run
+def compare(results, baseline_path, threshold):
+    """Returns the (rows, stage) pairs whose median time grew by more than `threshold` (a fraction)."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["rows"], r["stage"]): r for r in json.load(f)["results"]}
+    slower = []
+    print(f"\n{'rows':>10} {'stage':<30} {'before':>9} {'after':>9} {'change':>8}")
+    for record in results:
+        before = baseline.get((record["rows"], record["stage"]))
+        if before is None:
+            continue
+        change = record["median"] / before["median"] - 1
+        flag = "  SLOWER" if change > threshold else ""
+        print(f"{record['rows']:>10} {record['stage']:<30} {before['median']:>9.4f} {record['median']:>9.4f} "
+              f"{change:>+8.1%}{flag}")
+        if change > threshold:
+            slower.append((record["rows"], record["stage"]))
+    return slower
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic Rightmove data.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="numbers of listings to benchmark")
+    parser.add_argument("--stages", nargs="+", choices=["normalize", *STAGES], help="stages to run (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic listings")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="stop repeating once a run takes this long")
+    parser.add_argument("--legacy-max", type=int, default=20_000,
+                        help="skip the quadratic legacy UPDATE queries above this many rows")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run that measures peak memory")
+    parser.add_argument("--out", help="where to save the results (default: data/benchmarks/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="a saved results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown (fraction) reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if any stage got slower")
+    args = parser.parse_args()
+
+    stages = args.stages or ["normalize", *STAGES]
+    metadata = run_metadata(args)
+    results = []
+    print(f"{'rows':>10} {'stage':<30} {'median s':>9} {'items/s':>12} {'peak MB':>8}")
+    for n_rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            logging.info(f'Generating {n_rows} synthetic listings')
+            inputs = make_inputs(n_rows, args.seed, tmp, memory=not args.no_memory)
+            # normalising is timed while the listings are generated, a chunk at a time
+            timed = []
+            if "normalize" in stages:
+                timed.append(("normalize", [inputs["normalize_seconds"]], n_rows, inputs["normalize_peak"]))
+            for name in stages:
+                if name == "normalize" or (name in LEGACY_STAGES and n_rows > args.legacy_max):
+                    continue
+                seconds, items, peak_mb = measure(STAGES[name], inputs, args.repeat, args.max_seconds,
+                                                  memory=not args.no_memory)
+                timed.append((name, seconds, items, peak_mb))
+            for name, seconds, items, peak_mb in timed:
+                record = result_record(n_rows, name, seconds, items, peak_mb)
+                results.append(record)
+                peak = f"{peak_mb:>8.1f}" if peak_mb is not None else f"{'-':>8}"
+                print(f"{n_rows:>10} {name:<30} {record['median']:>9.4f} {record['items_per_second']:>12,.0f} {peak}")
+            del inputs
+            sqlq.dispose_engines()
+
+    ## Save the results, named so runs sort by time and can be traced to a commit
+    out = args.out
+    if out is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        out = os.path.join(data_folder_path, "benchmarks", f"{stamp}-{(metadata['commit'] or 'unknown')[:10]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"meta": metadata, "results": results}, f, indent=2)
+    logging.info(f'Results saved to {out}')
+
+    if args.compare:
+        slower = compare(results, args.compare, args.threshold)
+        if slower and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# Measure scraper throughput and failure behaviour against the fake Rightmove and TravelTime services
+
+# Arguments
+import argparse
+
+# Running scripts asynchronously
+import asyncio
+
+# Data Manipulation
+import pandas as pd
+
+# Response output
+import json
+import contextlib
+import io
+
+# File and System Operations
+import os
+import sys
+import time
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "load_test_scrapers.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import functions as rent
+from rental_utils import fake_services
+from run_fake_services import add_config_arguments, config_from_arguments
+
+logging.info('Imported Custom Package')
+
+
+# MEASURING
+
+## Run one phase of the crawl and record its time, output size, failure and the requests it made
+async def run_phase(name, server, phase, count):
+    server.reset_stats()
+    start = time.perf_counter()
+    result, error = None, None
+    try:
+        # the scrapers print progress for every page
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await phase()
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    seconds = time.perf_counter() - start
+    stats = server.stats()
+    items = count(result) if result is not None else 0
+    record = {
+        "phase": name,
+        "seconds": seconds,
+        "items": items,
+        "items_per_second": items / seconds if seconds > 0 else None,
+        "requests": stats["requests"],
+        "requests_per_second": stats["requests"] / seconds if seconds > 0 else None,
+        "statuses": stats["by_endpoint"],
+        "error": error,
+    }
+    return result, record
+
+
+## Crawl a city the way nb01.py, nb01a.py and nb03.py would
+async def crawl(server, city, total_results, pages):
+    records = []
+    ids, record = await run_phase("find_locations", server, lambda: rent.find_locations(city), len)
+    records.append(record)
+    if not ids:
+        return records
+
+    listings, record = await run_phase("scrape_search", server, lambda: rent.scrape_search(ids[0], total_results), len)
+    records.append(record)
+    if not listings:
+        return records
+
+    urls = [f"{rent.RIGHTMOVE_BASE_URL}{listing['propertyUrl']}" for listing in listings[:pages]]
+    _, record = await run_phase("scrape_properties", server, lambda: rent.scrape_properties(urls), len)
+    records.append(record)
+
+    frame = pd.DataFrame({
+        "id": [listing["id"] for listing in listings],
+        "latitude": [listing["location"]["latitude"] for listing in listings],
+        "longitude": [listing["location"]["longitude"] for listing in listings],
+    })
+    credentials = {"app_id": "load-test", "api_key": "load-test"}
+    _, record = await run_phase("fetch_travel_times", server,
+                                lambda: asyncio.to_thread(rent.fetch_travel_times, frame, credentials), len)
+    records.append(record)
+    return records
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the scrapers against local fake services.")
+    parser.add_argument("--city", default="london")
+    parser.add_argument("--total-results", type=int, default=1_000, help="listings scrape_search asks for")
+    parser.add_argument("--pages", type=int, default=200, help="listing pages scrape_properties fetches")
+    parser.add_argument("--out", help="also write the measurements to this JSON file")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_arguments(args)
+    with fake_services.FakeServer(config) as server, fake_services.use_fake_services(server):
+        records = asyncio.run(crawl(server, args.city, args.total_results, args.pages))
+
+    print(f"{'phase':<20} {'seconds':>8} {'items':>7} {'items/s':>9} {'requests':>9}  outcome")
+    for record in records:
+        outcome = record["error"] or "ok"
+        print(f"{record['phase']:<20} {record['seconds']:>8.2f} {record['items']:>7} "
+              f"{record['items_per_second'] or 0:>9.1f} {record['requests']:>9}  {outcome}")
+        for endpoint, statuses in record["statuses"].items():
+            print(f"{'':<20} {endpoint}: {statuses}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"config": server.stats()["config"], "phases": records}, f, indent=2)
+        logging.info(f'Measurements saved to {args.out}')
+
+
+if __name__ == "__main__":
+    main()
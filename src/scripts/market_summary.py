@@ -0,0 +1,89 @@
+# Print market summaries (listings, mean, sd and quantiles of rent per bed) from the aggregate cube
+
+# Arguments
+import argparse
+
+# File and System Operations
+import os
+import sys
+import time
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "market_summary.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import sql_queries as sqlq
+from rental_utils import market_cube
+
+logging.info('Imported Custom Package')
+
+
+## Set Up The Paths of the Key Outside Directories/Files
+logging.info('Setting up other paths...')
+data_folder_path = os.path.join(current_dir, '..', '..', "data")
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise rents per bed from the market cube.")
+    parser.add_argument("--db", default=os.path.join(data_folder_path, "properties.db"), help="the properties database")
+    parser.add_argument("--by", nargs="*", default=["bedrooms", "travel_band"], choices=market_cube.DIMENSIONS,
+                        help="dimensions to group by (none for one overall row)")
+    parser.add_argument("--precision", type=int, help="group geohashes by this many characters")
+    parser.add_argument("--area", nargs="+", help="only these geohash areas (prefixes)")
+    parser.add_argument("--bedrooms", type=int, nargs="+")
+    parser.add_argument("--type", dest="property_types", nargs="+", help="property types, e.g. Flat")
+    parser.add_argument("--band", dest="travel_bands", nargs="+",
+                        choices=[label for label, _ in market_cube.TRAVEL_BANDS] + [market_cube.UNKNOWN])
+    parser.add_argument("--from-month", help="first month (YYYY-MM)")
+    parser.add_argument("--to-month", help="last month (YYYY-MM)")
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.25, 0.5, 0.75])
+    parser.add_argument("--no-update", action="store_true", help="read the cube as it is, without applying new changes")
+    parser.add_argument("--rebuild", action="store_true", help="recount every listing")
+    parser.add_argument("--csv", help="also save the summary to this CSV file")
+    args = parser.parse_args()
+
+    engine = sqlq.get_sql_engine(args.db)
+    if args.rebuild or not args.no_update:
+        market_cube.update_cube(engine, rebuild=args.rebuild)
+
+    start = time.perf_counter()
+    summary = market_cube.rollup(
+        engine,
+        by=args.by,
+        geohash_precision=args.precision,
+        quantiles=args.quantiles,
+        geohash_prefix=args.area,
+        bedrooms=args.bedrooms,
+        property_types=args.property_types,
+        travel_bands=args.travel_bands,
+        months=(args.from_month, args.to_month) if args.from_month or args.to_month else None,
+    )
+    logging.info(f'Rolled up {len(summary)} groups in {(time.perf_counter() - start) * 1000:.1f} ms')
+    print(summary.round(1).to_string(index=False))
+    if args.csv:
+        summary.to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
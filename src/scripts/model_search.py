@@ -0,0 +1,76 @@
+# Compare candidate models of rent per bedroom with parallel cross-validation
+
+# Arguments
+import argparse
+
+# File and System Operations
+import os
+import sys
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "model_search.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import functions as rent
+from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+from rental_utils import modeling
+from rental_utils import model_search
+
+logging.info('Imported Custom Package')
+
+
+## Set Up The Paths of the Key Outside Directories/Files
+logging.info('Setting up other paths...')
+data_folder_path = os.path.join(current_dir, '..', '..', "data")
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validate candidate rent models in parallel.")
+    parser.add_argument("--db", default=f"{data_folder_path}/properties.db", help="the SQLite database file")
+    parser.add_argument("--candidates", nargs="+", choices=list(model_search.CANDIDATES),
+                        help="models to compare (default: all)")
+    parser.add_argument("--folds", type=int, default=5, help="number of cross-validation folds")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: every core)")
+    parser.add_argument("--out", help="also write the comparison to this CSV file")
+    args = parser.parse_args()
+
+    ## Load and clean the regression data, then build the shared feature matrix
+    logging.info('Getting Data from the Database')
+    engine = sqlq.get_sql_engine(args.db)
+    reg_data = rent.clean_for_reg(pq.regression_query().read(engine))
+    logging.info(f'Data found, with {len(reg_data)} usable properties')
+    X = modeling.FeatureBuilder().fit(reg_data).transform(reg_data)
+    y = reg_data["price_per_bed"].to_numpy(dtype=float)
+
+    ## Run the search
+    summary = model_search.run_search(X, y, candidates=args.candidates, folds=args.folds, n_jobs=args.jobs)
+    print(summary.to_string(index=False, float_format=lambda v: f"{v:,.3f}"))
+    if args.out:
+        summary.to_csv(args.out, index=False)
+        logging.info(f'Comparison saved to {args.out}')
+
+
+if __name__ == "__main__":
+    main()
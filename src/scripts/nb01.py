@@ -33,6 +33,7 @@ logging.info('Importing Custom Package...')
 sys.path.insert(0,os.path.join(current_dir, '..'))
 import rental_utils
 from rental_utils import functions as rent
+from rental_utils import scrape_archive
 # Note that whenever rent.function_name is called, 
 # all the required packages are imported in the background anyway
 logging.info('Imported Custom Package')
@@ -73,9 +74,13 @@ async def run():
     # Output the raw-ish data to a json    
     logging.info('Saving Json Output')
     with open(f"{data_folder_path}/rightmove_properties.json", "w", encoding="utf-8") as f:
-        f.write(json.dumps(chosen_results, indent=2))
+        json.dump(chosen_results, f)
     logging.info(f'Json output saved to {data_folder_path}/rightmove_properties.json')
 
+    # Keep this scrape in the archive too, since the json is overwritten by the next run
+    crawl = scrape_archive.ScrapeArchive(f"{data_folder_path}/archive").add(chosen_results, source=location_input)
+    logging.info(f'Scrape archived as {crawl}')
+
 if __name__ == "__main__":
     asyncio.run(run())
 
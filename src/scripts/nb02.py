@@ -84,8 +84,10 @@ engine = sqlq.get_sql_engine(f"{data_folder_path}/properties.db")
 
 
 ## Execute the CREATE TABLE query to create a blank table
-with engine.connect() as connection:
+with engine.begin() as connection:
     connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+sqlq.ensure_indexes(engine)
+sqlq.ensure_column(engine, "properties_data", "summary", "TEXT")
 
 ## Save the dataframe into that table, extending it by default
 sqlq.make_table(clean_df, "properties_data", engine)
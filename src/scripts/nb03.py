@@ -41,6 +41,7 @@ from rental_utils import functions as rent
 
 # Import the sql queries sub-package
 from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
 
 logging.info('Imported Custom Package')
 
@@ -65,61 +66,23 @@ logging.info(f'The Following Credentials Will Be Used:{credentials}')
 ## Load in the data from the corresponding table in the database
 logging.info('Getting Data from the Database')
 engine = sqlq.get_sql_engine(f"{data_folder_path}/properties.db")
-with engine.connect() as connection:
-    rightmove_data = pd.read_sql(text(sqlq.GET_PROPERTIES_DATA_SQL_QUERY), connection)
+## (only the columns the payload needs are read)
+rightmove_data = pq.PropertyQuery(columns=["id", "latitude", "longitude"]).read(engine)
 logging.info(f'Data found, with {len(rightmove_data["id"])} properties')
 
-## Set Up The Headers
-logging.info("Creating Payload and Setting Up Headers")
-headers = {
-    "Content-Type": "application/json",
-    "X-Application-Id": credentials["app_id"],
-    "X-Api-Key": credentials["api_key"]
-}
-
-## Create the Payload Based on our data
-payload_1 = rent.create_payload(rightmove_data)
-
-
-logging.info("Payload Ready, Making the Request...")
 ## Make the request to get the travel times
-### Make the request
-response = requests.post(
-    "https://api.traveltimeapp.com/v4/time-filter/fast",
-    headers= headers,
-    data=json.dumps(payload_1)
-)
-### Log if the response was OK
-if response.status_code == 200:
-    logging.info("Received Valid Response")
-else: 
-    logging.info("Received Invalid Response")
-
-
-### Get the nested part of the json response that is relevant
-results = response.json()["results"][0]["locations"]
-
-### Convert to DataFrame
-df_results = pd.DataFrame([
-    {
-        "id": loc["id"],
-        "distance": loc["properties"]["distance"],
-        "travel_time": loc["properties"]["travel_time"]
-    }
-    for loc in results
-])
+## (rent.fetch_travel_times builds the payload, sets up the headers and parses the response)
+logging.info("Making the Request...")
+df_results = rent.fetch_travel_times(rightmove_data, credentials)
+logging.info(f"Received Valid Response, with {len(df_results)} travel times")
 
 ### Merge this dataframe with the original dataframe
-properties_data = df_results.merge(
-    rightmove_data.drop(columns=["travel_time","distance"]),
-      on="id", how="left")
-
-##### create a temporary table
-sqlq.make_table(properties_data[["id", "travel_time", "distance"]], "temp_updates", engine, if_exists="replace")
+properties_data = df_results.merge(rightmove_data, on="id", how="left")
 
-##### run a single SQL statement to update properties_data using temp_updates (fill in missing data)
-with engine.begin() as connection:
-    connection.execute(text(sqlq.UPDATE_DIST_AND_TRAVEL_TIME))
+##### stage the results and fill in missing data with one set-based update
+##### (the API returns ids as strings, so cast back to match the table's key)
+updates = properties_data[["id", "travel_time", "distance"]].astype({"id": int})
+sqlq.bulk_update("properties_data", updates, "id", ["travel_time", "distance"], engine, only_null=True)
 
 
 logging.info("Saved Travel Time Data to the DataBase")
\ No newline at end of file
@@ -12,8 +12,6 @@ import sys
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-# Regressions
-from sklearn.linear_model import LinearRegression
 
 # Saving out data
 from sqlalchemy import inspect, text
@@ -48,6 +46,9 @@ from rental_utils import functions as rent
 
 # Import the sql queries sub-package
 from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+from rental_utils import replication as repl
+from rental_utils import modeling
 
 logging.info('Imported Custom Package')
 
@@ -68,15 +69,17 @@ with open(credentials_file_path, "r") as f:
 # PRIMARY RUNNING
 
 
-## Load in the complete data from the corresponding table in the database
+## Load in the rows usable for regression from the corresponding table in the database
+## (the cleaning filters run in SQL, so unusable rows are never transferred)
 logging.info('Getting Data from the Database')
 engine = sqlq.get_sql_engine(f"{data_folder_path}/properties.db")
-with engine.connect() as connection:
-    properties_data = pd.read_sql(text(sqlq.GET_PROPERTIES_DATA_SQL_QUERY), connection)
-logging.info(f'Data found, with {len(properties_data["id"])} properties')
+sqlq.ensure_indexes(engine)
+sqlq.ensure_column(engine, "properties_data", "prediction_sd", "REAL")
+properties_data = pq.regression_query().read(engine)
+logging.info(f'Data found, with {len(properties_data["id"])} usable properties')
 
 
-## Clean the data
+## Clean the data (converts weekly rents to monthly; the filters were already applied in SQL)
 reg_data = rent.clean_for_reg(properties_data)
 
 ## Make A Scatter Plot of Rent Per Bed Against Travel Time
@@ -95,29 +98,26 @@ else:
 
 
 # MAKE PREDICTIONS OF RENT PER BED BASED ON THE RENTAL DATA
+## Reuse the latest saved model unless the user asks for a refit (or none has been saved yet)
+model_dir = os.path.join(data_folder_path, "models")
+model = modeling.load_model(model_dir)
+refit = model is None or input("Refit the model on the latest data? (y/n): ").strip().lower() == 'y'
+
+if refit:
+    logging.info('Fitting the Model')
+    ## Fit on bedrooms, property type, keyword flags, commute and location, with cross-validation,
+    ## keeping bootstrap replicates so each prediction gets a standard deviation
+    model = modeling.fit_model(reg_data, n_bootstrap=2000)
+    modeling.save_model(model, model_dir)
+logging.info(f'Using model {model.version} (cross-validated scores: {model.cv_scores})')
+
+## Predict only the properties that don't have a prediction yet
 logging.info('Making Predictions')
-## Select features and target
-X = reg_data[['travel_time', 'bathrooms']]
-y = reg_data['price_per_bed']
-
-## Create and fit model
-model = LinearRegression()
-model.fit(X, y)
-
-## To generate predictions 
-predictions = model.predict(X)
-
-## Add predictions to dataframe
-reg_data.loc[:,'predicted_price_per_bed'] = predictions
-
-logging.info('Saving Out Predictions')
-# Save Out The Data With Predictions
-##### create a temporary table
-sqlq.make_table(reg_data[["id", "predicted_price_per_bed"]], "temp_updates", engine, if_exists="replace")
-
-##### run a single SQL statement to update properties_data using temp_updates (fill in missing data)
-with engine.begin() as connection:
-    connection.execute(text(sqlq.UPDATE_PREDICTED_PRICE))
+if refit:
+    ## a new model replaces every prediction, so clear the old ones first
+    with engine.begin() as connection:
+        connection.execute(text("UPDATE properties_data SET predicted_price_per_bed = NULL, prediction_sd = NULL"))
+modeling.score_missing(engine, model)
 
 
 logging.info('Predictions Saved Out to Local Database')
@@ -133,20 +133,22 @@ supabase_engine = sqlq.get_supabase_engine(
     database="postgres"
 )
 
-## Execute the CREATE TABLE query to create a blank table if it doesn't already exist
+## Create the cloud table on a new database; one created before prediction_sd existed gets the column added
 with supabase_engine.begin() as connection:
     connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
-
-## find the ids that already exist
-with supabase_engine.connect() as conn:
-    existing_ids = conn.execute(text("SELECT id FROM properties_data")).fetchall()
-## filter out only the ids that will be unique to the existing table
-existing_ids = {row[0] for row in existing_ids}
-new_rows = reg_data[~reg_data['id'].isin(existing_ids)]
-
-
-# fill in the data into the table
-sqlq.make_table(new_rows, "properties_data", supabase_engine)
+sqlq.ensure_column(supabase_engine, "properties_data", "prediction_sd", "REAL")
+sqlq.ensure_column(supabase_engine, "properties_data", "summary", "TEXT")
+
+## Ship the rows that changed locally since the last sync (new rows, travel times, predictions, prices)
+## The cloud table mirrors the local rows that are usable for regression and have a prediction
+synced = repl.replicate(
+    engine, supabase_engine, "supabase",
+    query=pq.regression_query(predicted_missing=False),
+)
+sqlq.ensure_indexes(supabase_engine)
+repl.compact_change_log(engine)
+logging.info(f'{synced["upserted"]} properties sent to and {synced["deleted"]} removed from the cloud database')
 
 
-logging.info('Predictions Saved Out to Cloud Database')
\ No newline at end of file
+logging.info('Predictions Saved Out to Cloud Database')
+logging.info(f'Database connection metrics: {sqlq.engine_metrics()}')
@@ -46,6 +46,8 @@ from rental_utils import functions as rent
 
 # Import the sql queries sub-package
 from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+from rental_utils import cloud_cache
 
 logging.info('Imported Custom Package')
 
@@ -75,13 +77,6 @@ supabase_engine = sqlq.get_supabase_engine(
 )
 
 
-# extract the table from the database
-with supabase_engine.connect() as connection:
-    properties_data = pd.read_sql(text(sqlq.GET_PROPERTIES_DATA_SQL_QUERY), connection)
-    
-logging.info(f'Data found, with {len(properties_data["id"])} properties')
-
-
 ## Help a user find underpriced flats
 
 ### ask a user for the budget they have to spend on rent
@@ -89,5 +84,16 @@ user_budget_input = input("What is your desired monthly budget on rent? ").strip
 ### set the budget as 1000 to default if the user does not input a number
 user_budget = int(user_budget_input) if user_budget_input else 1000
 
-sorted_data = rent.find_underpriced(properties_data, user_budget)
+# read through a local copy of the cloud table: a single probe query checks it is fresh,
+# and only rows changed since the last run are downloaded
+cache = cloud_cache.CloudCache(supabase_engine, f"{data_folder_path}/cloud_cache.db")
+
+# extract only the most underpriced flats within budget
+# (the budget cut and the ranking run in SQL on the local copy)
+# ranked by savings in standard deviations of the prediction, so noisy predictions do not come first
+properties_data = cache.read(pq.underpriced_query(user_budget, k=50, by_z_score=True))
+
+logging.info(f'Data found, with {len(properties_data["id"])} properties')
+
+sorted_data = rent.find_underpriced(properties_data, user_budget, rank_by='savings_z')
 
@@ -0,0 +1,5 @@
+#!/usr/bin/env bash
+# Run every stage of the pipeline without prompts (arguments are passed on to run_pipeline.py)
+set -euo pipefail
+cd "$(dirname "$0")"
+python run_pipeline.py "$@"
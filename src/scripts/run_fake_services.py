@@ -0,0 +1,87 @@
+# Run the fake Rightmove and TravelTime services on a local port (for offline scraper testing)
+
+# Arguments
+import argparse
+
+# File and System Operations
+import os
+import sys
+import time
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "run_fake_services.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import fake_services
+
+logging.info('Imported Custom Package')
+
+
+# PRIMARY RUNNING
+
+## The fault and size settings, shared with load_test_scrapers.py
+def add_config_arguments(parser):
+    parser.add_argument("--listings", type=int, default=5_000, help="listings per location")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic listings")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean delay added to each response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="standard deviation of that delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--rate-limit", type=float, help="requests per second before 429s (default: no limit)")
+    parser.add_argument("--burst", type=int, default=20, help="requests allowed at once before the rate limit applies")
+    parser.add_argument("--max-results", type=int, default=1_000, help="highest search index served")
+    parser.add_argument("--unreachable-rate", type=float, default=0.02, help="share of locations with no travel time")
+
+
+def config_from_arguments(args) -> fake_services.FakeServiceConfig:
+    return fake_services.FakeServiceConfig(
+        listings_per_location=args.listings,
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        burst=args.burst,
+        max_results=args.max_results,
+        unreachable_rate=args.unreachable_rate,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake Rightmove and TravelTime endpoints from synthetic data.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = fake_services.FakeServer(config_from_arguments(args), args.host, args.port).start()
+    print(f"export RIGHTMOVE_BASE_URL={server.url} TRAVELTIME_BASE_URL={server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logging.info(f'Shutting down after {server.stats()["requests"]} requests')
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Run the whole pipeline (scrape, load, travel times, model, sync, recommend) without prompts
+
+# Arguments
+import argparse
+
+# File and System Operations
+import os
+import sys
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "run_pipeline.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import pipeline
+
+logging.info('Imported Custom Package')
+
+
+## Set Up The Paths of the Key Outside Directories/Files
+logging.info('Setting up other paths...')
+credentials_file_path = os.path.join(current_dir, '..', '..', "credentials.json")
+supabase_credentials_file_path = os.path.join(current_dir, '..', '..', "supabase_credentials.json")
+data_folder_path = os.path.join(current_dir, '..', '..', "data")
+
+
+# PRIMARY RUNNING
+
+STAGE_NAMES = ["scrape", "load", "travel_time", "model", "recommend", "cube", "sync"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the rental pipeline unattended, skipping stages that are up to date.")
+    parser.add_argument("--data-dir", default=data_folder_path, help="folder for the database, models and outputs")
+    parser.add_argument("--city", default="london", help="the UK town or city to scrape")
+    parser.add_argument("--cities", nargs="+", default=[],
+                        help="crawl several towns at once instead (e.g. --cities london manchester leeds)")
+    parser.add_argument("--cities-file", help="a file listing towns to crawl, one per line")
+    parser.add_argument("--total-results", type=int, default=250, help="how many flats to scrape")
+    parser.add_argument("--scrape-max-age-hours", type=float, default=24.0, help="reuse a scrape younger than this")
+    parser.add_argument("--transport", default="public_transport", help="TravelTime transport mode")
+    parser.add_argument("--refit", action="store_true", help="fit a new model when the data has changed")
+    parser.add_argument("--n-bootstrap", type=int, default=2000, help="bootstrap replicates for a new model")
+    parser.add_argument("--embedding-model",
+                        help="also embed the listing text with this sentence-transformers model when fitting "
+                             "(e.g. sentence-transformers/all-MiniLM-L6-v2; needs torch and transformers)")
+    parser.add_argument("--budget", type=float, nargs="+", default=[1000.0], help="budgets to recommend flats for")
+    parser.add_argument("--k", type=int, default=50, help="flats recommended per budget")
+    parser.add_argument("--rank-by", choices=["savings", "savings_z"], default="savings_z")
+    parser.add_argument("--no-sync", action="store_true", help="do not replicate to Supabase")
+    parser.add_argument("--force", nargs="+", default=[], choices=STAGE_NAMES, help="run these stages even if up to date")
+    parser.add_argument("--only", nargs="+", choices=STAGE_NAMES, help="run just these stages")
+    parser.add_argument("--jobs", type=int, default=2, help="stages run at once")
+    parser.add_argument("--workers", type=int, help="processes cleaning the towns of a multi-city crawl (default: all cores)")
+    parser.add_argument("--crawl-concurrency", type=int, default=4, help="towns scraped at once")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record timing spans and metrics (data/metrics: a JSON lines log and metrics.prom)")
+    args = parser.parse_args()
+
+    ## Towns from the command line and the file, in order
+    cities = list(args.cities)
+    if args.cities_file:
+        with open(args.cities_file, "r", encoding="utf-8") as f:
+            cities += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    params = pipeline.PipelineParams(
+        data_dir=args.data_dir,
+        city=args.city,
+        cities=tuple(cities),
+        total_results=args.total_results,
+        scrape_max_age_hours=args.scrape_max_age_hours,
+        transportation_type=args.transport,
+        refit=args.refit,
+        n_bootstrap=args.n_bootstrap,
+        embedding_model=args.embedding_model,
+        budgets=tuple(args.budget),
+        k=args.k,
+        rank_by=args.rank_by,
+        sync=not args.no_sync,
+        travel_credentials_path=credentials_file_path,
+        supabase_credentials_path=supabase_credentials_file_path,
+        jobs=args.jobs,
+        workers=args.workers,
+        crawl_concurrency=args.crawl_concurrency,
+        metrics=args.metrics,
+    )
+    results = pipeline.run_pipeline(params, force=tuple(args.force), only=tuple(args.only) if args.only else None)
+
+    ## Print one line per stage and fail the run if any stage did not finish
+    for name, result in results.items():
+        print(f"{name:<12} {result['status']:<8} {result.get('seconds', 0.0):8.2f}s")
+    if any(result["status"] in ("failed", "blocked") for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
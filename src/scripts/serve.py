@@ -0,0 +1,95 @@
+# Run the scoring service: valuations and underpriced rankings over HTTP
+
+# Arguments
+import argparse
+
+# Response output
+import json
+
+# File and System Operations
+import os
+import sys
+
+# Tracking
+import logging
+
+
+# Set up logging to debug/ keep track
+
+logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
+logging.getLogger().setLevel(logging.INFO)
+
+
+# DIRECTORY SETUP
+
+### Find the directory of the current file
+__file__ = "serve.py"
+
+logging.info('Finding current Path')
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Set the parent to be the current path of the system
+# # (so one can import the custom package)
+logging.info('Importing Custom Package...')
+sys.path.insert(0,os.path.join(current_dir, '..'))
+import rental_utils
+from rental_utils import sql_queries as sqlq
+from rental_utils import service
+from rental_utils import cloud_cache
+
+logging.info('Imported Custom Package')
+
+
+## Set Up The Paths of the Key Outside Directories/Files
+logging.info('Setting up other paths...')
+credentials_file_path = os.path.join(current_dir, '..', '..', "supabase_credentials.json")
+data_folder_path = os.path.join(current_dir, '..', '..', "data")
+
+
+# PRIMARY RUNNING
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve rent valuations and underpriced rankings over HTTP.")
+    parser.add_argument("--db", default=f"{data_folder_path}/properties.db", help="the SQLite database file")
+    parser.add_argument("--supabase", action="store_true",
+                        help="load the properties from Supabase instead (through the local cache)")
+    parser.add_argument("--model-dir", default=os.path.join(data_folder_path, "models"), help="saved models (from nb04.py)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", help="listen on this Unix socket path instead of a TCP port")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="how long a micro-batch waits for more requests")
+    parser.add_argument("--rank-by", choices=["savings", "savings_z"], default="savings",
+                        help="rank by raw savings or by savings in standard deviations of the prediction")
+    parser.add_argument("--no-comparables", action="store_true", help="skip the comparables index")
+    args = parser.parse_args()
+
+    ## Connect to where the properties live
+    if args.supabase:
+        with open(credentials_file_path, "r") as f:
+            credentials = json.load(f)
+        supabase_engine = sqlq.get_supabase_engine(
+            user="postgres",
+            password=credentials['password'],
+            host=credentials['host'],
+            port=5432,
+            database="postgres"
+        )
+        engine = cloud_cache.CloudCache(supabase_engine, f"{data_folder_path}/cloud_cache.db").fresh_engine()
+    else:
+        engine = sqlq.get_sql_engine(args.db)
+
+    ## Load everything once, then serve
+    scoring = service.ScoringService.from_database(
+        engine, args.model_dir, with_comparables=not args.no_comparables, rank_by=args.rank_by, max_wait_ms=args.max_wait_ms
+    )
+    server = service.make_server(scoring, args.host, args.port, unix_socket=args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info('Shutting down')
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
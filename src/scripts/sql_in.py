@@ -1,12 +1,12 @@
+import argparse
 import sys
 import os
 import logging
-import pandas as pd
 
-def get_user_input(prompt):
-    user_input = input(prompt).strip().lower().replace(' ', '_')
-    return user_input if user_input else 'table_1'
-        
+def get_table_name(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name.strip().lower().replace(' ', '_') or 'table_1'
+
 #__file__ = "sql_in.py"
 def main():
     logging.basicConfig(format='%(asctime)s [%(levelname)s] [%(filename)s] %(message)s', level=logging.INFO)
@@ -27,42 +27,43 @@ def main():
     # Print the updated sys.path
         print(f'Priority System Path: {sys.path[0]}')
     try:
-        import semi_utils
-        from semi_utils import sql_queries as sqlq
-        print('Successfully imported sql_queries as sqlq from econ_utils')
+        from rental_utils import sql_queries as sqlq
+        from rental_utils import ingest
+        print('Successfully imported sql_queries and ingest from rental_utils')
     except ImportError as e:
-        print(f'Error importing econ_utils: {e}')
+        print(f'Error importing rental_utils: {e}')
         sys.exit(1)
 
-    # THE MAIN SCRIPT
-    logging.info('Retrieving the bloomberg dataframe')
-    bloomberg_data = pd.read_excel(os.path.join(sys.path[0],"../data/bloomberg_data.xlsx"))
-    logging.info('bloomberg dataframe retreived')
+    data_folder_path = os.path.join(parent_dir, '..', 'data')
+
+    # THE ARGUMENTS
+    parser = argparse.ArgumentParser(
+        description="Stream a CSV, NDJSON, Parquet or XLSX file into a database table."
+    )
+    parser.add_argument("path", nargs="?", default=os.path.join(data_folder_path, "bloomberg_data.xlsx"),
+                        help="the file to load (default: data/bloomberg_data.xlsx)")
+    parser.add_argument("--table", help="the table to load into (default: the file name)")
+    parser.add_argument("--db", default=os.path.join(data_folder_path, "properties.db"),
+                        help="the SQLite database file (default: data/properties.db)")
+    parser.add_argument("--url", help="a database URL to use instead of --db")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="rows read and written at a time")
+    parser.add_argument("--if-exists", choices=["append", "replace", "fail"], default="append",
+                        help="what to do if the table already exists")
+    args = parser.parse_args()
 
+    # THE MAIN SCRIPT
     logging.info('Retrieving the Database/Creating if not Existing Already')
-    engine = sqlq.get_sql_engine()
+    engine = sqlq.get_engine(args.url) if args.url else sqlq.get_sql_engine(args.db)
     logging.info('Retrieved the Database')
 
-    # Create an inspector object
-    inspector = sqlq.inspect(sqlq.engine)
-
-    # Get a list of all table names
-    tables = inspector.get_table_names()
-
-    name = get_user_input("What do you want to call the table?")
-    if_exists = 'append'
-    if name in tables:
-        replace = input(f'Table name: {name} already exists. Replace? (Else will append to the table) [Y/N] ').strip().lower().replace(' ', '_')
-        if replace == 'y':
-            if_exists = 'replace'
+    table = args.table or get_table_name(args.path)
+    print(f'Your data will be saved to the table name: {table}')
+    stats = ingest.ingest_file(args.path, table, engine, chunksize=args.chunksize, if_exists=args.if_exists)
 
-    print(f'Your data will be saved to the table name: {name}')
-    sqlq.make_table(df = bloomberg_data, name = name, engine = engine, if_exists=if_exists)
-    
-    logging.info('Saved a table to database')
+    logging.info(f'Saved a table to database: {stats["rows"]:,} rows at {stats["rows_per_second"]:,.0f} rows/s')
 
 if __name__ == "__main__":
     print("Script is being run directly")
     main()
 else:
-    print("Script is being imported")
\ No newline at end of file
+    print("Script is being imported")
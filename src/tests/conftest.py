@@ -0,0 +1,39 @@
+# Shared fixtures for the rental_utils tests
+
+# Data Manipulation and Analysis
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# File and System Operations
+import os
+import sys
+
+# Testing
+import pytest
+
+## Make the package importable when pytest is run from src/ or from the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rental_utils import sql_queries as sqlq
+
+
+## A fresh SQLite database file per test, on the pooled engine the package uses
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = sqlq.get_sql_engine(str(tmp_path / "properties.db"))
+    yield engine
+    sqlq.dispose_engines()
+
+
+## A small keyed table to write into
+@pytest.fixture
+def items_table(sqlite_engine):
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, price REAL, name TEXT)"))
+    return "items"
+
+
+def read_table(engine, table, order_by="id"):
+    with engine.connect() as connection:
+        return pd.read_sql(text(f"SELECT * FROM {table} ORDER BY {order_by}"), connection)
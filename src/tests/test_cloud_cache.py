@@ -0,0 +1,71 @@
+# Tests for the local cache of the cloud table, with SQLite standing in for the cloud
+
+# Data Manipulation and Analysis
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# Testing
+import pytest
+from conftest import read_table
+from rental_utils import cloud_cache
+from rental_utils import property_queries as pq
+from rental_utils import replication as repl
+from rental_utils import sql_queries as sqlq
+
+
+@pytest.fixture
+def source(sqlite_engine):
+    repl.ensure_change_tracking(sqlite_engine)
+    return sqlite_engine
+
+
+## The "cloud" copy, kept up to date by replication as Supabase is
+@pytest.fixture
+def remote(tmp_path):
+    return sqlq.get_sql_engine(str(tmp_path / "remote.db"))
+
+
+@pytest.fixture
+def cache(remote, tmp_path):
+    return cloud_cache.CloudCache(remote, str(tmp_path / "cache.db"), chunksize=4)
+
+
+def _listings(ids, price=500.0):
+    return pd.DataFrame({"id": list(ids), "bedrooms": 2, "price_per_bed": price, "travel_time": 30})
+
+
+def _execute(engine, statement):
+    with engine.begin() as connection:
+        connection.execute(text(statement))
+
+
+def test_refresh_fetches_only_what_changed(source, remote, cache):
+    sqlq.bulk_load("properties_data", _listings(range(1, 11)), "id", source)
+    repl.replicate(source, remote, "cloud")
+
+    # a cold cache fetches the whole table
+    assert cache.refresh() == {"fetched": 10, "deleted": 0}
+    assert read_table(cache.engine, "properties_data")["id"].tolist() == list(range(1, 11))
+    assert cache.state()["row_count"] == 10
+
+    # nothing has changed, so the probe alone answers
+    assert cache.refresh() == {"fetched": 0, "deleted": 0}
+
+    # one updated row is the only one fetched
+    _execute(source, "UPDATE properties_data SET price_per_bed = 450 WHERE id = 3")
+    repl.replicate(source, remote, "cloud")
+    assert cache.refresh() == {"fetched": 1, "deleted": 0}
+    assert read_table(cache.engine, "properties_data").set_index("id").at[3, "price_per_bed"] == 450
+
+    # a remote delete is reconciled from the ids
+    _execute(source, "DELETE FROM properties_data WHERE id IN (4, 9)")
+    repl.replicate(source, remote, "cloud")
+    assert cache.refresh() == {"fetched": 0, "deleted": 2}
+    assert read_table(cache.engine, "properties_data")["id"].tolist() == [1, 2, 3, 5, 6, 7, 8, 10]
+
+    # and reads see the same rows as the remote
+    query = pq.PropertyQuery(columns=["id", "price_per_bed"])
+    pd.testing.assert_frame_equal(cache.read(query).sort_values("id", ignore_index=True),
+                                  query.read(remote).sort_values("id", ignore_index=True))
@@ -0,0 +1,91 @@
+# Tests for crawling many towns and merging them into properties_data
+
+# Data Manipulation and Analysis
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# File and System Operations
+import asyncio
+import os
+
+# Testing
+import pytest
+from conftest import read_table
+from rental_utils import crawl
+from rental_utils import fake_services
+from rental_utils import sql_queries as sqlq
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    with sqlite_engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    crawl.ensure_city_column(sqlite_engine)
+    return sqlite_engine
+
+
+def _town(city, ids, travel_times):
+    return pd.DataFrame({
+        "id": ids,
+        "price_per_bed": 800.0,
+        "city": crawl.city_slug(city),
+        "travel_time": travel_times,
+        "distance": [None if t is None else 10 * t for t in travel_times],
+    })
+
+
+def test_merge_city_keeps_the_first_town_and_only_fills_missing_travel_times(engine):
+    # a listing stored before cities were tracked has no city yet
+    sqlq.bulk_load("properties_data", _town("London", [9], [None]).drop(columns=["city"]), "id", engine)
+
+    first = crawl.merge_city(_town("London", [1, 2, 3, 9], [600, None, None, None]), engine)
+    assert first == {"new": 3, "tagged": 1, "travel_times": 0}
+
+    second = crawl.merge_city(_town("St Albans", [1, 2, 4], [999, 900, 1200]), engine)
+    assert second == {"new": 1, "tagged": 0, "travel_times": 1}
+
+    rows = read_table(engine, "properties_data").set_index("id")
+    assert rows["city"].to_dict() == {1: "london", 2: "london", 3: "london", 4: "st-albans", 9: "london"}
+    # id 1 already had a travel time, so the second town's is ignored; id 2's gap is filled
+    assert rows.at[1, "travel_time"] == 600 and rows.at[2, "travel_time"] == 900
+    assert pd.isna(rows.at[3, "travel_time"]) and rows.at[4, "travel_time"] == 1200
+    assert rows.at[2, "distance"] == 9000
+
+
+@pytest.fixture
+def server():
+    config = fake_services.FakeServiceConfig(listings_per_location=60, unreachable_rate=0.0)
+    with fake_services.FakeServer(config) as server, fake_services.use_fake_services(server):
+        yield server
+
+
+def test_load_cities_merges_each_town_and_reports_failures(engine, server, tmp_path):
+    data_dir = str(tmp_path / "data")
+    crawled = asyncio.run(crawl.crawl_cities(["London", "St Albans", "st albans"], data_dir, total_results=48))
+    assert sorted(crawled) == ["London", "St Albans"]
+    assert all(summary["listings"] == 48 for summary in crawled.values())
+    # one town's partition is corrupt and another was never crawled
+    broken = crawl.partition_path(data_dir, "Reading")
+    os.makedirs(os.path.dirname(broken))
+    with open(broken, "w") as f:
+        f.write('[{"id": 1, ')
+
+    credentials = {"app_id": "test", "api_key": "test"}
+    results = crawl.load_cities(["London", "St Albans", "Reading", "Bath"], data_dir, engine, workers=2,
+                                credentials=credentials)
+
+    assert "error" in results["Reading"] and "no partition" in results["Bath"]["error"]
+    for city in ("London", "St Albans"):
+        assert results[city]["listings"] == 48 and results[city]["travel_times_requested"] > 0
+    rows = read_table(engine, "properties_data")
+    assert rows["city"].value_counts().to_dict() == {"london": results["London"]["new"],
+                                                     "st-albans": results["St Albans"]["new"]}
+    assert rows["travel_time"].notna().any()
+
+    # a second load only asks for the travel times still missing (listings out of reach)
+    again = crawl.load_cities(["London"], data_dir, engine, workers=1, credentials=credentials)
+    london = rows[rows["city"] == "london"]
+    assert again["London"]["new"] == 0
+    assert again["London"]["travel_times_requested"] == (london["latitude"].notna() & london["travel_time"].isna()).sum()
@@ -0,0 +1,55 @@
+# Tests for the share inversion of the random-coefficients demand model
+
+# Data Manipulation and Analysis
+import numpy as np
+
+# Testing
+import pytest
+from rental_utils import demand
+
+
+@pytest.fixture
+def simulated():
+    return demand.simulate_markets(n_markets=30, products=8, n_draws=100, seed=4)
+
+
+def _problem(simulated, block_size=8):
+    problem = demand.DemandProblem(simulated["markets"], simulated["x_linear"], simulated["instruments"],
+                                   n_draws=len(simulated["draws"]), block_size=block_size)
+    # invert with the consumers the shares were simulated with, so the true delta is exact
+    problem.draws = simulated["draws"]
+    return problem
+
+
+@pytest.mark.parametrize("accelerate", [True, False])
+def test_solve_delta_recovers_the_true_mean_utilities(simulated, accelerate):
+    problem = _problem(simulated)
+
+    delta = problem.solve_delta(simulated["sigma"], accelerate=accelerate, warm=False)
+
+    np.testing.assert_allclose(delta, simulated["delta"], rtol=0, atol=1e-10)
+    assert problem.stats["solves"] == 1 and problem.stats["evaluations"] > 0
+
+
+## Solve once, returning delta and the contraction evaluations it took
+def _solve(problem, sigma, **options):
+    before = problem.stats["evaluations"]
+    delta = problem.solve_delta(sigma, **options)
+    return delta, problem.stats["evaluations"] - before
+
+
+def test_acceleration_and_warm_starts_take_fewer_evaluations(simulated):
+    sigma = simulated["sigma"]
+    problem = _problem(simulated)
+    _, plain = _solve(problem, sigma, accelerate=False, warm=False)
+    _, accelerated = _solve(problem, sigma, accelerate=True, warm=False)
+    assert accelerated < plain
+
+    # a nearby sigma, as the outer search takes, from scratch and from the solution at sigma
+    nearby = sigma * 1.02
+    cold_delta, cold = _solve(problem, nearby, warm=False)
+    _solve(problem, sigma, warm=False)
+    warm_delta, warm = _solve(problem, nearby, warm=True)
+
+    assert warm < cold
+    np.testing.assert_allclose(warm_delta, cold_delta, rtol=0, atol=1e-10)
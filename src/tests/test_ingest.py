@@ -0,0 +1,128 @@
+# Tests for streaming data files into the database
+
+# Data Manipulation and Analysis
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import inspect, text
+
+# Testing
+import pytest
+from conftest import read_table
+from rental_utils import ingest
+
+
+def _csv(tmp_path, rows, name="data.csv"):
+    path = tmp_path / name
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return str(path)
+
+
+def _tables(engine):
+    return sorted(inspect(engine).get_table_names())
+
+
+# SCHEMA
+
+def test_widen_orders_numeric_kinds_and_falls_back_to_text():
+    assert ingest.widen("integer", "bigint") == "bigint"
+    assert ingest.widen("float", "integer") == "float"
+    assert ingest.widen(None, "integer") == "integer"
+    assert ingest.widen("datetime", "integer") == "text"
+    assert ingest.widen("boolean", "boolean") == "boolean"
+
+
+def test_scan_schema_widens_for_later_chunks(tmp_path):
+    rows = {
+        "small": [1, 2, 3, 4, 5, 6],
+        "grows": [1, 2, 3, 4, 3_000_000_000, 6],
+        "fraction": [1, 2, 3, 4, 5, 1.5],
+        "label": [1, 2, 3, 4, 5, "six"],
+        "when": ["2024-01-01"] * 6,
+        "empty_at_first": [None, None, None, None, 2.5, None],
+    }
+    path = _csv(tmp_path, rows)
+
+    # the first chunk alone looks like small integers throughout
+    assert ingest.infer_schema(pd.read_csv(path, nrows=2))["fraction"] == "integer"
+    assert ingest.scan_schema(path, chunksize=2) == {
+        "small": "integer", "grows": "bigint", "fraction": "float",
+        "label": "text", "when": "datetime", "empty_at_first": "float",
+    }
+
+
+# CONFORM
+
+def test_conform_counts_values_it_cannot_read():
+    chunk = pd.DataFrame({"price": ["10.5", "unknown", None], "rooms": [1, 2, None]})
+    coerced = {}
+
+    out = ingest.conform(chunk, {"price": "float", "rooms": "integer", "missing": "text"}, coerced)
+
+    assert out["price"].iloc[0] == 10.5 and out["price"].isna().tolist() == [False, True, True]
+    assert str(out["rooms"].dtype) == "Int32"
+    assert out["missing"].isna().all()
+    assert coerced == {"price": 1}
+
+
+def test_conform_never_rounds_into_whole_number_columns():
+    with pytest.raises(ValueError, match="fractions"):
+        ingest.conform(pd.DataFrame({"rooms": [1, 1.5]}), {"rooms": "integer"})
+    with pytest.raises(ValueError, match="range"):
+        ingest.conform(pd.DataFrame({"rooms": [3_000_000_000]}), {"rooms": "integer"})
+
+
+# INGEST
+
+def test_ingest_keeps_values_that_only_later_chunks_show(tmp_path, sqlite_engine):
+    path = _csv(tmp_path, {"id": [1, 2, 3, 4], "size": [10, 20, 30, 1.5], "big": [1, 2, 3, 3_000_000_000]})
+
+    stats = ingest.ingest_file(path, "shifters", sqlite_engine, chunksize=2)
+
+    assert stats["rows"] == 4 and stats["chunks"] == 2 and stats["coerced"] == 0
+    table = read_table(sqlite_engine, "shifters")
+    assert table["size"].tolist() == [10.0, 20.0, 30.0, 1.5]
+    assert table["big"].tolist() == [1, 2, 3, 3_000_000_000]
+    assert _tables(sqlite_engine) == ["shifters"]
+
+
+def test_failed_load_leaves_no_table(tmp_path, sqlite_engine):
+    path = _csv(tmp_path, {"id": [1, 2, 3, 4], "rooms": [1, 2, 3, 4.5]})
+
+    with pytest.raises(ValueError, match="fractions"):
+        ingest.ingest_file(path, "shifters", sqlite_engine, chunksize=2, schema={"id": "integer", "rooms": "integer"})
+    # the first chunk had been staged, but neither it nor the staging table survive
+    assert _tables(sqlite_engine) == []
+
+
+def test_failed_replace_keeps_the_old_table(tmp_path, sqlite_engine):
+    ingest.ingest_file(_csv(tmp_path, {"id": [1, 2]}, "old.csv"), "shifters", sqlite_engine)
+    path = _csv(tmp_path, {"id": [3, 4, 5.5]}, "new.csv")
+
+    with pytest.raises(ValueError):
+        ingest.ingest_file(path, "shifters", sqlite_engine, chunksize=2, if_exists="replace", schema={"id": "integer"})
+    assert read_table(sqlite_engine, "shifters")["id"].tolist() == [1, 2]
+
+    ingest.ingest_file(path, "shifters", sqlite_engine, chunksize=2, if_exists="replace")
+    assert read_table(sqlite_engine, "shifters")["id"].tolist() == [3.0, 4.0, 5.5]
+    assert _tables(sqlite_engine) == ["shifters"]
+
+
+def test_append_checks_the_file_fits_the_existing_columns(tmp_path, sqlite_engine):
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("CREATE TABLE shifters (id INTEGER, rate REAL, note TEXT)"))
+        connection.execute(text("INSERT INTO shifters VALUES (1, 0.5, 'kept')"))
+
+    # whole numbers fit a REAL column, and the extra column is skipped
+    path = _csv(tmp_path, {"id": [2, 3], "rate": [1, 2], "extra": ["x", "y"]}, "fits.csv")
+    assert ingest.ingest_file(path, "shifters", sqlite_engine)["rows"] == 2
+    assert read_table(sqlite_engine, "shifters")["rate"].tolist() == [0.5, 1.0, 2.0]
+
+    # fractions do not fit the INTEGER id column, so nothing is written
+    path = _csv(tmp_path, {"id": [4, 4.5]}, "too_wide.csv")
+    with pytest.raises(ValueError, match="does not fit"):
+        ingest.ingest_file(path, "shifters", sqlite_engine)
+    assert read_table(sqlite_engine, "shifters")["id"].tolist() == [1, 2, 3]
+
+    with pytest.raises(ValueError, match="already exists"):
+        ingest.ingest_file(path, "shifters", sqlite_engine, if_exists="fail")
@@ -0,0 +1,118 @@
+# Tests for the aggregate cube of rents kept in properties.db
+
+# Data Manipulation and Analysis
+import numpy as np
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# Testing
+import pytest
+from rental_utils import functions as rent
+from rental_utils import market_cube as cube
+from rental_utils import replication as repl
+from rental_utils import sql_queries as sqlq
+from rental_utils import synthetic
+
+
+def _listings(n, seed=0):
+    data = synthetic.search_listings(n, seed)
+    clean_df = rent.clean_column_names(rent.filter_df(pd.json_normalize(data, max_level=1)))
+    clean_df["travel_time"] = np.random.default_rng(seed).integers(300, 6000, len(clean_df))
+    return clean_df
+
+
+def _read(engine, statement):
+    with engine.connect() as connection:
+        return pd.read_sql(text(statement), connection)
+
+
+def _execute(engine, statement, params=None):
+    with engine.begin() as connection:
+        connection.execute(text(statement), params or {})
+
+
+@pytest.fixture
+def engine(sqlite_engine):
+    repl.ensure_change_tracking(sqlite_engine)
+    sqlq.bulk_load("properties_data", _listings(2000), "id", sqlite_engine)
+    return sqlite_engine
+
+
+def _change_listings(engine):
+    ids = _read(engine, "SELECT id FROM properties_data ORDER BY id")["id"].tolist()
+    _execute(engine, "UPDATE properties_data SET price_per_bed = price_per_bed * 1.3 WHERE id % 7 = 0")
+    _execute(engine, "UPDATE properties_data SET travel_time = travel_time + 1200 WHERE id % 11 = 0")
+    _execute(engine, "UPDATE properties_data SET bedrooms = 0 WHERE id = :id", {"id": ids[5]})
+    _execute(engine, "DELETE FROM properties_data WHERE id % 13 = 0")
+    new = _listings(200, seed=1)
+    new["id"] += 10_000_000
+    sqlq.bulk_load("properties_data", new, "id", engine)
+
+
+## The whole cube by its dimensions: totals and quantiles of every cell
+def _snapshot(engine):
+    return cube.rollup(engine, by=cube.DIMENSIONS, quantiles=(0.1, 0.5, 0.9))
+
+
+def _buckets(engine):
+    return _read(engine, f"SELECT {', '.join('c.' + d for d in cube.DIMENSIONS)}, b.bucket, b.count "
+                         f"FROM market_cube c JOIN market_cube_buckets b ON b.cell = c.cell "
+                         f"ORDER BY {', '.join(cube.DIMENSIONS)}, b.bucket")
+
+
+def test_incremental_updates_equal_a_rebuild(engine):
+    assert cube.update_cube(engine)["rebuilt"]
+    _change_listings(engine)
+
+    update = cube.update_cube(engine)
+    assert not update["rebuilt"] and 0 < update["listings"] < 2200
+    incremental, incremental_buckets = _snapshot(engine), _buckets(engine)
+    members = _read(engine, "SELECT id, cell FROM market_cube_members")
+
+    assert cube.update_cube(engine, rebuild=True)["rebuilt"]
+    pd.testing.assert_frame_equal(incremental, _snapshot(engine))
+    pd.testing.assert_frame_equal(incremental_buckets, _buckets(engine))
+    assert len(members) == incremental["listings"].sum()
+    # no cell is left empty by the listings that moved out of it
+    assert incremental_buckets["count"].min() > 0 and incremental["listings"].min() > 0
+
+
+def test_quantiles_are_within_one_percent(engine):
+    cube.update_cube(engine)
+    rows = _read(engine, 'SELECT bedrooms, price_per_bed, "priceFrequency" FROM properties_data')
+    rows["value"] = np.where(rows["priceFrequency"] == "weekly", rows["price_per_bed"] * 52 / 12, rows["price_per_bed"])
+    rows = rows[(rows["bedrooms"] >= 1) & rows["value"].between(*cube.PRICE_BOUNDS)]
+
+    quantiles = (0.05, 0.25, 0.5, 0.75, 0.95)
+    summary = cube.rollup(engine, by=["bedrooms"], quantiles=quantiles).set_index("bedrooms")
+    for bedrooms, group in rows.groupby("bedrooms"):
+        values = np.sort(group["value"].to_numpy())
+        assert summary.at[bedrooms, "listings"] == len(values)
+        assert summary.at[bedrooms, "mean"] == pytest.approx(values.mean())
+        for q in quantiles:
+            exact = values[int(np.floor(q * (len(values) - 1)))]
+            assert abs(summary.at[bedrooms, f"p{q * 100:g}"] / exact - 1) <= cube.SKETCH_ACCURACY + 1e-9
+
+
+@pytest.mark.parametrize("keep_one", [True, False])
+def test_a_compacted_change_log_rebuilds_the_cube(engine, keep_one):
+    cube.update_cube(engine)
+    _change_listings(engine)
+    # an older run compacting without regard for the cube: the entries since its mark are gone,
+    # either all of them or all but a later change
+    pending = repl.replication_status(engine).set_index("target").at[cube.TARGET, "pending_changes"]
+    assert pending > 0
+    _execute(engine, "DELETE FROM properties_changes")
+    if keep_one:
+        _execute(engine, "UPDATE properties_data SET travel_time = 700 WHERE id = "
+                         "(SELECT MIN(id) FROM properties_data)")
+
+    update = cube.update_cube(engine)
+
+    assert update["rebuilt"]
+    recovered, recovered_buckets = _snapshot(engine), _buckets(engine)
+    cube.update_cube(engine, rebuild=True)
+    pd.testing.assert_frame_equal(recovered, _snapshot(engine))
+    pd.testing.assert_frame_equal(recovered_buckets, _buckets(engine))
@@ -0,0 +1,106 @@
+# Tests for the hedonic model's feature matrix
+
+# Data Manipulation and Analysis
+import numpy as np
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# File and System Operations
+import pickle
+
+# Testing
+import pytest
+from rental_utils import functions as rent
+from rental_utils import modeling
+from rental_utils import property_queries as pq
+from rental_utils import sql_queries as sqlq
+from rental_utils import synthetic
+from rental_utils import text_features
+
+
+@pytest.fixture
+def listings():
+    return pd.DataFrame({
+        "bedrooms": [1, 2, 3, 2],
+        "bathrooms": [1, 1, 2, None],
+        "travel_time": [20, 35, 50, 35],
+        "distance": [2000, 5000, 9000, 5000],
+        "latitude": [51.50, 51.52, 51.55, 51.52],
+        "longitude": [-0.12, -0.10, -0.05, -0.10],
+        "propertySubType": ["Flat", "Flat", "House", None],
+        "propertyTypeFullDescription": ["1 bed luxury flat", "2 bed flat", "3 bed house with garden", "2 bed flat"],
+        "displayAddress": ["Camden", "Hackney", "Croydon", "Hackney"],
+        "price_per_bed": [900.0, 700.0, 500.0, 720.0],
+    })
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    """Stands in for the transformer: a 3-d vector from the text's length and vowels."""
+    texts = []
+
+    def fake_encode(self, batch):
+        texts.extend(batch)
+        return np.array([[len(t), sum(c in "aeiou" for c in t), 1.0] for t in batch], dtype=np.float32)
+
+    monkeypatch.setattr(text_features.TextEmbedder, "_encode", fake_encode)
+    return texts
+
+
+def test_features_without_embeddings(listings):
+    builder = modeling.FeatureBuilder().fit(listings)
+    features = builder.transform(listings)
+
+    assert list(features.columns) == builder.feature_names
+    assert not any(name.startswith("emb_") for name in builder.feature_names)
+    assert features["bathrooms"].tolist() == [1.0, 1.0, 2.0, 1.0]
+    assert features["kw_luxury"].tolist() == [1, 0, 0, 0]
+
+
+def test_keywords_from_summaries_stored_in_the_database(sqlite_engine):
+    listings = synthetic.search_listings(50)
+    for listing in listings:
+        listing["summary"] = "A 2 bedroom flat moments from Bank station."
+    listings[0]["summary"] = "A luxury 2 bedroom flat moments from Bank station."
+    clean_df = rent.clean_column_names(rent.filter_df(pd.json_normalize(listings, max_level=1)))
+    clean_df["travel_time"] = 600
+    clean_df["distance"] = 5000
+    with sqlite_engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    sqlq.bulk_load("properties_data", clean_df, "id", sqlite_engine)
+
+    rows = pq.regression_query(bathrooms=None, monthly_price_per_bed=None).read(sqlite_engine)
+    features = modeling.FeatureBuilder().fit(rows).transform(rows)
+
+    luxury = rows["id"] == listings[0]["id"]
+    assert luxury.sum() == 1
+    assert features.loc[luxury, "kw_luxury"].tolist() == [1]
+    assert features.loc[~luxury, "kw_luxury"].eq(0).all()
+
+
+def test_features_with_cached_embeddings(listings, encoded, tmp_path):
+    cache = str(tmp_path / "embeddings.db")
+    builder = modeling.FeatureBuilder(embedding_model="fake-model", embedding_cache=cache).fit(listings)
+    features = builder.transform(listings)
+
+    assert list(features.columns) == builder.feature_names
+    assert builder.feature_names[-3:] == ["emb_0", "emb_1", "emb_2"]
+    assert features.loc[0, "emb_0"] == len("1 bed luxury flat Camden")
+    # rows 1 and 3 share their text, and the row fit embedded is not encoded twice
+    assert len(encoded) == len(set(encoded)) == 3
+
+    # a pickled builder (as in model.joblib) reopens the cache instead of encoding again
+    restored = pickle.loads(pickle.dumps(builder))
+    assert restored._embedder is None
+    pd.testing.assert_frame_equal(restored.transform(listings), features)
+    assert len(encoded) == 3
+
+
+def test_fit_model_with_embeddings(listings, encoded, tmp_path):
+    model = modeling.fit_model(listings, cv=2, embedding_model="fake-model",
+                               embedding_cache=str(tmp_path / "embeddings.db"))
+
+    assert model.builder.embedding_dim == 3
+    assert model.predict(listings).shape == (4,)
@@ -0,0 +1,113 @@
+# Tests for the incrementally fitted linear regression
+
+# Data Manipulation and Analysis
+import numpy as np
+import pandas as pd
+
+# Modelling
+from sklearn.linear_model import LinearRegression
+
+# Testing
+import pytest
+from rental_utils.online_regression import IncrementalLinearRegression, make_segments
+
+FEATURES = ["bedrooms", "travel_time", "latitude"]
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(7)
+    n = 600
+    X = np.column_stack([
+        rng.integers(1, 6, n),
+        rng.uniform(5, 90, n),
+        rng.normal(51.5, 0.05, n),
+    ])
+    segments = rng.choice(["Flat", "House", "Studio"], n)
+    # a different intercept and travel-time slope per segment
+    base = pd.Series(segments).map({"Flat": 600.0, "House": 500.0, "Studio": 750.0}).to_numpy()
+    slope = pd.Series(segments).map({"Flat": -2.0, "House": -1.0, "Studio": -3.0}).to_numpy()
+    y = base + 40 * X[:, 0] + slope * X[:, 1] + 300 * (X[:, 2] - 51.5) + rng.normal(0, 15, n)
+    return X, y, segments
+
+
+def _sklearn_coefficients(X, y):
+    fit = LinearRegression().fit(X, y)
+    return np.concatenate([[fit.intercept_], fit.coef_])
+
+
+def _as_array(coefficients):
+    return np.array([coefficients["intercept"]] + [coefficients[f] for f in FEATURES])
+
+
+def test_batches_match_one_batch_fit(rows):
+    X, y, _ = rows
+    model = IncrementalLinearRegression(FEATURES)
+    for batch in np.array_split(np.arange(len(X)), 5):
+        model.partial_fit(X[batch], y[batch])
+
+    np.testing.assert_allclose(_as_array(model.coefficients()), _sklearn_coefficients(X, y), rtol=1e-8, atol=1e-6)
+    np.testing.assert_allclose(model.predict(X), LinearRegression().fit(X, y).predict(X), atol=1e-6)
+
+
+def test_segment_coefficients_match_a_fit_per_segment(rows):
+    X, y, segments = rows
+    model = IncrementalLinearRegression(FEATURES)
+    for batch in np.array_split(np.arange(len(X)), 3):
+        model.partial_fit(X[batch], y[batch], segments=segments[batch])
+
+    for segment in ("Flat", "House", "Studio"):
+        chosen = segments == segment
+        np.testing.assert_allclose(_as_array(model.coefficients(segment)),
+                                   _sklearn_coefficients(X[chosen], y[chosen]), rtol=1e-8, atol=1e-6)
+    # the pooled fit is still the fit on every row
+    np.testing.assert_allclose(_as_array(model.coefficients()), _sklearn_coefficients(X, y), rtol=1e-8, atol=1e-6)
+
+    # segments with enough rows predict with their own model
+    flats = segments == "Flat"
+    expected = LinearRegression().fit(X[flats], y[flats]).predict(X[flats])
+    np.testing.assert_allclose(model.predict(X[flats], segments=segments[flats]), expected, atol=1e-6)
+
+
+def test_negative_weights_remove_rows(rows):
+    X, y, segments = rows
+    model = IncrementalLinearRegression(FEATURES).partial_fit(X, y, segments=segments)
+
+    removed = np.arange(0, len(X), 4)
+    model.partial_fit(X[removed], y[removed], segments=segments[removed], sample_weight=-np.ones(len(removed)))
+
+    kept = np.setdiff1d(np.arange(len(X)), removed)
+    np.testing.assert_allclose(_as_array(model.coefficients()), _sklearn_coefficients(X[kept], y[kept]),
+                               rtol=1e-8, atol=1e-6)
+    assert model.pooled().n == len(kept)
+    studios = kept[segments[kept] == "Studio"]
+    np.testing.assert_allclose(_as_array(model.coefficients("Studio")), _sklearn_coefficients(X[studios], y[studios]),
+                               rtol=1e-8, atol=1e-6)
+
+
+def test_save_and_load_roundtrip(rows, sqlite_engine):
+    X, y, segments = rows
+    model = IncrementalLinearRegression(FEATURES).partial_fit(X, y, segments=segments)
+
+    assert IncrementalLinearRegression.load(sqlite_engine, "hedonic") is None
+    model.save(sqlite_engine, "hedonic")
+    loaded = IncrementalLinearRegression.load(sqlite_engine, "hedonic")
+
+    assert loaded.features == FEATURES
+    assert sorted(loaded.stats) == ["Flat", "House", "Studio"]
+    for segment in (None, "Flat", "House", "Studio"):
+        assert loaded.coefficients(segment) == pytest.approx(model.coefficients(segment))
+    assert loaded.residual_variance() == pytest.approx(model.residual_variance())
+
+    # the loaded model keeps accumulating, and saving again replaces the old rows
+    loaded.partial_fit(X[:50], y[:50], segments=np.full(50, "Maisonette"))
+    loaded.save(sqlite_engine, "hedonic")
+    assert sorted(IncrementalLinearRegression.load(sqlite_engine, "hedonic").stats) == \
+        ["Flat", "House", "Maisonette", "Studio"]
+
+
+def test_make_segments_derives_the_month():
+    df = pd.DataFrame({"propertySubType": ["Flat", None],
+                       "firstVisibleDate": ["2024-03-05T10:00:00Z", "2024-04-01T00:00:00Z"]})
+    assert make_segments(df).tolist() == ["Flat|2024-03", "NA|2024-04"]
+    assert make_segments(df, by=()).tolist() == ["ALL", "ALL"]
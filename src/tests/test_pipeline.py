@@ -0,0 +1,75 @@
+# Tests for the pipeline's stage scheduling
+
+# Database Connection
+from sqlalchemy import inspect
+
+# File and System Operations
+import json
+import time
+
+# Testing
+from rental_utils import pipeline
+from rental_utils import sql_queries as sqlq
+
+
+def _stage(name, events, deps=(), after=(), fail=False):
+    def run(params):
+        events.append(("start", name))
+        time.sleep(0.05)
+        events.append(("end", name))
+        if fail:
+            raise RuntimeError(f"{name} broke")
+        return {}
+    return pipeline.Stage(name, run, lambda params: time.time(), deps=deps, after=after)
+
+
+def _run(tmp_path, stages):
+    params = pipeline.PipelineParams(data_dir=str(tmp_path), jobs=3, sync=False)
+    return pipeline.run_pipeline(params, stages=stages)
+
+
+def test_sync_waits_for_the_cube_in_the_default_graph(tmp_path):
+    params = pipeline.PipelineParams(data_dir=str(tmp_path))
+    sync = {s.name: s for s in pipeline.build_stages(params)}["sync"]
+    assert sync.deps == ("model",) and sync.after == ("cube",)
+
+
+def test_after_orders_stages_without_blocking_them(tmp_path):
+    events = []
+    results = _run(tmp_path, [
+        _stage("model", events),
+        _stage("cube", events, deps=("model",), fail=True),
+        _stage("recommend", events, deps=("model",)),
+        _stage("sync", events, deps=("model",), after=("cube",)),
+    ])
+
+    assert results["cube"]["status"] == "failed"
+    # a failed cube does not stop the sync, which only started once the cube was done
+    assert results["sync"]["status"] == "ran"
+    assert events.index(("start", "sync")) > events.index(("end", "cube"))
+    # recommend has no such constraint, so it ran alongside the cube
+    assert events.index(("start", "recommend")) < events.index(("end", "cube"))
+
+
+def test_failed_dependencies_still_block(tmp_path):
+    events = []
+    results = _run(tmp_path, [
+        _stage("model", events, fail=True),
+        _stage("cube", events, deps=("model",)),
+        _stage("sync", events, deps=("model",), after=("cube",)),
+    ])
+
+    assert [results[name]["status"] for name in ("model", "cube", "sync")] == ["failed", "blocked", "blocked"]
+
+
+def test_sync_creates_the_cloud_table_on_a_new_database(tmp_path, monkeypatch):
+    cloud = sqlq.get_sql_engine(str(tmp_path / "cloud.db"))
+    monkeypatch.setattr(sqlq, "get_supabase_engine", lambda **kwargs: cloud)
+    credentials = tmp_path / "supabase.json"
+    credentials.write_text(json.dumps({"host": "localhost", "password": "secret"}))
+    params = pipeline.PipelineParams(data_dir=str(tmp_path), supabase_credentials_path=str(credentials))
+    pipeline.prepare_database(params)
+
+    assert pipeline._sync(params)["upserted"] == 0
+    columns = {col["name"] for col in inspect(cloud).get_columns("properties_data")}
+    assert {"prediction_sd", "city", "updated_at"} <= columns
@@ -0,0 +1,71 @@
+# Tests for the budget ranking index against a brute-force stable sort
+
+# Data Manipulation and Analysis
+import numpy as np
+import pandas as pd
+
+# Testing
+import pytest
+from rental_utils import ranking
+
+
+@pytest.fixture
+def listings():
+    rng = np.random.default_rng(7)
+    n = 500
+    price = rng.integers(300, 1500, n).astype(float)
+    price[rng.random(n) < 0.02] = np.nan
+    # rounded predictions give plenty of exact ties
+    predicted = np.round(price + rng.normal(0, 150, n), -1)
+    predicted[rng.random(n) < 0.05] = np.nan
+    sd = rng.choice([0.0, 50.0, 100.0, np.nan], size=n, p=[0.05, 0.45, 0.45, 0.05])
+    return pd.DataFrame({
+        "id": np.arange(n),
+        "price_per_bed": price,
+        "predicted_price_per_bed": predicted,
+        "prediction_sd": sd,
+        "bedrooms": rng.integers(1, 5, n),
+        "travel_time": rng.integers(600, 4000, n),
+    })
+
+
+def brute_force(listings, rank_by, budget, k, bounds):
+    """The ids a stable sort of the whole frame ranks first: highest score, missing scores last."""
+    scored = listings.assign(savings=listings["predicted_price_per_bed"] - listings["price_per_bed"])
+    scored["savings_z"] = scored["savings"] / scored["prediction_sd"].where(scored["prediction_sd"] > 0)
+    keep = scored["price_per_bed"] <= budget
+    for name, (low, high) in bounds.items():
+        if low is not None:
+            keep &= scored[name] >= low
+        if high is not None:
+            keep &= scored[name] <= high
+    chosen = scored[keep]
+    score = chosen[rank_by].to_numpy()
+    order = np.argsort(np.where(np.isnan(score), np.inf, -score), kind="stable")
+    return chosen["id"].to_numpy()[order][:max(k, 0)].tolist()
+
+
+@pytest.mark.parametrize("rank_by", ["savings", "savings_z"])
+def test_top_rows_match_a_stable_sort(listings, rank_by):
+    index = ranking.UnderpricedIndex(listings, rank_by=rank_by, block_size=64, max_k=10)
+    prices = np.sort(listings["price_per_bed"].dropna().to_numpy())
+    last_full = prices[(len(prices) // 64) * 64 - 1]
+    budgets = [0, prices[0], prices[63], prices[200] + 0.5, last_full, prices[-1] - 1, prices[-1], 10_000]
+    bounds_options = [{}, {"bedrooms": (2, None)}, {"bedrooms": (2, 3), "travel_time": (None, 2700)}]
+
+    for budget in budgets:
+        for k in [0, 1, 7, 10, 11, 40, 1000]:
+            for bounds in bounds_options:
+                found = index.query(budget, k, bounds)["id"].tolist()
+                assert found == brute_force(listings, rank_by, budget, k, bounds), (budget, k, bounds)
+
+
+def test_query_many_returns_the_same_listings(listings):
+    index = ranking.UnderpricedIndex(listings, block_size=64, max_k=10)
+    queries = [ranking.BudgetQuery(900, 5), ranking.BudgetQuery(1200, 20, {"bedrooms": (3, None)})]
+
+    results = index.query_many(queries, columns=["id"])
+
+    for query, result in zip(queries, results):
+        assert [row["id"] for row in result["listings"]] == brute_force(listings, "savings", query.budget,
+                                                                        query.k, query.bounds)
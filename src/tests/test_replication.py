@@ -0,0 +1,167 @@
+# Tests for replicating properties_data between two SQLite databases
+
+# Data Manipulation and Analysis
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# Testing
+import pytest
+from conftest import read_table
+from rental_utils import sql_queries as sqlq
+from rental_utils import property_queries as pq
+from rental_utils import replication as repl
+
+
+@pytest.fixture
+def source(sqlite_engine):
+    repl.ensure_change_tracking(sqlite_engine)
+    return sqlite_engine
+
+
+@pytest.fixture
+def target(tmp_path):
+    return sqlq.get_sql_engine(str(tmp_path / "target.db"))
+
+
+def _listings(ids, bedrooms=2, price=500.0):
+    return pd.DataFrame({"id": list(ids), "bedrooms": bedrooms, "price_per_bed": price, "travel_time": None})
+
+
+def _execute(engine, statement, params=None):
+    with engine.begin() as connection:
+        connection.execute(text(statement), params or {})
+
+
+def _target_rows(engine):
+    return read_table(engine, "properties_data")
+
+
+def _high_water_mark(engine, name):
+    status = repl.replication_status(engine).set_index("target")
+    return int(status.at[name, "last_seq"])
+
+
+def test_replicate_ships_inserts_updates_and_deletes(source, target):
+    sqlq.bulk_load("properties_data", _listings(range(1, 6)), "id", source)
+
+    first = repl.replicate(source, target, "copy")
+    assert first["upserted"] == 5 and first["deleted"] == 0
+    assert _target_rows(target)["id"].tolist() == [1, 2, 3, 4, 5]
+    assert _target_rows(target)["updated_at"].notna().all()
+
+    _execute(source, "UPDATE properties_data SET travel_time = 25 WHERE id = 2")
+    _execute(source, "DELETE FROM properties_data WHERE id = 4")
+    sqlq.bulk_load("properties_data", _listings([6]), "id", source)
+
+    second = repl.replicate(source, target, "copy")
+    assert second == {"upserted": 2, "deleted": 1, "last_seq": _high_water_mark(source, "copy")}
+    rows = _target_rows(target).set_index("id")
+    assert rows.index.tolist() == [1, 2, 3, 5, 6]
+    assert rows.at[2, "travel_time"] == 25
+
+    # nothing has changed since, so nothing is shipped
+    assert repl.replicate(source, target, "copy")["upserted"] == 0
+
+
+def test_replicate_resumes_after_an_interrupted_batch(source, target, monkeypatch):
+    sqlq.bulk_load("properties_data", _listings(range(1, 11)), "id", source)
+
+    bulk_load = sqlq.bulk_load
+    calls = []
+
+    def failing_bulk_load(table, df, *args, **kwargs):
+        calls.append(df["id"].tolist())
+        if len(calls) == 2:
+            raise ConnectionError("target went away")
+        return bulk_load(table, df, *args, **kwargs)
+
+    monkeypatch.setattr(sqlq, "bulk_load", failing_bulk_load)
+    with pytest.raises(ConnectionError):
+        repl.replicate(source, target, "copy", batch_size=4)
+    # the first batch landed and the mark stopped after it
+    assert _target_rows(target)["id"].tolist() == [1, 2, 3, 4]
+    assert _high_water_mark(source, "copy") == 4
+
+    monkeypatch.setattr(sqlq, "bulk_load", bulk_load)
+    resumed = repl.replicate(source, target, "copy", batch_size=4)
+    assert resumed["upserted"] == 6
+    assert _target_rows(target)["id"].tolist() == list(range(1, 11))
+    assert _high_water_mark(source, "copy") == 10
+
+
+def test_replicate_deletes_rows_that_stop_matching_the_query(source, target):
+    sqlq.bulk_load("properties_data", _listings([1, 2], bedrooms=2), "id", source)
+    sqlq.bulk_load("properties_data", _listings([3], bedrooms=4), "id", source)
+    query = pq.PropertyQuery(bedrooms=(None, 3))
+
+    assert repl.replicate(source, target, "small", query=query)["upserted"] == 2
+    assert _target_rows(target)["id"].tolist() == [1, 2]
+
+    _execute(source, "UPDATE properties_data SET bedrooms = 5 WHERE id = 1")
+    _execute(source, "UPDATE properties_data SET bedrooms = 1 WHERE id = 3")
+
+    result = repl.replicate(source, target, "small", query=query)
+    assert result["upserted"] == 1 and result["deleted"] == 1
+    assert _target_rows(target)["id"].tolist() == [2, 3]
+
+
+def test_compaction_keeps_what_the_slowest_target_needs(source, target, tmp_path):
+    other = sqlq.get_sql_engine(str(tmp_path / "other.db"))
+    sqlq.bulk_load("properties_data", _listings([1, 2, 3]), "id", source)
+
+    # nothing has synced yet, so nothing can go
+    assert repl.compact_change_log(source) == 0
+
+    repl.replicate(source, target, "fast")
+    repl.replicate(source, other, "slow")
+    assert repl.compact_change_log(source) == 3
+
+    _execute(source, "UPDATE properties_data SET travel_time = 30 WHERE id = 1")
+    _execute(source, "DELETE FROM properties_data WHERE id = 3")
+    repl.replicate(source, target, "fast")
+    # "slow" has not seen the two new changes yet
+    assert repl.compact_change_log(source) == 0
+
+    assert repl.replicate(source, other, "slow") == {"upserted": 1, "deleted": 1, "last_seq": 5}
+    assert repl.compact_change_log(source) == 2
+    assert _target_rows(other)["id"].tolist() == _target_rows(target)["id"].tolist() == [1, 2]
+    assert repl.replication_status(source)["pending_changes"].tolist() == [0, 0]
+
+
+def test_a_target_added_after_compaction_gets_a_full_copy(source, target, tmp_path):
+    late = sqlq.get_sql_engine(str(tmp_path / "late.db"))
+    sqlq.bulk_load("properties_data", _listings([1, 2], bedrooms=2), "id", source)
+    sqlq.bulk_load("properties_data", _listings([3], bedrooms=4), "id", source)
+    repl.replicate(source, target, "a")
+    assert repl.compact_change_log(source) == 3
+
+    # the log no longer holds the inserts "b" needs, so it is sent every row matching its query
+    query = pq.PropertyQuery(bedrooms=(None, 3))
+    assert repl.replicate(source, late, "b", query=query) == {"upserted": 2, "deleted": 0, "last_seq": 3}
+    assert _target_rows(late)["id"].tolist() == [1, 2]
+    assert _target_rows(late)["updated_at"].notna().all()
+
+    # from then on "b" follows the log as usual
+    _execute(source, "UPDATE properties_data SET bedrooms = 5 WHERE id = 2")
+    assert repl.replicate(source, late, "b", query=query) == {"upserted": 0, "deleted": 1, "last_seq": 4}
+    assert _target_rows(late)["id"].tolist() == [1]
+
+
+def test_a_target_behind_the_compacted_log_is_reconciled(source, target, tmp_path):
+    behind = sqlq.get_sql_engine(str(tmp_path / "behind.db"))
+    sqlq.bulk_load("properties_data", _listings([1, 2, 3]), "id", source)
+    repl.replicate(source, target, "a")
+    repl.replicate(source, behind, "b")
+
+    _execute(source, "DELETE FROM properties_data WHERE id = 1")
+    sqlq.bulk_load("properties_data", _listings([4]), "id", source)
+    repl.replicate(source, target, "a")
+    # "b" is dropped (e.g. its project was recreated), so compaction can pass its mark
+    _execute(source, "DELETE FROM replication_state WHERE target = 'b'")
+    assert repl.compact_change_log(source) == 5
+
+    result = repl.replicate(source, behind, "b")
+    assert result == {"upserted": 3, "deleted": 1, "last_seq": 5}
+    assert _target_rows(behind)["id"].tolist() == [2, 3, 4]
@@ -0,0 +1,89 @@
+# Tests for the compressed archive of raw scrapes
+
+# Data Manipulation and Analysis
+from itertools import chain
+
+# File and System Operations
+import os
+
+# Testing
+import pytest
+from rental_utils import scrape_archive
+from rental_utils import synthetic
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    # small frames, segments and index batches, so a short crawl crosses all of them
+    monkeypatch.setattr(scrape_archive, "FRAME_RECORDS", 16)
+    monkeypatch.setattr(scrape_archive, "SEGMENT_BYTES", 4096)
+    monkeypatch.setattr(scrape_archive, "INDEX_BATCH", 50)
+    yield scrape_archive.ScrapeArchive(str(tmp_path / "archive"))
+    scrape_archive.sqlq.dispose_engines()
+
+
+def _index_rows(archive, crawl):
+    with archive.engine.connect() as connection:
+        return connection.exec_driver_sql("SELECT COUNT(*) FROM archive_index WHERE crawl = ?", (crawl,)).scalar()
+
+
+def test_a_crawl_reads_back_as_written(archive):
+    listings = synthetic.search_listings(300)
+    crawl = archive.add(listings, source="London")
+
+    crawls = archive.crawls()
+    assert crawls["crawl"].tolist() == [crawl] and crawls.at[0, "listings"] == 300
+    assert crawls.at[0, "segments"] > 1
+    assert list(chain.from_iterable(archive.iter_crawl(crawl, chunk_size=64))) == listings
+    assert [len(chunk) for chunk in archive.iter_crawl(crawl, chunk_size=64)] == [64, 64, 64, 64, 44]
+
+    for i in (0, 15, 16, 157, 299):
+        assert archive.get(listings[i]["id"]) == listings[i]
+    wanted = [listings[i]["id"] for i in range(0, 300, 7)] + [1]
+    assert archive.get_many(wanted) == {listing["id"]: listing for listing in listings[::7]}
+    assert archive.get(1) is None
+
+
+def test_later_crawls_win_and_earlier_ones_stay_readable(archive):
+    listings = synthetic.search_listings(40)
+    first = archive.add(listings, source="London")
+    changed = [dict(listing, summary="Now reduced") for listing in listings[:10]]
+    second = archive.add(changed, source="London")
+
+    assert archive.latest() == second
+    assert archive.get(listings[3]["id"]) == changed[3]
+    assert archive.get(listings[3]["id"], crawl=first) == listings[3]
+    assert archive.get_many([listings[3]["id"], listings[30]["id"]]) == {
+        listings[3]["id"]: changed[3], listings[30]["id"]: listings[30]}
+    assert archive.history(listings[3]["id"]) == [first, second]
+
+
+def test_a_failed_crawl_leaves_nothing_behind(archive):
+    listings = synthetic.search_listings(200)
+    with pytest.raises(ConnectionError):
+        with archive.writer("London") as writer:
+            writer.write_many(listings)
+            crawl = writer.crawl
+            # the index rows of the first frames have already been written
+            assert _index_rows(archive, crawl) > 0
+            raise ConnectionError("search page timed out")
+
+    assert archive.crawls().empty
+    assert _index_rows(archive, crawl) == 0
+    assert not os.path.exists(os.path.join(archive.root, crawl))
+    assert archive.get(listings[0]["id"]) is None
+    with pytest.raises(KeyError):
+        next(archive.iter_crawl(crawl))
+
+
+def test_a_listing_repeated_within_a_crawl_keeps_its_last_copy(archive):
+    listings = synthetic.search_listings(30)
+    # the same listing on two result pages, with its price changed in between
+    repeated = dict(listings[2], price={**listings[2]["price"], "amount": 1.0})
+    crawl = archive.add(listings + [repeated], source="London")
+
+    assert archive.get(listings[2]["id"]) == repeated
+    assert archive.get_many([listings[2]["id"]]) == {listings[2]["id"]: repeated}
+    assert archive.history(listings[2]["id"]) == [crawl]
+    # the stream is the crawl as scraped, repeats included
+    assert sum(len(chunk) for chunk in archive.iter_crawl(crawl)) == 31
@@ -0,0 +1,65 @@
+# Tests for the scoring service's HTTP handling
+
+# Response output
+import http.client
+import json
+
+# Parallel Processing
+import threading
+
+# Testing
+import pytest
+from rental_utils import service as svc
+
+
+class FailingService:
+    """Stands in for ScoringService: valuations fail the way a bug would."""
+
+    def __init__(self):
+        self.latency = svc.LatencyTracker()
+
+    def value(self, listings):
+        raise RuntimeError("model file is corrupt")
+
+    def rank(self, queries):
+        return [{"budget": q.budget, "listings": []} for q in queries]
+
+
+@pytest.fixture
+def server():
+    service = FailingService()
+    server = svc.make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, service
+    server.shutdown()
+    server.server_close()
+
+
+def _post(server, path, body):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=5)
+    connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    payload = json.loads(response.read())
+    connection.close()
+    return response.status, payload
+
+
+def test_unexpected_errors_answer_500_and_are_timed(server):
+    server, service = server
+
+    status, payload = _post(server, "/value", json.dumps({"listing": {"bedrooms": 2}}))
+
+    assert status == 500
+    assert payload == {"error": "Internal error: RuntimeError"}
+    assert service.latency.summary()["/value"]["count"] == 1
+
+
+def test_bad_requests_answer_400(server):
+    server, service = server
+
+    assert _post(server, "/underpriced", "{not json")[0] == 400
+    assert _post(server, "/underpriced", json.dumps({"queries": [{"k": 3}]}))[0] == 400
+    status, payload = _post(server, "/underpriced", json.dumps({"budget": 900, "k": 3}))
+    assert status == 200 and payload == {"budget": 900.0, "listings": []}
+    assert service.latency.summary()["/underpriced"]["count"] == 3
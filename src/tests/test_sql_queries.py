@@ -0,0 +1,129 @@
+# Tests for the staged bulk writes in sql_queries
+
+# Data Manipulation and Analysis
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# Testing
+from conftest import read_table
+from rental_utils import sql_queries as sqlq
+
+
+def _seed(engine, rows):
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO items (id, price, name) VALUES (:id, :price, :name)"), rows)
+
+
+# BULK UPDATE
+
+def test_bulk_update_overwrites_matching_rows(sqlite_engine, items_table):
+    _seed(sqlite_engine, [{"id": 1, "price": 100.0, "name": "a"}, {"id": 2, "price": 200.0, "name": "b"}])
+    updates = pd.DataFrame({"id": [2, 3], "price": [250.0, 300.0]})
+
+    assert sqlq.bulk_update(items_table, updates, "id", ["price"], sqlite_engine) == 1
+
+    table = read_table(sqlite_engine, items_table)
+    assert table["price"].tolist() == [100.0, 250.0]
+    assert table["name"].tolist() == ["a", "b"]
+
+
+def test_bulk_update_keeps_the_last_row_of_a_repeated_key(sqlite_engine, items_table):
+    _seed(sqlite_engine, [{"id": 1, "price": 100.0, "name": "a"}])
+    updates = pd.DataFrame({"id": [1, 1, 1], "price": [110.0, 120.0, 130.0]})
+
+    assert sqlq.bulk_update(items_table, updates, "id", ["price"], sqlite_engine) == 1
+    assert read_table(sqlite_engine, items_table)["price"].tolist() == [130.0]
+
+
+def test_bulk_update_only_null_leaves_filled_rows(sqlite_engine, items_table):
+    _seed(sqlite_engine, [{"id": 1, "price": None, "name": "a"}, {"id": 2, "price": 200.0, "name": "b"}])
+    updates = pd.DataFrame({"id": [1, 2], "price": [150.0, 999.0]})
+
+    assert sqlq.bulk_update(items_table, updates, "id", ["price"], sqlite_engine, only_null=True) == 1
+    assert read_table(sqlite_engine, items_table)["price"].tolist() == [150.0, 200.0]
+
+
+# BULK LOAD
+
+def _temp_tables(engine):
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT name FROM sqlite_temp_master WHERE type = 'table'")).scalars().all()
+
+
+def test_bulk_load_skips_existing_keys(sqlite_engine, items_table):
+    _seed(sqlite_engine, [{"id": 1, "price": 100.0, "name": "a"}])
+    df = pd.DataFrame({"id": [1, 2, 3], "price": [111.0, 200.0, 300.0], "name": ["x", "b", "c"]})
+
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine) == 2
+
+    table = read_table(sqlite_engine, items_table)
+    assert table["id"].tolist() == [1, 2, 3]
+    # the existing row is left as it was
+    assert table.loc[0, ["price", "name"]].tolist() == [100.0, "a"]
+
+
+def test_bulk_load_upsert_overwrites_existing_keys(sqlite_engine, items_table):
+    _seed(sqlite_engine, [{"id": 1, "price": 100.0, "name": "a"}])
+    df = pd.DataFrame({"id": [1, 2], "price": [111.0, 200.0], "name": ["x", "b"]})
+
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine, upsert=True) == 2
+
+    table = read_table(sqlite_engine, items_table)
+    assert table["price"].tolist() == [111.0, 200.0]
+    assert table["name"].tolist() == ["x", "b"]
+
+
+def test_bulk_load_keeps_the_last_row_of_a_repeated_key(sqlite_engine, items_table):
+    df = pd.DataFrame({"id": [1, 2, 1], "price": [100.0, 200.0, 150.0], "name": ["first", "b", "last"]})
+
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine) == 2
+    assert read_table(sqlite_engine, items_table).loc[0, ["price", "name"]].tolist() == [150.0, "last"]
+
+    # the same holds when upserting over a row that exists
+    df = pd.DataFrame({"id": [1, 1], "price": [160.0, 170.0], "name": ["again", "latest"]})
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine, upsert=True) == 1
+    assert read_table(sqlite_engine, items_table).loc[0, ["price", "name"]].tolist() == [170.0, "latest"]
+
+
+def test_bulk_load_only_loads_the_table_columns(sqlite_engine, items_table):
+    # "scraped_at" is not in the table and "name" is not in the frame
+    df = pd.DataFrame({"scraped_at": ["2024-01-01", "2024-01-02"], "id": [1, 2], "price": [100.0, 200.0]})
+
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine) == 2
+
+    table = read_table(sqlite_engine, items_table)
+    assert list(table.columns) == ["id", "price", "name"]
+    assert table["price"].tolist() == [100.0, 200.0]
+    assert table["name"].isna().all()
+
+    df = pd.DataFrame({"id": [2], "name": ["b"], "extra": [1]})
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine, upsert=True) == 1
+    # an upsert only touches the columns the frame has
+    assert read_table(sqlite_engine, items_table).loc[1, ["price", "name"]].tolist() == [200.0, "b"]
+
+
+def test_bulk_load_stages_in_a_temporary_table(sqlite_engine, items_table):
+    df = pd.DataFrame({"id": [1, 2], "price": ["100", "200.5"], "name": ["a", "b"]})
+
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine, staging="incoming") == 2
+
+    # the staging table takes the target's column types, so text prices are stored as numbers
+    with sqlite_engine.connect() as connection:
+        types = connection.execute(text("SELECT typeof(price) FROM items ORDER BY id")).scalars().all()
+    assert types == ["real", "real"]
+    # and it is dropped once the rows have been moved across
+    assert "incoming" not in _temp_tables(sqlite_engine)
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine, staging="incoming") == 0
+
+
+def test_bulk_load_upsert_with_only_the_key_in_common(sqlite_engine, items_table):
+    _seed(sqlite_engine, [{"id": 1, "price": 100.0, "name": "a"}])
+    df = pd.DataFrame({"id": [1, 2], "scraped_at": ["2024-01-01", "2024-01-02"]})
+
+    # nothing to overwrite, so the existing row is kept and only the new key is inserted
+    assert sqlq.bulk_load(items_table, df, "id", sqlite_engine, upsert=True) == 1
+    table = read_table(sqlite_engine, items_table)
+    assert table["id"].tolist() == [1, 2]
+    assert table.loc[0, ["price", "name"]].tolist() == [100.0, "a"]
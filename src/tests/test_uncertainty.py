@@ -0,0 +1,128 @@
+# Tests for bootstrap error bars and standardised savings
+
+# Data Manipulation and Analysis
+import numpy as np
+import pandas as pd
+
+# Database Connection
+from sqlalchemy import text
+
+# Modelling
+from sklearn.linear_model import LinearRegression
+
+# Testing
+import pytest
+from rental_utils import functions as rent
+from rental_utils import property_queries as pq
+from rental_utils import ranking
+from rental_utils import sql_queries as sqlq
+from rental_utils import uncertainty
+
+
+def test_resample_counts_are_int32_resamples():
+    counts = uncertainty.resample_counts(1000, 7, np.random.default_rng(3))
+
+    assert counts.dtype == np.int32 and counts.shape == (7, 1000)
+    assert (counts.sum(axis=1) == 1000).all()
+    # about 1 - 1/e of the rows turn up in each resample
+    assert np.abs((counts > 0).mean(axis=1) - (1 - np.exp(-1))).max() < 0.05
+
+
+def test_resample_counts_by_row_block_are_resamples():
+    blocks = list(uncertainty.iter_resample_counts(1000, 300, np.random.default_rng(3), row_block=64))
+
+    assert [rows.start for rows, _ in blocks] == list(range(0, 1000, 64))
+    counts = np.hstack([block for _, block in blocks])
+    assert counts.dtype == np.int32 and counts.shape == (300, 1000)
+    assert (counts.sum(axis=1) == 1000).all()
+    # every row is drawn once per replicate on average, in the last (short) block too
+    assert counts.mean() == 1 and abs(counts[:, -40:].mean() - 1) < 0.05
+    assert np.abs((counts > 0).mean(axis=1) - (1 - np.exp(-1))).max() < 0.05
+
+
+def test_bootstrap_ols_matches_the_textbook_standard_errors(monkeypatch):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 2))
+    y = 3 + X @ np.array([2.0, -1.0]) + rng.normal(0, 1.0, 2000)
+
+    boot = uncertainty.bootstrap_ols(X, y, n_boot=400, seed=1)
+
+    fit = LinearRegression().fit(X, y)
+    np.testing.assert_allclose(boot.beta[1:], fit.coef_, rtol=1e-10)
+    # the slopes' standard errors are about sigma / sqrt(n) for unit-variance features
+    assert boot.coefs[:, 1:].std(axis=0) == pytest.approx([1 / np.sqrt(2000)] * 2, rel=0.2)
+
+    # with a small count budget the rows are resampled in blocks of 25, and each
+    # replicate is still the weighted fit on its resample
+    monkeypatch.setattr(uncertainty, "COUNT_BLOCK_BYTES", uncertainty.DRAW_BYTES * 400 * 25)
+    blocked = uncertainty.bootstrap_ols(X, y, n_boot=400, seed=1)
+    counts = np.hstack([block for _, block in
+                        uncertainty.iter_resample_counts(len(X), 400, np.random.default_rng(1), row_block=25)])
+    for replicate in (0, 399):
+        refit = LinearRegression().fit(X, y, sample_weight=counts[replicate])
+        np.testing.assert_allclose(blocked.coefs[replicate, 1:], refit.coef_, rtol=1e-8)
+    assert blocked.coefs[:, 1:].std(axis=0) == pytest.approx([1 / np.sqrt(2000)] * 2, rel=0.2)
+
+
+@pytest.fixture
+def listings():
+    return pd.DataFrame({
+        "id": [1, 2, 3, 4],
+        "price_per_bed": [500.0, 600.0, 900.0, 700.0],
+        "predicted_price_per_bed": [700.0, 650.0, 1000.0, 690.0],
+        "prediction_sd": [100.0, 10.0, 0.0, None],
+        "displayAddress": ["a", "b", "c", "d"],
+        "propertyUrl": ["/a", "/b", "/c", "/d"],
+    })
+
+
+def test_savings_z_matches_the_sql_version(listings, sqlite_engine):
+    z = uncertainty.savings_z(listings)
+    assert z.iloc[:2].tolist() == [2.0, 5.0] and z.iloc[2:].isna().all()
+
+    with sqlite_engine.begin() as connection:
+        connection.execute(text(sqlq.CREATE_TABLE_SQL_QUERY))
+    sqlq.bulk_insert("properties_data", listings[["id", "price_per_bed", "predicted_price_per_bed", "prediction_sd"]],
+                     sqlite_engine)
+    from_sql = pq.PropertyQuery(with_savings=True, by_z_score=True).read(sqlite_engine)["savings_z"]
+    pd.testing.assert_series_equal(from_sql, z, check_names=False)
+
+
+def test_ranking_by_z_score_needs_prediction_sd(listings, capsys):
+    ranked = rent.find_underpriced(listings, user_budget=800, rank_by="savings_z")
+    assert ranked["id"].tolist() == [2, 1, 4]
+    index = ranking.UnderpricedIndex(listings, rank_by="savings_z")
+    assert index.properties["savings_z"].tolist()[:2] == [2.0, 5.0]
+
+    without_sd = listings.drop(columns=["prediction_sd"])
+    with pytest.raises(ValueError, match="prediction_sd"):
+        rent.find_underpriced(without_sd, user_budget=800, rank_by="savings_z")
+    with pytest.raises(ValueError, match="prediction_sd"):
+        ranking.UnderpricedIndex(without_sd, rank_by="savings_z")
+    # ranking by plain savings still works without one
+    assert rent.find_underpriced(without_sd, user_budget=800)["id"].tolist() == [1, 2, 4]
+
+
+def test_savings_z_against_comparables_uses_their_spread(listings):
+    listings["comparable_price_per_bed"] = [800.0, 700.0, 900.0, 750.0]
+    listings["comparable_mad"] = [100.0, 50.0, 0.0, None]
+
+    z = uncertainty.savings_z(listings, "comparable_price_per_bed")
+    assert z.iloc[:2].tolist() == pytest.approx([300 / (100 * uncertainty.MAD_TO_SD), 100 / (50 * uncertainty.MAD_TO_SD)])
+    assert z.iloc[2:].isna().all()
+    ranked = rent.find_underpriced(listings, user_budget=800, reference_col="comparable_price_per_bed",
+                                   rank_by="savings_z")
+    assert ranked["savings_z"].tolist()[:2] == z.iloc[:2].tolist()
+
+    # the prediction's standard deviation says nothing about the comparable price
+    without_mad = listings.drop(columns=["comparable_mad"])
+    with pytest.raises(ValueError, match="comparable_mad"):
+        uncertainty.savings_z(without_mad, "comparable_price_per_bed")
+    with pytest.raises(ValueError, match="comparable_mad"):
+        ranking.UnderpricedIndex(without_mad, rank_by="savings_z", reference_col="comparable_price_per_bed")
+    assert "savings_z" not in rent.find_underpriced(without_mad, user_budget=800,
+                                                    reference_col="comparable_price_per_bed").columns
+
+    # and other references have no spread at all
+    with pytest.raises(ValueError, match="only defined"):
+        uncertainty.savings_z(listings, "priceAmount")